@@ -42,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'writing.request_timing.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
@@ -78,8 +79,19 @@ WSGI_APPLICATION = 'mysite.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # django.db.backends.sqlite3 in WAL mode, see writing/backends/sqlite3/base.py
+        'ENGINE': 'writing.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # keep the connections of the threads for a minute instead of one per request
+        'CONN_MAX_AGE': 60,
+        'OPTIONS': {
+            # seconds a connection waits for the write lock before "database is locked"
+            'timeout': 20,
+        },
+        'TEST': {
+            # a file, not in memory, so that the tests see the WAL mode and the locks of the real database
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -111,7 +123,6 @@ LANGUAGE_CODE = 'en-us'
 TIME_ZONE = 'Asia/Shanghai'
 
 USE_I18N = True
-USE_L10N = True
 
 USE_TZ = True
 
@@ -131,3 +142,28 @@ LOCALE_PATHS = [os.path.join(BASE_DIR,'locale/'), ]
 
 # Allow large request body 10MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10485760
+# The records posted gzipped (see writing/record_upload.py) are not limited by DATA_UPLOAD_MAX_MEMORY_SIZE,
+# but by their decompressed size in chars.
+WRITING_MAX_RECORD_SIZE = 200 * 1024 * 1024
+# The chunks uploaded during an exam (see writing/record_upload.py) which is not submitted are deleted
+# after this many seconds without a new chunk, by `python manage.py run_worker` or `compact_records`.
+WRITING_CHUNK_MAX_AGE_SECONDS = 2 * 24 * 60 * 60
+
+# Run the feature extraction jobs in a thread of the web server.
+# Set it to False and run `python manage.py run_worker` to run them in a separate process.
+WRITING_JOBS_IN_PROCESS = True
+# A job without heartbeat (updated after each batch of records) for this many seconds is marked failed.
+WRITING_JOB_STALE_SECONDS = 10 * 60
+
+# Timing of the requests, see writing/request_timing.py.
+# Number of requests kept in memory for the request timings page of the dashboard.
+WRITING_REQUEST_TIMING_SIZE = 10000
+# Log every request to the 'writing.request_timing' logger.
+WRITING_REQUEST_TIMING_LOG = False
+# Requests slower than this are logged with their slowest queries.
+WRITING_SLOW_REQUEST_SECONDS = 1.0
+
+# Pragmas run on every new SQLite connection, see writing/backends/sqlite3/base.py (WAL mode by default).
+# WRITING_SQLITE_PRAGMAS = {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'temp_store': 'MEMORY', 'cache_size': -20000}
+# Run the writes of the exam views one after the other in a thread, see writing/write_queue.py.
+WRITING_SERIALIZED_WRITES = True
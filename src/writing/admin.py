@@ -1,8 +1,13 @@
 from django.contrib import admin
 
-from .models import WritingExam, WritingRecord, WritingAssignment, TeacherStudentRelation
+from .models import WritingExam, WritingRecord, WritingAssignment, TeacherStudentRelation, ExtractionJob, ReplayIndex, ReplaySegment, RecordChunk, ArchivedWritingRecord
 
 admin.site.register(WritingExam)
 admin.site.register(WritingRecord)
 admin.site.register(WritingAssignment)
 admin.site.register(TeacherStudentRelation)
+admin.site.register(ExtractionJob)
+admin.site.register(ReplayIndex)
+admin.site.register(ReplaySegment)
+admin.site.register(RecordChunk)
+admin.site.register(ArchivedWritingRecord)
@@ -0,0 +1,68 @@
+# coding=utf-8
+""" Helpers of the async views.
+
+Under ASGI, an async view waits for the database and for the write thread (see write_queue.py)
+without holding a thread, so one process holds the many slow uploads of the end of an exam.
+Django 4.2 has the async ORM, but login_required(), require_POST() and get_object_or_404()
+only support async views from Django 5.0: the versions here take both kinds of views.
+
+The sessions and the authentication backends are still sync, so the user is loaded in a thread,
+once per request (request.user is a lazy object).
+"""
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib.auth import decorators as auth_decorators
+from django.contrib.auth.views import redirect_to_login
+from django.http import Http404, HttpResponseNotAllowed
+from django.utils.functional import empty
+from django.views.decorators import http as http_decorators
+
+
+async def aget_user(request):
+    """ Return request.user, loaded from the session in a thread if it's not loaded yet.
+    """
+    user = request.user
+    if getattr(user, '_wrapped', None) is empty:
+        await sync_to_async(user._setup)()
+    return user
+
+
+async def aget_object_or_404(queryset, **kwargs):
+    """ get_object_or_404() with the async ORM. queryset is a QuerySet or a model.
+    """
+    if not hasattr(queryset, 'aget'):
+        queryset = queryset._default_manager.all()
+    try:
+        return await queryset.aget(**kwargs)
+    except queryset.model.DoesNotExist:
+        raise Http404(f'No {queryset.model._meta.object_name} matches the given query.')
+
+
+def login_required(view_func):
+    """ django.contrib.auth.decorators.login_required(), also for async views.
+    """
+    if not iscoroutinefunction(view_func):
+        return auth_decorators.login_required(view_func)
+
+    @wraps(view_func)
+    async def _wrapped_view(request, *args, **kwargs):
+        user = await aget_user(request)
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view_func(request, *args, **kwargs)
+    return _wrapped_view
+
+
+def require_POST(view_func):
+    """ django.views.decorators.http.require_POST(), also for async views.
+    """
+    if not iscoroutinefunction(view_func):
+        return http_decorators.require_POST(view_func)
+
+    @wraps(view_func)
+    async def _wrapped_view(request, *args, **kwargs):
+        if request.method != 'POST':
+            return HttpResponseNotAllowed(['POST'])
+        return await view_func(request, *args, **kwargs)
+    return _wrapped_view
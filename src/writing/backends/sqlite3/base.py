@@ -0,0 +1,39 @@
+# coding=utf-8
+""" The SQLite backend of Django, for many students writing at the same time.
+
+The pragmas of settings.WRITING_SQLITE_PRAGMAS are run on every new connection. The default ones put
+the database in WAL mode, where the readers don't block the writer nor the writer the readers, and
+only sync the WAL at checkpoints, which is safe in WAL mode (a power loss may only lose the last transactions).
+
+The transactions of the write paths are started with BEGIN IMMEDIATE, i.e. they take the write lock at once:
+a transaction which reads and then writes would otherwise fail with "database is locked" without waiting
+for the timeout (see the 'timeout' option in settings.py) when another connection has written in the meantime.
+It's opt-in (see write_queue.immediate_atomic()), so that the read-only transactions don't wait for the writes.
+"""
+from django.conf import settings
+from django.db.backends.sqlite3 import base
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'temp_store': 'MEMORY',
+    # in KiB when negative
+    'cache_size': -20000,
+}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # set by write_queue.immediate_atomic() for the transactions taking the write lock at once
+    immediate_transactions = False
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in getattr(settings, 'WRITING_SQLITE_PRAGMAS', DEFAULT_PRAGMAS).items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        if self.immediate_transactions:
+            self.cursor().execute('BEGIN IMMEDIATE')
+        else:
+            super()._start_transaction_under_autocommit()
@@ -0,0 +1,182 @@
+# coding=utf-8
+""" Benchmarks of the feature extraction on synthetic records (see synthetic.py),
+run by `manage.py benchmark`.
+
+Each result is a dict with the name of the benchmark, the record format and size,
+and the median and minimum seconds of the repeated runs.
+"""
+import json
+import platform
+import random
+import statistics
+import time
+
+import django
+from django.utils import timezone
+
+from .extract_features import EXTRACTOR_VERSION, count_num_of_words, decide_edition_hint, decide_edition_range
+from .feature_engine import FeatureEngine, extract_features_from_chunks
+from .fields import compress_text, iter_stored_text
+from .record_format import dumps, iter_events
+from .synthetic import generate_record
+
+DEFAULT_SIZES = [100, 500, 1000, 2000, 5000]
+# the legacy records grow with the square of the number of words (5000 words are about 200MB of json)
+DEFAULT_MAX_LEGACY_WORDS = 1000
+# decide_edition_range is timed on a sample of the editions, each one keeps two articles in memory
+MAX_SAMPLED_EDITIONS = 500
+# the long essay decide_edition_range is also timed on, editing at random positions
+DEFAULT_ESSAY_CHARS = 20000
+ESSAY_EDITIONS = 2000
+
+
+def time_runs(func, repeat):
+    """ Return (median, min) seconds of repeat calls of func.
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations), min(durations)
+
+
+def _result(name, record_format, num_of_words, num_of_events, seconds, **extra):
+    median, minimum = seconds
+    result = {
+        'benchmark': name,
+        'format': record_format,
+        'words': num_of_words,
+        'events': num_of_events,
+        'seconds': median,
+        'seconds_min': minimum,
+        'us_per_event': median / num_of_events * 1e6 if num_of_events else None,
+    }
+    result.update(extra)
+    return result
+
+
+def benchmark_record(record, article, record_format, num_of_words, repeat):
+    text = dumps(record)
+    num_of_events = len(record['sequences'])
+    results = []
+
+    seconds = time_runs(lambda: extract_features_from_chunks([text], article, -1), repeat)
+    results.append(_result('extract_features', record_format, num_of_words, num_of_events, seconds, record_chars=len(text)))
+
+    # as the batch extraction does it, from the compressed record
+    stored = compress_text(text)
+    seconds = time_runs(lambda: extract_features_from_chunks(iter_stored_text(stored), article, -1), repeat)
+    results.append(_result('extract_features_stored', record_format, num_of_words, num_of_events, seconds, stored_bytes=len(stored)))
+
+    step = max(1, num_of_events // MAX_SAMPLED_EDITIONS)
+    editions = []
+    prev_article = ''
+    for i, event in enumerate(iter_events(record)):
+        if i % step == 0:
+            editions.append((prev_article, event['article'], decide_edition_hint(event, len(prev_article), len(event['article']))))
+        prev_article = event['article']
+    for name, hinted in [('decide_edition_range', False), ('decide_edition_range_hinted', True)]:
+        def run():
+            for prev_article, cur_article, hint in editions:
+                decide_edition_range(prev_article, cur_article, hint if hinted else None)
+        results.append(_result(name, record_format, num_of_words, len(editions), time_runs(run, repeat)))
+    return results
+
+
+def benchmark_plugins(record, article, record_format, num_of_words):
+    """ Return the results of the feature plugins and of the decoding of the editions.
+    """
+    timings = {}
+    FeatureEngine().extract([dumps(record)], article, -1, timings)
+    num_of_events = len(record['sequences'])
+    return [
+        _result(f'plugin:{name}', record_format, num_of_words, num_of_events, (seconds, seconds))
+        for name, seconds in timings.items()
+    ]
+
+
+def benchmark_essay_editions(num_of_chars, repeat, seed=0):
+    """ Return the results of decide_edition_range without hint, with a verified hint and with a trusted one,
+    on a long essay edited at random positions (the worst case without hint is editing near the middle).
+    """
+    rnd = random.Random(seed)
+    article = ''.join(rnd.choice('abcdefghijklmnopqrstuvwxyz    ,.') for _ in range(num_of_chars))
+    num_of_words = count_num_of_words(article)
+    editions = []
+    for _ in range(ESSAY_EDITIONS):
+        start = rnd.randint(0, len(article) - 1)
+        if rnd.random() < 0.8:
+            new_article = article[:start] + 'x' + article[start:]
+            hint = (start, start, 1)
+        else:
+            new_article = article[:start] + article[start+1:]
+            hint = (start, start + 1, 0)
+        editions.append((article, new_article, hint))
+        article = new_article
+
+    results = []
+    for name, hint_mode in [
+        ('decide_edition_range', None),
+        ('decide_edition_range_hinted', 'verified'),
+        ('decide_edition_range_trusted', 'trusted'),
+    ]:
+        def run():
+            for prev_article, cur_article, hint in editions:
+                decide_edition_range(prev_article, cur_article, hint if hint_mode else None,
+                                     verify_hint=hint_mode != 'trusted')
+        results.append(_result(name, 'essay', num_of_words, len(editions), time_runs(run, repeat), article_chars=num_of_chars))
+    return results
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, repeat=3, max_legacy_words=DEFAULT_MAX_LEGACY_WORDS, seed=0, log=None,
+                   essay_chars=DEFAULT_ESSAY_CHARS):
+    """ Return the benchmark report as a dict.
+    """
+    results = []
+    for num_of_words in sizes:
+        record, article = generate_record(num_of_words, seed=seed)
+        formats = [('compact', record)]
+        if num_of_words <= max_legacy_words:
+            formats.append(('legacy', generate_record(num_of_words, seed=seed, legacy=True)[0]))
+        for record_format, formatted_record in formats:
+            if log is not None:
+                log(f'{num_of_words} words, {record_format} format')
+            results.extend(benchmark_record(formatted_record, article, record_format, num_of_words, repeat))
+        results.extend(benchmark_plugins(record, article, 'compact', num_of_words))
+        seconds = time_runs(lambda: count_num_of_words(article), repeat)
+        results.append(_result('count_num_of_words', 'article', num_of_words, 0, seconds, article_chars=len(article)))
+    if essay_chars:
+        if log is not None:
+            log(f'{essay_chars} chars essay')
+        results.extend(benchmark_essay_editions(essay_chars, repeat, seed=seed))
+
+    return {
+        'created': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'platform': platform.platform(),
+        'extractor_version': EXTRACTOR_VERSION,
+        'seed': seed,
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def compare_reports(report, baseline):
+    """ Yield (result, baseline seconds, ratio) for the results of report also in baseline,
+    ratio being the slowdown.
+    """
+    def key(result):
+        return result['benchmark'], result['format'], result['words']
+
+    baseline_seconds = {key(result): result['seconds'] for result in baseline['results']}
+    for result in report['results']:
+        before = baseline_seconds.get(key(result))
+        if before:
+            yield result, before, result['seconds'] / before
+
+
+def load_report(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
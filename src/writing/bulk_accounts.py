@@ -0,0 +1,117 @@
+# coding=utf-8
+""" Create many student or teacher accounts at once.
+
+Hashing the passwords is by far the slowest part, so it's done by a pool of processes
+for each import, and the rows are inserted with a few bulk_create in one transaction.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, User
+from django.db import IntegrityError, transaction
+
+from .models import TeacherStudentRelation
+from .roles import TEACHER
+
+# below this number of passwords, the pool costs more than it saves
+MIN_PASSWORDS_FOR_POOL = 8
+
+
+def hash_passwords(passwords, workers=None):
+    """ Return the hashes of the passwords, computed by a pool of `workers` processes
+    which only lives during the call.
+
+    The processes are spawned rather than forked, so that they don't inherit the database connections
+    and the threads of a web server process.
+    """
+    workers = min(workers or os.cpu_count() or 1, len(passwords))
+    if workers <= 1 or len(passwords) < MIN_PASSWORDS_FOR_POOL:
+        return [make_password(password) for password in passwords]
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=django.setup) as pool:
+            return list(pool.map(make_password, passwords, chunksize=max(1, len(passwords) // (workers * 4))))
+    except BrokenProcessPool:
+        # e.g. a process of the pool was killed
+        return [make_password(password) for password in passwords]
+
+
+def _existing_usernames(usernames):
+    return set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+
+
+def create_users(accounts, teacher=None, group=None, workers=None):
+    """ Create the users of accounts, a list of (username, password, first_name),
+    which do not exist yet. Existing usernames are left untouched.
+    The usernames are normalized as User.objects.create_user() does.
+
+    The new users are assigned to the teacher and added to the group if given.
+    Return (the number of created users, the sorted list of the skipped existing usernames).
+    """
+    # keep the first account of each username
+    new_accounts = {}
+    for username, password, first_name in accounts:
+        new_accounts.setdefault(User.normalize_username(username), (password, first_name))
+    skipped = _existing_usernames(list(new_accounts))
+    usernames = [username for username in new_accounts if username not in skipped]
+    if not usernames:
+        return 0, sorted(skipped)
+
+    hashed_passwords = dict(zip(usernames, hash_passwords([new_accounts[username][0] for username in usernames], workers)))
+
+    while usernames:
+        try:
+            with transaction.atomic():
+                _insert_users(usernames, new_accounts, hashed_passwords, teacher, group)
+            break
+        except IntegrityError:
+            # some of the usernames were created meanwhile, e.g. by another import: skip them too
+            created_meanwhile = _existing_usernames(usernames)
+            if not created_meanwhile:
+                raise
+            skipped |= created_meanwhile
+            usernames = [username for username in usernames if username not in created_meanwhile]
+    return len(usernames), sorted(skipped)
+
+
+def _insert_users(usernames, new_accounts, hashed_passwords, teacher, group):
+    User.objects.bulk_create([
+        User(username=username, password=hashed_passwords[username], first_name=new_accounts[username][1])
+        for username in usernames
+    ])
+    user_ids = list(User.objects.filter(username__in=usernames).values_list('pk', flat=True))
+    if teacher is not None:
+        TeacherStudentRelation.objects.bulk_create([
+            TeacherStudentRelation(teacher=teacher, student_id=user_id) for user_id in user_ids
+        ])
+    if group is not None:
+        User.groups.through.objects.bulk_create([
+            User.groups.through(user_id=user_id, group_id=group.pk) for user_id in user_ids
+        ])
+
+
+def create_student_accounts(teacher, student_ids, workers=None):
+    """ Create the accounts of the students of a teacher.
+    The username is <teacher username>_<student id>, and the password and the first name are the student id.
+    Return (the number of created accounts, the skipped existing usernames), see create_users().
+    """
+    return create_users(
+        [(f'{teacher.username}_{sid}', str(sid), str(sid)) for sid in student_ids],
+        teacher=teacher,
+        workers=workers,
+    )
+
+
+def create_teacher_accounts(teacher_ids, workers=None):
+    """ Create the accounts of teachers, whose username and password are the teacher id.
+    Return (the number of created accounts, the skipped existing usernames), see create_users().
+    """
+    return create_users(
+        [(tid, str(tid), '') for tid in teacher_ids],
+        group=Group.objects.get(name=TEACHER),
+        workers=workers,
+    )
@@ -0,0 +1,143 @@
+# coding=utf-8
+""" An article edited by deltas, without copying the whole text at each edition.
+
+Document is a rope of one level: the text is cut into blocks of about BLOCK_SIZE chars,
+and a Fenwick tree over the lengths of the blocks finds the block of a position in
+O(log(number of blocks)). replace() only rebuilds the blocks it touches (and the tree when
+the number of blocks changes), so an edition costs O(BLOCK_SIZE + log n) instead of O(n).
+
+A Document reads like a str: len(), document[i] and document[start:end] (a str) work as
+on the text, and str(document) is the whole text.
+"""
+
+BLOCK_SIZE = 512
+
+
+def split_blocks(text):
+    return [text[i:i+BLOCK_SIZE] for i in range(0, len(text), BLOCK_SIZE)]
+
+
+class FenwickTree:
+    """ Prefix sums of a list of numbers, updated in O(log n).
+    """
+    __slots__ = ('tree',)
+
+    def __init__(self, values):
+        tree = [0] + list(values)
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self.tree = tree
+
+    def add(self, i, delta):
+        i += 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix_sum(self, n):
+        """ Sum of the first n values.
+        """
+        total = 0
+        while n > 0:
+            total += self.tree[n]
+            n -= n & -n
+        return total
+
+    def search(self, value):
+        """ Return the largest n such that the sum of the first n values is <= value (the values are >= 0).
+        """
+        n = 0
+        step = 1 << (len(self.tree) - 1).bit_length()
+        while step:
+            if n + step < len(self.tree) and self.tree[n + step] <= value:
+                n += step
+                value -= self.tree[n]
+            step >>= 1
+        return n
+
+
+class Document:
+    __slots__ = ('blocks', 'lengths', 'length')
+
+    def __init__(self, text=''):
+        self._build(split_blocks(text))
+
+    def _build(self, blocks):
+        self.blocks = blocks
+        self.lengths = FenwickTree(len(block) for block in blocks)
+        self.length = sum(len(block) for block in blocks)
+
+    def _replace_in_block(self, j, start, end, text):
+        """ Replace the chars from start to end of the block j by text, which doesn't empty it.
+        """
+        block = self.blocks[j]
+        self.blocks[j] = block[:start] + text + block[end:]
+        self.lengths.add(j, len(text) - (end - start))
+
+    def __len__(self):
+        return self.length
+
+    def __str__(self):
+        return ''.join(self.blocks)
+
+    def _locate(self, position):
+        """ Return (j, offset) such that position is at offset in the block j (offset can be the length of the last block).
+        """
+        j = self.lengths.search(position)
+        if j == len(self.blocks):
+            j -= 1
+        return j, position - self.lengths.prefix_sum(j)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, end, step = key.indices(len(self))
+            if step != 1:
+                raise ValueError('Document slices have no step')
+            return self.slice(start, end)
+        length = len(self)
+        if key < 0:
+            key += length
+        if not 0 <= key < length:
+            raise IndexError('Document index out of range')
+        j, offset = self._locate(key)
+        return self.blocks[j][offset]
+
+    def slice(self, start, end):
+        """ Return the text from start to end (0 <= start, end <= len(self)).
+        """
+        if start >= end:
+            return ''
+        j, offset = self._locate(start)
+        pieces = []
+        length = end - start
+        while length > 0:
+            piece = self.blocks[j][offset:offset+length]
+            pieces.append(piece)
+            length -= len(piece)
+            j += 1
+            offset = 0
+        return ''.join(pieces)
+
+    def replace(self, start, end, text):
+        """ Replace the text from start to end by text.
+        """
+        if not self.blocks:
+            self._build(split_blocks(text))
+            return
+        if not 0 <= start <= end <= self.length:
+            raise ValueError(f'Invalid range [{start}, {end}) of a document of {self.length} chars')
+        j1, offset1 = self._locate(start)
+        j2, offset2 = self._locate(end)
+        if offset2 == 0 and j2 > j1:
+            # end at the beginning of a block is the end of the previous one
+            j2 -= 1
+            offset2 = len(self.blocks[j2])
+        if j1 == j2 and 0 < len(self.blocks[j1]) + len(text) - (offset2 - offset1) <= 2 * BLOCK_SIZE:
+            # the usual case: a small edition inside a block
+            self._replace_in_block(j1, offset1, offset2, text)
+            self.length += len(text) - (end - start)
+        else:
+            content = self.blocks[j1][:offset1] + text + self.blocks[j2][offset2:]
+            self._build(self.blocks[:j1] + split_blocks(content) + self.blocks[j2+1:])
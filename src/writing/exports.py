@@ -0,0 +1,139 @@
+# coding=utf-8
+""" Exports of the extracted features, streamed so that the memory does not grow with the number of records.
+"""
+import json
+import zlib
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.db.models import Exists, OuterRef, Subquery
+
+from .models import WritingRecord
+
+# size of the chunks sent to the client
+CHUNK_SIZE = 64 * 1024
+# number of rows fetched at once by afeatures_rows()
+ROWS_CHUNK_SIZE = 2000
+
+
+def _features_queryset():
+    """ The (username, features json) of the last record with features of each user,
+    in the order of the first record with features of the users.
+
+    The download used to be a dict {username: features}, filled with the records in the order of their pk:
+    a user with several records appears once, where their first record is, with the features of the last one.
+    """
+    records = WritingRecord.objects.filter(user__isnull=False).exclude(features='')
+    later_records = records.filter(user=OuterRef('user'), pk__gt=OuterRef('pk'))
+    first_record = records.filter(user=OuterRef('user')).order_by('pk').values('pk')[:1]
+    return records.exclude(Exists(later_records)).annotate(
+        first_pk=Subquery(first_record)
+    ).order_by('first_pk').values_list('user__username', 'features')
+
+
+def features_rows():
+    """ Yield (username, features json) of the users with extracted features for the json download,
+    see _features_queryset().
+    Only these two columns are read from the database.
+    """
+    return _features_queryset().iterator()
+
+
+def record_features_rows():
+    """ Yield (record id, exam id, username, features json) of every record with extracted features,
+    in the order of the records, for the summary table (one row per record, see feature_summary.py).
+    """
+    return WritingRecord.objects.filter(user__isnull=False).exclude(features='').order_by('pk').values_list(
+        'pk', 'exam_id', 'user__username', 'features'
+    ).iterator()
+
+
+async def afeatures_rows():
+    """ features_rows() as an async iterator.
+
+    The rows are fetched in chunks in a thread, as QuerySet.aiterator() does: in Django 4.2,
+    aiterator() runs the query of a values_list() in the event loop, which raises SynchronousOnlyOperation.
+    """
+    rows = features_rows()
+    next_rows = sync_to_async(lambda: list(islice(rows, ROWS_CHUNK_SIZE)))
+    while True:
+        chunk = await next_rows()
+        for row in chunk:
+            yield row
+        if len(chunk) < ROWS_CHUNK_SIZE:
+            break
+
+
+class _FeaturesJsonBuffer:
+    """ The text of the json object {username: features, ...}, taken out in chunks of about CHUNK_SIZE chars.
+
+    The features are already stored as json, so they are copied into the output as they are.
+    """
+    __slots__ = ('pieces', 'size', 'separator')
+
+    def __init__(self):
+        self.pieces = ['{']
+        self.size = 1
+        self.separator = ''
+
+    def add(self, username, features):
+        """ Add a record, return a chunk if the buffer is full, else None.
+        """
+        piece = f'{self.separator}{json.dumps(username)}: {features}'
+        self.pieces.append(piece)
+        self.size += len(piece)
+        self.separator = ', '
+        if self.size < CHUNK_SIZE:
+            return None
+        chunk = ''.join(self.pieces)
+        self.pieces = []
+        self.size = 0
+        return chunk
+
+    def close(self):
+        self.pieces.append('}')
+        return ''.join(self.pieces)
+
+
+def iter_features_json(rows):
+    """ Yield the json object {username: features, ...} as text chunks.
+    """
+    buffer = _FeaturesJsonBuffer()
+    for username, features in rows:
+        chunk = buffer.add(username, features)
+        if chunk is not None:
+            yield chunk
+    yield buffer.close()
+
+
+async def aiter_features_json(rows):
+    """ iter_features_json() of an async iterator.
+    """
+    buffer = _FeaturesJsonBuffer()
+    async for username, features in rows:
+        chunk = buffer.add(username, features)
+        if chunk is not None:
+            yield chunk
+    yield buffer.close()
+
+
+def iter_gzip(chunks):
+    """ Compress text chunks into a gzip stream.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+async def aiter_gzip(chunks):
+    """ iter_gzip() of an async iterator.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
@@ -1,10 +1,29 @@
 # coding=utf-8
-import json
+import hashlib
 import re
 
 from .models import WritingRecord
 
-def decide_edition_range(prev_article, cur_article):
+# Bump it whenever a change of extract_features() changes its results:
+# the features cached in WritingRecord.features are then extracted again.
+EXTRACTOR_VERSION = 1
+
+
+def features_fingerprint(record, article):
+    """ Return the fingerprint of the features extracted from a record and an article by this version.
+    The record can also be given as an iterable of text chunks.
+    """
+    if isinstance(record, str):
+        record = [record]
+    digest = hashlib.sha256()
+    for chunk in record:
+        digest.update(chunk.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(article.encode('utf-8'))
+    return f'{EXTRACTOR_VERSION}:{digest.hexdigest()}'
+
+
+def decide_edition_range(prev_article, cur_article, hint=None, verify_hint=True):
     """ Return s1, e1, s2, e2 (the position after the edition).
     Note that each time, we only insert at most one character (because of the keyinput event listener).
 
@@ -37,121 +56,127 @@ def decide_edition_range(prev_article, cur_article):
             'a|bc|d' -> 'ac|d' select and insert one same char in the middle, check the inputtype if it's delete or insert. 
                             This current implementation considers it as deleting b without selection.
             'a|c|d' -> 'ac|d' s1 = e1 = s2 = e2 = 3. Currently considered as deleting with selection.
-    """
-    s1 = s2 = e1 = e2 = -1
 
+    hint is an optional (start, end, length) claiming that
+    cur_article == prev_article[:start] + <length chars> + prev_article[end:], e.g. from decide_edition_hint().
+    A correct hint locates the edition without scanning the articles: we only extend it to the exact
+    (s1, e1, s2, e2) defined above, which usually takes a few characters.
+    The hint is checked with two slice comparisons unless verify_hint is False
+    (only use that when cur_article was built from the hint, e.g. compact records).
+    Wrong hints are ignored. The result is always the same as without hint.
+    """
     if prev_article is None or len(prev_article) == 0:
         # start from the scratch
-        s1 = e1 = s2 = 0
-        e2 = len(cur_article)
-        return s1, e1, s2, e2
-    else:
-        # because the edition is continuous, so we only need to find the first and second different positions.
-        prev_i = cur_i = 0
-        while prev_i < len(prev_article) and cur_i < len(cur_article):
-            prev_char = prev_article[prev_i]
-            cur_char = cur_article[cur_i]
-
-            if prev_char != cur_char:
-                if s1 == -1:
-                    s1 = prev_i
-                    s2 = cur_i
-                    break
-            prev_i += 1
-            cur_i += 1
-
-        if s1 == -1:
-            s1 = s2 = prev_i  # prev_i == cur_i == min(len(prev_article), len(cur_article))
-        
-        if s1 == len(prev_article) or s2 == len(cur_article):
-            e1 = len(prev_article)
-            e2 = len(cur_article)
-
-            assert prev_article[0:s1] == cur_article[0:s2] and prev_article[e1:] == cur_article[e2:]
-            assert s1 == s2 and len(prev_article)-e1 == len(cur_article)-e2
-            return s1, e1, s2, e2
-
-        # now we know prev_article[0:s1] == cur_article[0:s2]
-        # so we need to find e1 and e2 st prev_article[e1:] == cur_article[e2:]
-        # Note that cur_articel can be considered as 
-        #   1) deleting a substring (empty or the whole string) from prev_article
-        #   2) (optional) add ONE char at s2
-        # So we can try to find the common suffix e1 and e2 in prev_article[s1:] and cur_article[s2:] (for delete) or cur_article[s2+1:] (for insertion)
-        prev_i = len(prev_article) - 1
-        cur_i = len(cur_article) - 1
-        while prev_i >= s1 and cur_i >= s2:
-            prev_char = prev_article[prev_i]
-            cur_char = cur_article[cur_i]
-
-            if prev_char != cur_char:
-                if e1 == -1:
-                    e1 = prev_i + 1
-                    e2 = cur_i + 1
-                    break
-            prev_i -= 1
-            cur_i -= 1
-
-        if e1 == -1:
-            e1 = prev_i + 1
-            e2 = cur_i + 1
-        
-        assert prev_article[0:s1] == cur_article[0:s2] and prev_article[e1:] == cur_article[e2:]
-        assert s1 == s2 and len(prev_article)-e1 == len(cur_article)-e2
-        return s1, e1, s2, e2
-
-        
-def test_decide_edition_range():
-    s1, e1, s2, e2 = decide_edition_range('abcd', 'abcde')
-    print(s1, e1, s2, e2)
-    assert s1 == 4 and e1 == 4 and s2 == 4 and e2 == 5
-    s1, e1, s2, e2 = decide_edition_range('abcd', 'abc')
-    print(s1, e1, s2, e2)
-    assert s1 == 3 and e1 == 4 and s2 == 3 and e2 == 3
-
-    s1, e1, s2, e2 = decide_edition_range('abcd', 'eabcd')
-    print(s1, e1, s2, e2)
-    assert s1 == 0 and e1 == 0 and s2 == 0 and e2 == 1
-
-    s1, e1, s2, e2 = decide_edition_range('abcd', 'bcd')
-    print(s1, e1, s2, e2)
-    assert s1 == 0 and e1 == 1 and s2 == 0 and e2 == 0
-
-    s1, e1, s2, e2 = decide_edition_range('abcd', 'abced')
-    print(s1, e1, s2, e2)
-    assert s1 == 3 and e1 == 3 and s2 == 3 and e2 == 4
-
-    s1, e1, s2, e2 = decide_edition_range('abcd', 'abd')
-    print(s1, e1, s2, e2)
-    assert s1 == 2 and e1 == 3 and s2 == 2 and e2 == 2
-
-    s1, e1, s2, e2 = decide_edition_range('abcd', 'abe')
-    print(s1, e1, s2, e2)
-    assert s1 == 2 and e1 == 4 and s2 == 2 and e2 == 3
-
-    s1, e1, s2, e2 = decide_edition_range('abcd', 'ab')
-    print(s1, e1, s2, e2)
-    assert s1 == 2 and e1 == 4 and s2 == 2 and e2 == 2
-
-    s1, e1, s2, e2 = decide_edition_range('abcd', 'aed')
-    print(s1, e1, s2, e2)
-    assert s1 == 1 and e1 == 3 and s2 == 1 and e2 == 2
-
-    s1, e1, s2, e2 = decide_edition_range('abcd', 'ad')
-    print(s1, e1, s2, e2)
-    assert s1 == 1 and e1 == 3 and s2 == 1 and e2 == 1
-
-    s1, e1, s2, e2 = decide_edition_range('abcd', 'ecd')
-    print(s1, e1, s2, e2)
-    assert s1 == 0 and e1 == 2 and s2 == 0 and e2 == 1
-
-    s1, e1, s2, e2 = decide_edition_range('abcd', 'cd')
-    print(s1, e1, s2, e2)
-    assert s1 == 0 and e1 == 2 and s2 == 0 and e2 == 0
-
-    s1, e1, s2, e2 = decide_edition_range('acd', 'acd')
-    print(s1, e1, s2, e2)
-    assert s1 == 3 and e1 == 3 and s2 == 3 and e2 == 3
-    
+        return 0, 0, 0, len(cur_article)
+
+    len1 = len(prev_article)
+    len2 = len(cur_article)
+
+    prefix_length = None
+    if hint is not None:
+        start, end, length = hint
+        if (0 <= start <= end <= len1 and len2 == len1 - (end - start) + length and
+                (not verify_hint or (
+                    prev_article[:start] == cur_article[:start] and
+                    prev_article[end:] == cur_article[start+length:]))):
+            prefix_length = common_prefix_length(prev_article, cur_article, start)
+            suffix_known = len1 - end
+    if prefix_length is None:
+        prefix_length = common_prefix_length(prev_article, cur_article)
+        suffix_known = 0
+
+    s1 = s2 = prefix_length
+    if s1 == len1 or s2 == len2:
+        return s1, len1, s2, len2
+
+    # now we know prev_article[0:s1] == cur_article[0:s2]
+    # so we need to find e1 and e2 st prev_article[e1:] == cur_article[e2:],
+    # and the common suffix must not overlap the common prefix
+    suffix_limit = min(len1 - s1, len2 - s2)
+    suffix_length = common_suffix_length(prev_article, cur_article, min(suffix_known, suffix_limit), suffix_limit)
+    return s1, len1 - suffix_length, s2, len2 - suffix_length
+
+
+def common_prefix_length(a, b, start=0):
+    """ Return the length of the common prefix of a and b, knowing that a[:start] == b[:start].
+
+    It compares slices of growing sizes instead of single characters,
+    and binary searches the first different character in the first different slice.
+    """
+    n = min(len(a), len(b))
+    i = start
+    step = 8
+    while i < n:
+        j = min(i + step, n)
+        if a[i:j] == b[i:j]:
+            i = j
+            step *= 2
+            continue
+        # the first different char is in [i, j)
+        while j - i > 1:
+            mid = (i + j) // 2
+            if a[i:mid] == b[i:mid]:
+                i = mid
+            else:
+                j = mid
+        return i
+    return n
+
+
+def common_suffix_length(a, b, start=0, limit=None):
+    """ Return the length of the common suffix of a and b (at most limit), knowing that it's at least start.
+    """
+    len_a = len(a)
+    len_b = len(b)
+    n = min(len_a, len_b) if limit is None else limit
+    i = start
+    step = 8
+    while i < n:
+        j = min(i + step, n)
+        if a[len_a-j:len_a-i] == b[len_b-j:len_b-i]:
+            i = j
+            step *= 2
+            continue
+        # the last different char is in [i, j) counted from the end
+        while j - i > 1:
+            mid = (i + j) // 2
+            if a[len_a-mid:len_a-i] == b[len_b-mid:len_b-i]:
+                i = mid
+            else:
+                j = mid
+        return i
+    return n
+
+
+def decide_edition_hint(event, prev_length, cur_length):
+    """ Guess (start, end, length) of an event for decide_edition_range().
+
+    Compact events carry the exact edition.
+    For legacy events, 'position' is the caret position after the edition minus one, and
+    the selection is used when the browser reported it. Return None when nothing can be guessed.
+    """
+    if 'edit' in event:
+        start, end, text = event['edit']
+        return start, end, len(text)
+
+    select_start = event.get('selectStart', -1)
+    select_end = event.get('selectEnd', -1)
+    if select_start is not None and select_end is not None and 0 <= select_start < select_end:
+        return select_start, select_end, cur_length - prev_length + (select_end - select_start)
+
+    position = event.get('position')
+    if position is None:
+        return None
+    caret = position + 1
+    diff = cur_length - prev_length
+    if diff > 0:
+        # insertion, the caret is after the inserted chars
+        return caret - diff, caret - diff, diff
+    elif diff < 0:
+        # deletion, the caret is where the deleted chars were
+        return caret, caret - diff, 0
+    return None
+
 
 def decide_operation_type(s1, e1, s2, e2):
     op_type = 'unknown'
@@ -178,10 +203,16 @@ def count_num_of_words(article):
     return len([x for x in re.split(r'[,.?!;:\s]\s*', article) if len(x)>0])
 
 
-def count_num_of_deleted_words(deletion, preceding_content, subsequent_content):
-    sep = ' \t\n\r\f\v' + ',.?!;:'
+WORD_SEPARATORS = ' \t\n\r\f\v' + ',.?!;:'
+
+
+def count_num_of_partial_words(first_char, last_char, preceding_content, subsequent_content):
+    """ Return the number of incomplete words (0, 1 or 2) at the edges of a content from first_char to last_char.
+    Only the last char of preceding_content and the first one of subsequent_content matter.
+    """
+    sep = WORD_SEPARATORS
     subtraction = 0
-    if deletion[0] not in sep:
+    if first_char not in sep:
         # the first deleted word may not be complete
         if not preceding_content:
             # preceding_content is empty
@@ -192,14 +223,18 @@ def count_num_of_deleted_words(deletion, preceding_content, subsequent_content):
             if preceding_content[-1] not in sep:
                 # the first deleted word is not complete
                 subtraction += 1
-    if deletion[-1] not in sep:
+    if last_char not in sep:
         # the last may not be complete
         if not subsequent_content:
             pass
         else:
             if subsequent_content[0] not in sep:
                 subtraction += 1
+    return subtraction
+
 
+def count_num_of_deleted_words(deletion, preceding_content, subsequent_content):
+    subtraction = count_num_of_partial_words(deletion[0], deletion[-1], preceding_content, subsequent_content)
     return max(count_num_of_words(deletion)-subtraction, 0)
 
 
@@ -218,294 +253,9 @@ def count_num_of_jump_words(content, preceding_content, subsequent_content):
 def extract_features(writing_record):
     if not writing_record.record:
         return None
-
-    score = writing_record.score
-    record = json.loads(writing_record.record)
-    article = writing_record.article
-    start_time = record['startTime']
-    event_sequence = record['sequences']
-    submit_time = record['submitTime']
-    # num_of_words = len(article.split())
-    num_of_words = count_num_of_words(article)
-
-    if len(event_sequence) > 0:
-        planning_time = event_sequence[0]['time'] - start_time
-    
-    writing_time = submit_time - event_sequence[0]['time']
-
-    within_a_word_pause_list = []
-    between_words_pause_list =[]
-    between_paragraphs_pause_list = []
-    between_sentences_pause_list = []
-
-    last_in_word_timestamp = None
-    last_between_word_timestamp = None
-    last_paragraph_timestamp = None
-    last_sentence_timestamp = None
-
-    sequential_deleted_content = ''
-    sequential_deletion_length_list = []
-    preceding_deletion_content = ''
-    subsequent_deletion_content = ''
-    sequential_deletion_time = None
-    sequential_deletion_time_list = []
-
-    # sequential insertion means typing without pausing more than 2s (2000ms)
-    sequential_inserted_content = ''
-    sequential_insertion_length_list = []
-    preceding_insertion_content = ''
-    subsequent_insertion_content = ''
-    sequential_insertion_time = None
-    sequential_insertion_time_list = []
-
-    jump_length_list = []
-    jump_time_list = []
-
-    last_position = -1  # if last edition includes selection, it points to the end of the selection.
-    prev_article = ''
-    pre_sequential_char_insertion_timestamp = None
-
-    def handle_insertion():
-        nonlocal sequential_deleted_content
-        nonlocal sequential_deletion_time
-        nonlocal last_in_word_timestamp
-        nonlocal last_between_word_timestamp
-        nonlocal last_paragraph_timestamp
-        nonlocal last_sentence_timestamp
-        nonlocal pre_sequential_char_insertion_timestamp
-        nonlocal sequential_inserted_content
-        nonlocal sequential_insertion_time
-        nonlocal preceding_insertion_content
-        nonlocal subsequent_insertion_content
-
-        if sequential_deleted_content:
-            sequential_deletion_length_list.append(count_num_of_deleted_words(sequential_deleted_content, preceding_deletion_content, subsequent_deletion_content))
-            sequential_deletion_time_list.append(timestamp-sequential_deletion_time)
-        sequential_deleted_content = ''  # reset the deletion
-        sequential_deletion_time = None
-
-        if current_position != last_position+1:
-            # The editing position is not continuous
-            last_in_word_timestamp = None
-            last_between_word_timestamp = None
-            last_paragraph_timestamp = None
-            last_sentence_timestamp = None
-            pre_sequential_char_insertion_timestamp = None
-
-            sequential_inserted_content = ''
-            sequential_insertion_time = None
-
-            # handle jump edition
-            if current_position < last_position:
-                jump_length_list.append(count_num_of_jump_words(
-                    prev_article[end1:last_position+1],
-                    prev_article[:end1],
-                    prev_article[last_position+1:]
-                ))
-                jump_time_list.append(timestamp-prev_timestamp)
-            
-        else:
-            # only record sequential insertion when it's a continuous insertion and a long pause
-            if is_long_pause:
-                # end of a typing chunk so record it
-                if sequential_inserted_content:
-                    subsequent_insertion_content = prev_article[end1:]  # only the latest subsequent content matters.
-                    sequential_insertion_length_list.append(count_num_of_inserted_words(sequential_inserted_content, preceding_insertion_content, subsequent_insertion_content))
-                    sequential_insertion_time_list.append(timestamp-sequential_insertion_time)
-                # start a new typing chunk
-                sequential_inserted_content = cur_content
-                sequential_insertion_time = timestamp
-                preceding_insertion_content = prev_article[:start1]
-                
-            else:
-                if sequential_inserted_content:
-                    # within a typing chunk, so append the inserted content
-                    sequential_inserted_content = sequential_inserted_content + cur_content            
-
-        if cur_content == ' ':
-            # begin a new word (usually for between in word pause)
-            last_in_word_timestamp = None
-        elif cur_content in ',.?!;:':
-            # separated by punctuation
-            last_in_word_timestamp = None
-            last_between_word_timestamp = None
-            last_paragraph_timestamp = None
-            if last_sentence_timestamp is None and pre_sequential_char_insertion_timestamp is not None:
-                # assert pre_sequential_char_insertion_timestamp is not None
-                last_sentence_timestamp = pre_sequential_char_insertion_timestamp
-        elif cur_content == '\n':
-            # begin a new paragraph
-            last_in_word_timestamp = None
-            last_between_word_timestamp = None
-            last_sentence_timestamp = None
-            # find the most recent non-enter input
-            if last_paragraph_timestamp is None and pre_sequential_char_insertion_timestamp is not None:
-                # assert pre_sequential_char_insertion_timestamp is not None
-                last_paragraph_timestamp = pre_sequential_char_insertion_timestamp or timestamp                      
-        else:
-            # within a word
-            if last_in_word_timestamp is not None:
-                # within a word
-                within_a_word_pause_list.append(timestamp-last_in_word_timestamp)
-                last_sentence_timestamp = None
-                last_paragraph_timestamp = None
-            else:
-                # start a new word, compute the between in word pause for continouse edition
-                if last_between_word_timestamp is not None:
-                    assert last_sentence_timestamp is None
-                    assert last_paragraph_timestamp is None
-                    between_words_pause_list.append(timestamp-last_between_word_timestamp)
-
-                if last_sentence_timestamp is not None:
-                    assert last_between_word_timestamp is None
-                    between_sentences_pause_list.append(timestamp-last_sentence_timestamp)
-                    last_sentence_timestamp = None
-
-                if last_paragraph_timestamp is not None:
-                    assert last_between_word_timestamp is None
-                    between_paragraphs_pause_list.append(timestamp-last_paragraph_timestamp)
-                    last_paragraph_timestamp = None
-
-            last_in_word_timestamp = timestamp
-            last_between_word_timestamp = timestamp
-            pre_sequential_char_insertion_timestamp = timestamp
-
-    def handle_deletion():
-        nonlocal sequential_deleted_content
-        nonlocal preceding_deletion_content
-        nonlocal subsequent_deletion_content
-        nonlocal sequential_deletion_time
-        nonlocal sequential_inserted_content
-        nonlocal sequential_insertion_time
-
-        # reset them because this is not a sequential insertion
-        sequential_inserted_content = ''
-        sequential_insertion_time = None
-
-        # handle jump edition
-        if current_position < last_position:
-            jump_length_list.append(count_num_of_jump_words(
-                prev_article[end1:last_position+1],
-                prev_article[:end1],
-                prev_article[last_position+1:]
-            ))
-            jump_time_list.append(timestamp-prev_timestamp)
-
-        if sequential_deleted_content == '':
-            # this is a new deletion
-            preceding_deletion_content = prev_article[:start1]
-            subsequent_deletion_content = prev_article[end1:]
-            sequential_deletion_time = timestamp
-
-        if start1 == last_position+1:
-            # delete the subsequent selection
-            sequential_deleted_content = sequential_deleted_content + prev_content
-        elif end1 == last_position+1:
-            # delete the preceding selection
-            sequential_deleted_content = prev_content + sequential_deleted_content
-        else:
-            # delete another selection
-            if sequential_deleted_content:
-                sequential_deletion_length_list.append(count_num_of_deleted_words(sequential_deleted_content, preceding_deletion_content, subsequent_deletion_content))
-                sequential_deletion_time_list.append(timestamp-sequential_deletion_time)
-            sequential_deleted_content = prev_content
-            sequential_deletion_time = timestamp
-
-    for event_i, event in enumerate(event_sequence):
-        # print(event)
-        # current_position = event['position']  # this is not accurate, use end2-1.
-        input_type = event['inputType']
-        data = event['data']
-        timestamp = event['time']
-        cur_article = event['article']
-
-        start1, end1, start2, end2 = decide_edition_range(prev_article, cur_article)
-        current_position = end2-1  # this is the last char index if it's positive, this can be -1 if deleting the prefix
-
-        # print(start1, end1, start2, end2)
-        # print(current_position, end2-1, decide_operation_type(start1, end1, start2, end2), data)
-        # print(prev_article[start1:end1], '=>', 'newline' if cur_article[start2:end2] == '\n' else cur_article[start2:end2])
-
-        op_type, is_selection = decide_operation_type(start1, end1, start2, end2)
-        prev_content = prev_article[start1:end1]
-        cur_content = cur_article[start2:end2]
-
-        if event_i > 0:
-            prev_timestamp = event_sequence[event_i-1]['time']
-        else:
-            prev_timestamp = timestamp
-
-        is_long_pause = (timestamp-prev_timestamp) >= 2000
-
-        # everything with selection are not within a word
-        if is_selection:
-            # The editing with selection is not continuous
-            last_in_word_timestamp = None
-            last_between_word_timestamp = None
-            last_paragraph_timestamp = None
-            last_sentence_timestamp = None
-            pre_sequential_char_insertion_timestamp = None
-            sequential_inserted_content = ''
-            sequential_insertion_time = None
-
-            if op_type == 'insert':
-                handle_insertion()
-            elif op_type == 'delete':
-                handle_deletion()
-            else:
-                raise NotImplementedError(f'This [{op_type}] has not been supported yet')
-        else:
-            if op_type == 'insert':
-                handle_insertion()
-            elif op_type == 'delete':
-                # It's not insertion operation
-                last_in_word_timestamp = None
-                last_between_word_timestamp = None
-                last_paragraph_timestamp = None
-                last_sentence_timestamp = None
-                pre_sequential_char_insertion_timestamp = None
-
-                handle_deletion()
-            else:
-                raise NotImplementedError(f'This [{op_type}] has not been supported yet')
-
-
-        prev_article = cur_article
-        last_position = current_position
-
-    # print(len(within_a_word_pause_list), within_a_word_pause_list)
-    # print(len(between_words_pause_list), between_words_pause_list)
-
-    # print('planning_time', planning_time)
-    # print('writing_time', writing_time)
-
-    # only keep the results whose deletion length > 0.
-    sequential_deletion_time_list = [t for t, l in zip(sequential_deletion_time_list, sequential_deletion_length_list) if l > 0]
-    sequential_deletion_length_list = [x for x in sequential_deletion_length_list if x > 0]
-    sequential_insertion_time_list = [t for t, l in zip(sequential_insertion_time_list, sequential_insertion_length_list) if l > 0]
-    sequential_insertion_length_list = [x for x in sequential_insertion_length_list if x > 0]
-    jump_time_list = [t for t, l in zip(jump_time_list, jump_length_list) if l > 0]
-    jump_length_list = [x for x in jump_length_list if x > 0]
-
-    features_dict = {
-        'score':    score,
-        'tottime':  writing_time,
-        'platime':  planning_time,
-        'numword':  num_of_words,
-        'witpau':   within_a_word_pause_list,
-        'bewpau':   between_words_pause_list,
-        'parpau':   between_paragraphs_pause_list,
-        'senpau':   between_sentences_pause_list,
-        'dellen':   sequential_deletion_length_list,
-        'deltime':  sequential_deletion_time_list,
-        'numchun':  len(sequential_insertion_length_list),
-        'chuword':  sequential_insertion_length_list,
-        'chutime':  sequential_insertion_time_list,
-        'numjump':  len(jump_time_list),
-        'jumptime': jump_time_list,
-        'jumpword': jump_length_list,
-    }
-    return features_dict
+    # import here because the feature engine is built on the functions above
+    from .feature_engine import extract_features_from_chunks
+    return extract_features_from_chunks([writing_record.record], writing_record.article, writing_record.score)
 
 
 def main():
@@ -513,7 +263,7 @@ def main():
     # print(writing_record.user)
     # extract_features(writing_record)
     # return
-    for writing_record in WritingRecord.objects.all():
+    for writing_record in WritingRecord.objects.with_record().select_related('user'):
         if writing_record.user.username.startswith('litest'):
             continue
         try:
@@ -0,0 +1,131 @@
+# coding=utf-8
+""" Extract the features of many writing records at once.
+
+Used by the extract_features management command and the dashboard.
+"""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.db import transaction
+
+from .extract_features import features_fingerprint
+from .feature_engine import extract_features_from_chunks
+from .fields import iter_stored_text, stored_value
+from .models import WritingRecord
+
+# accounts used to test the platform, their records are never extracted
+TEST_USERNAME_PREFIX = 'litest'
+
+
+def records_to_extract(exam_ids=None, since=None, only_missing=False):
+    """ Return the queryset of the records whose features should be extracted.
+    """
+    records = WritingRecord.objects.filter(user__isnull=False).exclude(
+        user__username__startswith=TEST_USERNAME_PREFIX
+    ).exclude(record='')
+    if exam_ids:
+        records = records.filter(exam_id__in=exam_ids)
+    if since is not None:
+        records = records.filter(datetime__gte=since)
+    if only_missing:
+        records = records.filter(features='')
+    return records
+
+
+def extract_features_cached(record, article, score, fingerprint='', features=''):
+    """ Return (features json, fingerprint, status) for a record, given as it is stored (see fields.stored_value()),
+    status being 'extracted', 'rescored' (only the score changed) or 'cached' (nothing changed).
+
+    The features are only extracted again when the fingerprint of (record, article, extractor version)
+    differs from the one they were extracted with. Otherwise only the score, which can change after
+    the submission, is merged into the cached features.
+    """
+    # the record is decompressed chunk by chunk, once for the fingerprint and once more if it is extracted
+    new_fingerprint = features_fingerprint(iter_stored_text(record), article)
+    if features and fingerprint == new_fingerprint:
+        cached = json.loads(features)
+        if cached is not None and cached.get('score') != score:
+            cached['score'] = score
+            return json.dumps(cached), fingerprint, 'rescored'
+        return features, fingerprint, 'cached'
+
+    features = extract_features_from_chunks(iter_stored_text(record), article, score)
+    return json.dumps(features), new_fingerprint, 'extracted'
+
+
+def _extract_features_from_values(values):
+    """ Run extract_features_cached() on (pk, record, article, score, fingerprint, features).
+
+    This is run in the worker processes, so it only gets and returns plain values.
+    Return (pk, features json, fingerprint, status, error message).
+    """
+    pk, record, article, score, fingerprint, features = values
+    try:
+        features, fingerprint, status = extract_features_cached(record, article, score, fingerprint, features)
+    except Exception as e:
+        return pk, None, None, None, repr(e)
+    return pk, features, fingerprint, status, None
+
+
+def extract_features_in_batch(records, workers=1, batch_size=100, on_batch=None, use_cache=True):
+    """ Extract and save the features of the records of a queryset.
+
+    The records are read batch_size at a time and the features of each batch are
+    computed by a pool of `workers` processes (in this process if workers == 1),
+    then the changed ones are written back with a single bulk_update.
+    Records whose features are up to date are not extracted again unless use_cache is False.
+    on_batch(cnt_extracted, cnt_cached, failures) is called after each batch if given.
+    Return (cnt_extracted, cnt_cached, failures) where failures is a list of (record id, error message).
+    """
+    cnt_extracted = 0
+    cnt_cached = 0
+    failures = []
+
+    # collect the ids first: rows must not be rewritten while SQLite is still reading them
+    record_ids = list(records.order_by('pk').values_list('pk', flat=True))
+
+    executor = None
+    if workers > 1 and len(record_ids) > batch_size:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=django.setup)
+    try:
+        for i in range(0, len(record_ids), batch_size):
+            # the records are sent compressed to the workers
+            rows = WritingRecord.objects.filter(pk__in=record_ids[i:i+batch_size]).annotate(
+                stored_record=stored_value('record')
+            ).values_list(
+                'pk', 'stored_record', 'article', 'score', 'features_fingerprint', 'features'
+            ).iterator()
+            if not use_cache:
+                rows = ((pk, record, article, score, '', '') for pk, record, article, score, _, _ in rows)
+            if executor is not None:
+                results = executor.map(_extract_features_from_values, rows, chunksize=max(1, batch_size // workers))
+            else:
+                results = map(_extract_features_from_values, rows)
+
+            changed = []
+            for pk, features, fingerprint, status, error in results:
+                if error is not None:
+                    failures.append((pk, error))
+                    continue
+                if status == 'extracted':
+                    cnt_extracted += 1
+                else:
+                    cnt_cached += 1
+                if status != 'cached':
+                    changed.append(WritingRecord(pk=pk, features=features, features_fingerprint=fingerprint))
+
+            if changed:
+                with transaction.atomic():
+                    WritingRecord.objects.bulk_update(changed, ['features', 'features_fingerprint'])
+            if on_batch is not None:
+                on_batch(cnt_extracted, cnt_cached, failures)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return cnt_extracted, cnt_cached, failures
+
+
+def default_workers():
+    return os.cpu_count() or 1
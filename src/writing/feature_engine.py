@@ -0,0 +1,505 @@
+# coding=utf-8
+""" Single pass feature extraction engine.
+
+The engine reads the events of a record one by one, decodes each edition once into an Edit
+(the edited range, the operation, the contents, the position and the pause), and passes it
+to every feature plugin. A plugin keeps its own state in __slots__ and returns its features
+at the end, so a new feature is a new plugin instead of another pass over the record.
+
+The article is a Document (see document.py) the engine applies each edition to, so that an
+edition costs the same whatever the length of the article: the compact events are never
+turned into whole articles. The plugins never slice the article around an edition either:
+the contents before and after it only matter by their edge chars, and the words of a range
+are counted by the document itself, a WordBoundaryIndex (see word_index.py), if a plugin uses them.
+
+The features of extract_features() are computed by the plugins registered below,
+in the order of the keys of the features dict.
+"""
+import time
+
+from .extract_features import (
+    count_num_of_deleted_words,
+    count_num_of_inserted_words,
+    count_num_of_partial_words,
+    count_num_of_words,
+    decide_edition_hint,
+    decide_edition_range,
+    decide_operation_type,
+)
+from .document import Document
+from .record_format import iter_record_events
+from .word_index import WordBoundaryIndex
+
+# sequential insertion means typing without pausing more than 2s (2000ms)
+LONG_PAUSE = 2000
+
+FEATURE_PLUGINS = []
+
+
+def register_plugin(plugin_class):
+    """ Class decorator adding a plugin to the ones run by default.
+    """
+    FEATURE_PLUGINS.append(plugin_class)
+    return plugin_class
+
+
+class Edit:
+    """ An edition of the article, from prev_article to cur_article.
+
+    prev_article[start1:end1] (prev_content) is replaced by cur_article[start2:end2] (cur_content).
+    position is the index of the last edited char in cur_article (-1 if deleting the prefix),
+    and last_position the one of the previous edition.
+    prev_article is the Document of the article before the edition, which reads like a str
+    (cur_article is never built). words is the same document if it is a WordBoundaryIndex,
+    i.e. if a plugin uses it, else None.
+    The engine reuses the same object for all the editions, so plugins must not keep it.
+    """
+    __slots__ = (
+        'index', 'time', 'prev_time', 'is_long_pause', 'input_type', 'data',
+        'prev_article', 'start1', 'end1', 'start2', 'end2',
+        'op_type', 'is_selection', 'prev_content', 'cur_content', 'position', 'last_position',
+        'words',
+    )
+
+    @property
+    def is_continuous(self):
+        return self.position == self.last_position + 1
+
+
+class RecordSummary:
+    """ What the plugins get at the end, besides the editions.
+    """
+    __slots__ = ('start_time', 'submit_time', 'first_time', 'article', 'score')
+
+    def __init__(self, start_time, submit_time, first_time, article, score):
+        self.start_time = start_time
+        self.submit_time = submit_time
+        self.first_time = first_time
+        self.article = article
+        self.score = score
+
+
+class FeaturePlugin:
+    """ Base class of the plugins: on_edit() is called for each edition in order, then features().
+    """
+    __slots__ = ()
+    name = None
+    # whether on_edit() uses edit.words
+    uses_word_index = False
+
+    def on_edit(self, edit):
+        pass
+
+    def features(self, summary):
+        return {}
+
+
+def _keep_positive(times, lengths):
+    """ Only keep the results whose length > 0.
+    """
+    return [t for t, l in zip(times, lengths) if l > 0], [x for x in lengths if x > 0]
+
+
+@register_plugin
+class SummaryPlugin(FeaturePlugin):
+    """ score, total writing time, planning time and number of words.
+    """
+    __slots__ = ()
+    name = 'summary'
+
+    def features(self, summary):
+        return {
+            'score':    summary.score,
+            'tottime':  summary.submit_time - summary.first_time,
+            'platime':  summary.first_time - summary.start_time,
+            'numword':  count_num_of_words(summary.article),
+        }
+
+
+@register_plugin
+class PausePlugin(FeaturePlugin):
+    """ Pauses within a word, between words, between sentences and between paragraphs.
+    """
+    __slots__ = (
+        'last_in_word_time', 'last_between_word_time', 'last_paragraph_time', 'last_sentence_time',
+        'prev_char_insertion_time', 'within_a_word', 'between_words', 'between_paragraphs', 'between_sentences',
+    )
+    name = 'pause'
+
+    def __init__(self):
+        self.reset()
+        self.within_a_word = []
+        self.between_words = []
+        self.between_paragraphs = []
+        self.between_sentences = []
+
+    def reset(self):
+        self.last_in_word_time = None
+        self.last_between_word_time = None
+        self.last_paragraph_time = None
+        self.last_sentence_time = None
+        self.prev_char_insertion_time = None
+
+    def on_edit(self, edit):
+        # everything with selection and the deletions are not within a word
+        if edit.is_selection or edit.op_type != 'insert':
+            self.reset()
+        if edit.op_type != 'insert':
+            return
+        if not edit.is_continuous:
+            self.reset()
+
+        timestamp = edit.time
+        cur_content = edit.cur_content
+        if cur_content == ' ':
+            # begin a new word (usually for between in word pause)
+            self.last_in_word_time = None
+        elif cur_content in ',.?!;:':
+            # separated by punctuation
+            self.last_in_word_time = None
+            self.last_between_word_time = None
+            self.last_paragraph_time = None
+            if self.last_sentence_time is None and self.prev_char_insertion_time is not None:
+                self.last_sentence_time = self.prev_char_insertion_time
+        elif cur_content == '\n':
+            # begin a new paragraph
+            self.last_in_word_time = None
+            self.last_between_word_time = None
+            self.last_sentence_time = None
+            # find the most recent non-enter input
+            if self.last_paragraph_time is None and self.prev_char_insertion_time is not None:
+                self.last_paragraph_time = self.prev_char_insertion_time or timestamp
+        else:
+            if self.last_in_word_time is not None:
+                # within a word
+                self.within_a_word.append(timestamp-self.last_in_word_time)
+                self.last_sentence_time = None
+                self.last_paragraph_time = None
+            else:
+                # start a new word, compute the between in word pause for continouse edition
+                if self.last_between_word_time is not None:
+                    assert self.last_sentence_time is None
+                    assert self.last_paragraph_time is None
+                    self.between_words.append(timestamp-self.last_between_word_time)
+
+                if self.last_sentence_time is not None:
+                    assert self.last_between_word_time is None
+                    self.between_sentences.append(timestamp-self.last_sentence_time)
+                    self.last_sentence_time = None
+
+                if self.last_paragraph_time is not None:
+                    assert self.last_between_word_time is None
+                    self.between_paragraphs.append(timestamp-self.last_paragraph_time)
+                    self.last_paragraph_time = None
+
+            self.last_in_word_time = timestamp
+            self.last_between_word_time = timestamp
+            self.prev_char_insertion_time = timestamp
+
+    def features(self, summary):
+        return {
+            'witpau':   self.within_a_word,
+            'bewpau':   self.between_words,
+            'parpau':   self.between_paragraphs,
+            'senpau':   self.between_sentences,
+        }
+
+
+@register_plugin
+class DeletionPlugin(FeaturePlugin):
+    """ Sequential deletions: their number of words and their durations.
+    """
+    # the deleted content is content_before (reversed) + content_after, not to copy it at each deletion
+    __slots__ = ('content_before', 'content_after', 'preceding_content', 'subsequent_content', 'start_time', 'lengths', 'times')
+    name = 'deletion'
+
+    def __init__(self):
+        self.content_before = []
+        self.content_after = []
+        self.preceding_content = ''
+        self.subsequent_content = ''
+        self.start_time = None
+        self.lengths = []
+        self.times = []
+
+    def end_deletion(self, timestamp):
+        if self.content_before or self.content_after:
+            content = ''.join(reversed(self.content_before)) + ''.join(self.content_after)
+            self.lengths.append(count_num_of_deleted_words(content, self.preceding_content, self.subsequent_content))
+            self.times.append(timestamp-self.start_time)
+
+    def start_content(self, content):
+        self.content_before = []
+        self.content_after = [content] if content else []
+
+    def on_edit(self, edit):
+        if edit.op_type == 'insert':
+            self.end_deletion(edit.time)
+            self.start_content('')
+            self.start_time = None
+            return
+
+        if not (self.content_before or self.content_after):
+            # this is a new deletion
+            # only their edge chars are used
+            self.preceding_content = edit.prev_article[edit.start1-1:edit.start1] if edit.start1 else ''
+            self.subsequent_content = edit.prev_article[edit.end1:edit.end1+1]
+            self.start_time = edit.time
+
+        if edit.start1 == edit.last_position+1:
+            # delete the subsequent selection
+            self.content_after.append(edit.prev_content)
+        elif edit.end1 == edit.last_position+1:
+            # delete the preceding selection
+            self.content_before.append(edit.prev_content)
+        else:
+            # delete another selection
+            self.end_deletion(edit.time)
+            self.start_content(edit.prev_content)
+            self.start_time = edit.time
+
+    def features(self, summary):
+        times, lengths = _keep_positive(self.times, self.lengths)
+        return {
+            'dellen':   lengths,
+            'deltime':  times,
+        }
+
+
+@register_plugin
+class ChunkPlugin(FeaturePlugin):
+    """ Typing chunks, i.e. continuous insertions between two long pauses: their number of words and their durations.
+    """
+    # the inserted chars of the chunk, joined when it ends
+    __slots__ = ('content', 'preceding_content', 'start_time', 'lengths', 'times')
+    name = 'chunk'
+
+    def __init__(self):
+        self.content = []
+        self.preceding_content = ''
+        self.start_time = None
+        self.lengths = []
+        self.times = []
+
+    def on_edit(self, edit):
+        if edit.is_selection or edit.op_type != 'insert' or not edit.is_continuous:
+            # this is not a sequential insertion
+            self.content = []
+            self.start_time = None
+        if edit.op_type != 'insert' or not edit.is_continuous:
+            return
+
+        # only record sequential insertion when it's a continuous insertion and a long pause
+        if edit.is_long_pause:
+            # end of a typing chunk so record it
+            if self.content:
+                subsequent_content = edit.prev_article[edit.end1:edit.end1+1]  # only the latest subsequent content matters.
+                self.lengths.append(count_num_of_inserted_words(''.join(self.content), self.preceding_content, subsequent_content))
+                self.times.append(edit.time-self.start_time)
+            # start a new typing chunk
+            self.content = [edit.cur_content]
+            self.start_time = edit.time
+            self.preceding_content = edit.prev_article[edit.start1-1:edit.start1] if edit.start1 else ''
+        elif self.content:
+            # within a typing chunk, so append the inserted content
+            self.content.append(edit.cur_content)
+
+    def features(self, summary):
+        times, lengths = _keep_positive(self.times, self.lengths)
+        return {
+            'numchun':  len(lengths),
+            'chuword':  lengths,
+            'chutime':  times,
+        }
+
+
+@register_plugin
+class JumpPlugin(FeaturePlugin):
+    """ Jumps back to edit a preceding part: their number of skipped words and their pauses.
+    """
+    __slots__ = ('lengths', 'times')
+    name = 'jump'
+    uses_word_index = True
+
+    def __init__(self):
+        self.lengths = []
+        self.times = []
+
+    def on_edit(self, edit):
+        if edit.op_type == 'insert' and edit.is_continuous:
+            return
+        if edit.position < edit.last_position:
+            # the words of prev_article[start:end], as count_num_of_jump_words() counts them
+            prev_article = edit.prev_article
+            start, end = edit.end1, edit.last_position+1
+            if start < end:
+                subtraction = count_num_of_partial_words(
+                    prev_article[start], prev_article[end-1],
+                    prev_article[start-1:start] if start else '', prev_article[end:end+1],
+                )
+                self.lengths.append(max(edit.words.count_words(start, end)-subtraction, 0))
+            else:
+                self.lengths.append(0)
+            self.times.append(edit.time-edit.prev_time)
+
+    def features(self, summary):
+        times, lengths = _keep_positive(self.times, self.lengths)
+        return {
+            'numjump':  len(times),
+            'jumptime': times,
+            'jumpword': lengths,
+        }
+
+
+def edited_slice(document, start, end, text, slice_start, slice_end):
+    """ Return cur_article[slice_start:slice_end], where cur_article is the document
+    after replacing document[start:end] by text.
+    """
+    shift = end - start - len(text)
+    text_end = start + len(text)
+    pieces = [
+        document.slice(min(slice_start, start), min(slice_end, start)),
+        text[max(slice_start-start, 0):max(slice_end-start, 0)],
+    ]
+    if slice_end > text_end:
+        pieces.append(document.slice(max(slice_start, text_end) + shift, slice_end + shift))
+    return ''.join(pieces)
+
+
+def decide_document_edition_range(document, start, end, text):
+    """ Return the same as decide_edition_range(prev_article, cur_article, hint) where prev_article
+    is the document and cur_article is prev_article[:start] + text + prev_article[end:] (a compact event),
+    without building cur_article.
+    """
+    len1 = len(document)
+    len2 = len1 - (end - start) + len(text)
+    if not 0 <= start <= end <= len1:
+        raise ValueError(f'Invalid edition [{start}, {end}) of an article of {len1} chars')
+    if len1 == 0:
+        return 0, 0, 0, len2
+
+    text_end = start + len(text)
+    shift = end - start - len(text)
+
+    def cur_char(i):
+        if i < start:
+            return document[i]
+        if i < text_end:
+            return text[i-start]
+        return document[i+shift]
+
+    # the hint is right, only extend it to the exact range (usually a few chars)
+    prefix_length = start
+    n = min(len1, len2)
+    while prefix_length < n and document[prefix_length] == cur_char(prefix_length):
+        prefix_length += 1
+    s1 = s2 = prefix_length
+    if s1 == len1 or s2 == len2:
+        return s1, len1, s2, len2
+
+    suffix_limit = min(len1 - s1, len2 - s2)
+    suffix_length = min(len1 - end, suffix_limit)
+    while suffix_length < suffix_limit and document[len1-1-suffix_length] == cur_char(len2-1-suffix_length):
+        suffix_length += 1
+    return s1, len1 - suffix_length, s2, len2 - suffix_length
+
+
+class FeatureEngine:
+    def __init__(self, plugin_classes=None):
+        self.plugin_classes = list(FEATURE_PLUGINS if plugin_classes is None else plugin_classes)
+
+    def extract(self, record_chunks, article, score, timings=None):
+        """ Return the features of a record given as an iterable of text chunks.
+
+        If timings is a dict, the seconds spent in each plugin (by name) and in decoding
+        the editions ('decode') are added to it.
+        """
+        plugins = [plugin_class() for plugin_class in self.plugin_classes]
+        handlers = [(plugin.name, plugin.on_edit) for plugin in plugins]
+
+        # the record can be in the legacy or the compact format, see record_format.py
+        record_header = {}
+        edit = Edit()
+        document = WordBoundaryIndex() if any(plugin.uses_word_index for plugin in plugins) else Document()
+        edit.prev_article = document
+        edit.words = document if isinstance(document, WordBoundaryIndex) else None
+        edit.last_position = -1  # if last edition includes selection, it points to the end of the selection.
+        # the previous article of the legacy events, which carry the whole article
+        prev_text = ''
+        first_time = None
+
+        decode_start = time.perf_counter()
+        for event_i, event in enumerate(iter_record_events(record_chunks, record_header, articles=False)):
+            timestamp = event['time']
+
+            if 'edit' in event:
+                start, end, text = event['edit']
+                start1, end1, start2, end2 = decide_document_edition_range(document, start, end, text)
+                cur_content = edited_slice(document, start, end, text, start2, end2)
+            else:
+                cur_article = event['article']
+                hint = decide_edition_hint(event, len(prev_text), len(cur_article))
+                start1, end1, start2, end2 = decide_edition_range(prev_text, cur_article, hint)
+                cur_content = cur_article[start2:end2]
+                prev_text = cur_article
+            op_type, is_selection = decide_operation_type(start1, end1, start2, end2)
+            if op_type not in ('insert', 'delete'):
+                raise NotImplementedError(f'This [{op_type}] has not been supported yet')
+
+            if event_i == 0:
+                first_time = edit.prev_time = timestamp
+            edit.index = event_i
+            edit.time = timestamp
+            edit.is_long_pause = (timestamp-edit.prev_time) >= LONG_PAUSE
+            edit.input_type = event['inputType']
+            edit.data = event['data']
+            edit.start1, edit.end1, edit.start2, edit.end2 = start1, end1, start2, end2
+            edit.op_type = op_type
+            edit.is_selection = is_selection
+            edit.prev_content = document.slice(start1, end1)
+            edit.cur_content = cur_content
+            edit.position = end2-1  # this is the last char index if it's positive, this can be -1 if deleting the prefix
+
+            if timings is None:
+                for _name, on_edit in handlers:
+                    on_edit(edit)
+            else:
+                plugins_start = time.perf_counter()
+                timings['decode'] = timings.get('decode', 0) + plugins_start - decode_start
+                for name, on_edit in handlers:
+                    start = time.perf_counter()
+                    on_edit(edit)
+                    timings[name] = timings.get(name, 0) + time.perf_counter() - start
+                decode_start = time.perf_counter()
+
+            document.replace(start1, end1, cur_content)
+            edit.last_position = edit.position
+            edit.prev_time = timestamp
+
+        if first_time is None:
+            raise ValueError('The record has no event')
+        summary = RecordSummary(record_header['startTime'], record_header['submitTime'], first_time, article, score)
+        features = {}
+        for plugin in plugins:
+            features.update(plugin.features(summary))
+        return features
+
+
+def extract_features_from_chunks(record_chunks, article, score):
+    """ Extract the features of a record given as an iterable of text chunks, with the default plugins.
+
+    The events are parsed one by one while they are used, so the memory only depends
+    on the length of the article, not on the number of events.
+    """
+    return FeatureEngine().extract(record_chunks, article, score)
+
+
+def benchmark_feature_engine(records, plugin_classes=None):
+    """ Run the engine on (record text, article, score) and return the seconds spent
+    in each plugin and in decoding the editions.
+    """
+    engine = FeatureEngine(plugin_classes)
+    timings = {}
+    for record, article, score in records:
+        engine.extract([record], article, score, timings)
+    return timings
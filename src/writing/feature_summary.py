@@ -0,0 +1,108 @@
+# coding=utf-8
+""" Summary table of the extracted features: one row per record with fixed columns.
+
+The list features of extract_features() (pauses, chunks, deletions, jumps) are summarized
+by count, mean, median, std, p10, p90 and sum, computed for all the records at once with NumPy.
+NumPy is optional: it's only imported when a summary is requested.
+"""
+import csv
+import io
+import json
+
+SCALAR_FEATURES = ['score', 'tottime', 'platime', 'numword', 'numchun', 'numjump']
+LIST_FEATURES = ['witpau', 'bewpau', 'parpau', 'senpau', 'dellen', 'deltime', 'chuword', 'chutime', 'jumptime', 'jumpword']
+STATISTICS = ['count', 'mean', 'median', 'std', 'p10', 'p90', 'sum']
+
+COLUMNS = SCALAR_FEATURES + [f'{name}_{statistic}' for name in LIST_FEATURES for statistic in STATISTICS]
+
+
+def _segment_percentile(np, sorted_values, offsets, counts, q):
+    """ Percentile q (in [0, 1], linear interpolation as np.percentile) of each segment of sorted_values.
+    """
+    result = np.full(len(counts), np.nan)
+    has_values = counts > 0
+    position = q * (counts[has_values] - 1)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.ceil(position).astype(np.int64)
+    base = offsets[has_values]
+    low_values = sorted_values[base + lower]
+    high_values = sorted_values[base + upper]
+    result[has_values] = low_values + (high_values - low_values) * (position - lower)
+    return result
+
+
+def _summarize_lists(np, lists):
+    """ Return a (len(lists), len(STATISTICS)) array summarizing each list of numbers.
+    """
+    counts = np.fromiter((len(values) for values in lists), dtype=np.int64, count=len(lists))
+    values = np.fromiter((value for values in lists for value in values), dtype=np.float64, count=int(counts.sum()))
+    segments = np.repeat(np.arange(len(lists)), counts)
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1])) if len(lists) else counts
+
+    sums = np.bincount(segments, weights=values, minlength=len(lists))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+        deviations = values - means[segments]
+        stds = np.sqrt(np.bincount(segments, weights=deviations * deviations, minlength=len(lists)) / counts)
+
+    # sort the values inside each segment for the percentiles
+    sorted_values = values[np.lexsort((values, segments))]
+    return np.column_stack([
+        counts,
+        means,
+        _segment_percentile(np, sorted_values, offsets, counts, 0.5),
+        stds,
+        _segment_percentile(np, sorted_values, offsets, counts, 0.1),
+        _segment_percentile(np, sorted_values, offsets, counts, 0.9),
+        sums,
+    ])
+
+
+def summarize_features(rows):
+    """ Summarize (record id, exam id, username, features json) rows.
+    Return (records, table) where records are the (record id, exam id, username) of the rows
+    and table is a float array with one row per record and COLUMNS as columns.
+    """
+    import numpy as np
+
+    records = []
+    scalars = []
+    lists = {name: [] for name in LIST_FEATURES}
+    for record_id, exam_id, username, features in rows:
+        features = json.loads(features)
+        if not features:
+            continue
+        records.append((record_id, exam_id, username))
+        scalars.append([features[name] for name in SCALAR_FEATURES])
+        for name in LIST_FEATURES:
+            lists[name].append(features[name])
+
+    table = np.hstack(
+        [np.array(scalars, dtype=np.float64).reshape(len(records), len(SCALAR_FEATURES))] +
+        [_summarize_lists(np, lists[name]).reshape(len(records), len(STATISTICS)) for name in LIST_FEATURES]
+    )
+    return records, table
+
+
+def summary_csv(records, table):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['record_id', 'exam_id', 'username'] + COLUMNS)
+    for record, row in zip(records, table.tolist()):
+        writer.writerow(list(record) + ['' if value != value else f'{value:.12g}' for value in row])
+    return output.getvalue()
+
+
+def summary_npz(records, table):
+    import numpy as np
+
+    output = io.BytesIO()
+    np.savez_compressed(
+        output,
+        record_ids=np.array([record_id for record_id, _, _ in records], dtype=np.int64),
+        exam_ids=np.array([exam_id for _, exam_id, _ in records], dtype=np.int64),
+        usernames=np.array([username for _, _, username in records], dtype=str),
+        columns=np.array(COLUMNS),
+        table=table,
+    )
+    return output.getvalue()
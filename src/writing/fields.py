@@ -0,0 +1,159 @@
+# coding=utf-8
+""" Model fields of the writing app.
+"""
+import codecs
+import gzip
+import lzma
+import zlib
+
+from django.db import models
+from django.db.models import ExpressionWrapper, F
+
+# size of the decompressed chunks of iter_stored_text()
+CHUNK_SIZE = 64 * 1024
+
+# the first byte of a stored value tells how the rest is compressed
+COMPRESSIONS = {
+    'zlib': (b'Z', lambda data: zlib.compress(data, 6), zlib.decompress),
+    'lzma': (b'X', lzma.compress, lzma.decompress),
+    # as compressed by the browsers, see stored_compressed()
+    'gzip': (b'G', lambda data: gzip.compress(data, 6), gzip.decompress),
+}
+DECOMPRESSORS = {marker: decompress for marker, _compress, decompress in COMPRESSIONS.values()}
+
+# the first bytes of gzip data
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def compress_text(text, compression='zlib'):
+    marker, compress, _decompress = COMPRESSIONS[compression]
+    return marker + compress(text.encode('utf-8'))
+
+
+def decompress_text(data):
+    data = bytes(data)
+    try:
+        decompress = DECOMPRESSORS[data[:1]]
+    except KeyError:
+        raise ValueError(f'Unknown compression marker {data[:1]!r}')
+    return decompress(data[1:]).decode('utf-8')
+
+
+def stored_compressed(data):
+    """ Return the value stored by a CompressedTextField for utf-8 text already compressed
+    in the gzip or the zlib format (e.g. by CompressionStream('gzip') or ('deflate') in a browser),
+    so that it's stored without compressing it again. The data is not checked.
+    """
+    data = bytes(data)
+    compression = 'gzip' if data[:2] == GZIP_MAGIC else 'zlib'
+    return COMPRESSIONS[compression][0] + data
+
+
+def _iter_zlib_decompressed(data, chunk_size, wbits=zlib.MAX_WBITS):
+    decompressor = zlib.decompressobj(wbits)
+    while data:
+        chunk = decompressor.decompress(data, chunk_size)
+        data = decompressor.unconsumed_tail
+        yield chunk
+        if decompressor.eof:
+            break
+    yield decompressor.flush()
+    if not decompressor.eof:
+        raise EOFError('Compressed data ended before the end-of-stream marker was reached')
+
+
+def _iter_gzip_decompressed(data, chunk_size):
+    return _iter_zlib_decompressed(data, chunk_size, 16 + zlib.MAX_WBITS)
+
+
+def _iter_lzma_decompressed(data, chunk_size):
+    decompressor = lzma.LZMADecompressor()
+    while not decompressor.eof:
+        chunk = decompressor.decompress(data, chunk_size)
+        data = b''
+        if not chunk and decompressor.needs_input:
+            raise EOFError('Compressed data ended before the end-of-stream marker was reached')
+        yield chunk
+
+
+ITER_DECOMPRESSORS = {
+    COMPRESSIONS['zlib'][0]: _iter_zlib_decompressed,
+    COMPRESSIONS['lzma'][0]: _iter_lzma_decompressed,
+    COMPRESSIONS['gzip'][0]: _iter_gzip_decompressed,
+}
+
+
+def iter_stored_text(value, chunk_size=CHUNK_SIZE):
+    """ Yield the text of a value stored by a CompressedTextField (see stored_value()) in chunks,
+    so that the whole text is never in memory when it is compressed.
+    """
+    if isinstance(value, str):
+        yield value
+        return
+    data = bytes(value)
+    try:
+        iter_decompressed = ITER_DECOMPRESSORS[data[:1]]
+    except KeyError:
+        raise ValueError(f'Unknown compression marker {data[:1]!r}')
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    for chunk in iter_decompressed(data[1:], chunk_size):
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    decoder.decode(b'', final=True)
+
+
+def stored_value(field_name):
+    """ Return an expression selecting the value of a CompressedTextField as it is stored,
+    i.e. compressed bytes, or a str for the values written before the field was compressed.
+    """
+    return ExpressionWrapper(F(field_name), output_field=models.BinaryField())
+
+
+class CompressedTextField(models.BinaryField):
+    """ A text stored compressed, but read and written as str.
+
+    Values written before the field was compressed are still text in the database,
+    they are returned as they are. The empty string is stored as it is, so that
+    filter(field='') matches the old and the new rows.
+    A bytes value is taken as already stored, see stored_compressed().
+    """
+    description = 'Compressed text'
+
+    def __init__(self, *args, compression='zlib', **kwargs):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f'Unknown compression {compression!r}')
+        self.compression = compression
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.compression != 'zlib':
+            kwargs['compression'] = self.compression
+        return name, path, args, kwargs
+
+    def get_default(self):
+        default = super().get_default()
+        return '' if default == b'' else default
+
+    def from_db_value(self, value, expression, connection):
+        if value is None or isinstance(value, str):
+            return value
+        return decompress_text(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, str):
+            return value
+        return decompress_text(value)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if isinstance(value, str):
+            if not value:
+                return value
+            value = compress_text(value, self.compression)
+        elif isinstance(value, (bytes, memoryview)) and bytes(value[:1]) not in DECOMPRESSORS:
+            raise ValueError(f'Unknown compression marker {bytes(value[:1])!r}')
+        return super().get_db_prep_value(value, connection, prepared)
+
+    def value_to_string(self, obj):
+        return self.value_from_object(obj)
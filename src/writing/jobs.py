@@ -0,0 +1,151 @@
+# coding=utf-8
+""" Background feature extraction jobs.
+
+A job is an ExtractionJob row. By default it is run by a thread of the web server process
+right after it's created. When settings.WRITING_JOBS_IN_PROCESS is False, the jobs are
+left queued for `manage.py run_worker` instead.
+
+There is at most one queued and one running job (see the constraint of ExtractionJob).
+A job updates its heartbeat after each batch: when the process running it stops (e.g. the server
+is restarted), the job is marked failed once it has had no heartbeat for
+settings.WRITING_JOB_STALE_SECONDS, so that it doesn't block the next jobs for ever.
+A job queued for the thread of a web server which has stopped is failed in the same way.
+"""
+import json
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .feature_batch import extract_features_in_batch, records_to_extract
+from .models import ExtractionJob
+from .write_queue import immediate_atomic
+
+# one job at a time, they all extract the same records
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='extraction-job')
+
+# the default of settings.WRITING_JOB_STALE_SECONDS
+JOB_STALE_SECONDS = 10 * 60
+
+
+def expire_stale_jobs():
+    """ Mark failed the running jobs without heartbeat for settings.WRITING_JOB_STALE_SECONDS,
+    and the jobs queued as long ago for the web server threads. Return the number of failed jobs.
+    """
+    stale_time = timezone.now() - timedelta(seconds=getattr(settings, 'WRITING_JOB_STALE_SECONDS', JOB_STALE_SECONDS))
+    stale = Q(status=ExtractionJob.STATUS_RUNNING, heartbeat_time__lt=stale_time)
+    if getattr(settings, 'WRITING_JOBS_IN_PROCESS', True):
+        # the queued jobs of `manage.py run_worker` wait until the worker is started
+        stale |= Q(status=ExtractionJob.STATUS_QUEUED, created_time__lt=stale_time)
+    return ExtractionJob.objects.filter(stale).update(
+        status=ExtractionJob.STATUS_FAILED,
+        finished_time=timezone.now(),
+        error='The job has stopped (no heartbeat).',
+    )
+
+
+def enqueue_extraction_job(user=None):
+    """ Create an extraction job, or return the one which is already waiting or running.
+    """
+    expire_stale_jobs()
+    while True:
+        try:
+            # SQLite ignores select_for_update(), the write lock is taken at the start instead
+            with immediate_atomic():
+                job = ExtractionJob.objects.select_for_update().filter(
+                    status__in=[ExtractionJob.STATUS_QUEUED, ExtractionJob.STATUS_RUNNING]
+                ).order_by('pk').first()
+                if job is not None:
+                    return job
+                job = ExtractionJob.objects.create(created_by=user)
+            break
+        except IntegrityError:
+            # enqueued by another request at the same time, return that one
+            pass
+
+    if getattr(settings, 'WRITING_JOBS_IN_PROCESS', True):
+        transaction.on_commit(lambda: _executor.submit(_run_in_thread, job.pk))
+    return job
+
+
+def _run_in_thread(job_id):
+    close_old_connections()
+    try:
+        run_extraction_job(job_id)
+    finally:
+        close_old_connections()
+
+
+def run_extraction_job(job_id, workers=1):
+    """ Run a queued job. Return False if the job is not queued anymore (e.g. taken by another worker).
+    """
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            claimed = ExtractionJob.objects.filter(pk=job_id, status=ExtractionJob.STATUS_QUEUED).update(
+                status=ExtractionJob.STATUS_RUNNING,
+                started_time=now,
+                heartbeat_time=now,
+            )
+    except IntegrityError:
+        # another job is still running
+        claimed = False
+    if not claimed:
+        return False
+
+    def on_batch(cnt_extracted, cnt_cached, failures):
+        ExtractionJob.objects.filter(pk=job_id).update(
+            processed=cnt_extracted + cnt_cached + len(failures),
+            failed=len(failures),
+            failures=json.dumps(failures),
+            heartbeat_time=timezone.now(),
+        )
+
+    try:
+        records = records_to_extract()
+        ExtractionJob.objects.filter(pk=job_id).update(total=records.count())
+        extract_features_in_batch(records, workers=workers, on_batch=on_batch)
+    except Exception:
+        ExtractionJob.objects.filter(pk=job_id).update(
+            status=ExtractionJob.STATUS_FAILED,
+            finished_time=timezone.now(),
+            error=traceback.format_exc(),
+        )
+    else:
+        ExtractionJob.objects.filter(pk=job_id).update(
+            status=ExtractionJob.STATUS_DONE,
+            finished_time=timezone.now(),
+        )
+    return True
+
+
+def run_queued_jobs(workers=1):
+    """ Run the queued jobs one by one. Return the number of jobs run.
+    """
+    cnt_run = 0
+    while True:
+        expire_stale_jobs()
+        job_id = ExtractionJob.objects.filter(status=ExtractionJob.STATUS_QUEUED).order_by('pk').values_list(
+            'pk', flat=True
+        ).first()
+        if job_id is None:
+            return cnt_run
+        if not run_extraction_job(job_id, workers=workers):
+            # taken by another worker, or another job is still running
+            return cnt_run
+        cnt_run += 1
+
+
+def job_progress(job):
+    return {
+        'job_id': job.pk,
+        'status': job.status,
+        'total': job.total,
+        'processed': job.processed,
+        'failed': job.failed,
+        'finished': job.status in (ExtractionJob.STATUS_DONE, ExtractionJob.STATUS_FAILED),
+    }
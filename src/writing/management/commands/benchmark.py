@@ -0,0 +1,72 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from writing.benchmark import (
+    DEFAULT_ESSAY_CHARS,
+    DEFAULT_MAX_LEGACY_WORDS,
+    DEFAULT_SIZES,
+    compare_reports,
+    load_report,
+    run_benchmarks,
+)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the feature extraction on synthetic records and write the results as json.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                            help='Comma separated numbers of words of the records.')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Number of runs of each benchmark, the median is reported.')
+        parser.add_argument('--max-legacy-words', type=int, default=DEFAULT_MAX_LEGACY_WORDS,
+                            help='Only benchmark the legacy format up to this number of words.')
+        parser.add_argument('--essay-chars', type=int, default=DEFAULT_ESSAY_CHARS,
+                            help='Length of the essay decide_edition_range is timed on, 0 to skip it.')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seed of the synthetic records.')
+        parser.add_argument('--output', default='benchmark.json',
+                            help='File the results are written to.')
+        parser.add_argument('--baseline',
+                            help='Results of a previous run to compare with.')
+        parser.add_argument('--threshold', type=float, default=1.2,
+                            help='Slowdown compared to the baseline reported as a regression.')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError(f'Invalid --sizes {options["sizes"]!r}')
+        baseline = load_report(options['baseline']) if options['baseline'] else None
+
+        report = run_benchmarks(
+            sizes=sizes,
+            repeat=options['repeat'],
+            max_legacy_words=options['max_legacy_words'],
+            seed=options['seed'],
+            log=self.stdout.write,
+            essay_chars=options['essay_chars'],
+        )
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+
+        for result in report['results']:
+            per_event = f'{result["us_per_event"]:10.2f} us/event' if result['us_per_event'] is not None else ''
+            self.stdout.write(
+                f'{result["benchmark"]:>28} {result["format"]:>8} {result["words"]:>6} words '
+                f'{result["seconds"]*1000:10.3f} ms {per_event}'
+            )
+
+        if baseline is not None:
+            cnt_regressions = 0
+            for result, before, ratio in compare_reports(report, baseline):
+                if ratio > options['threshold']:
+                    cnt_regressions += 1
+                    self.stdout.write(self.style.WARNING(
+                        f'Regression: {result["benchmark"]} {result["format"]} {result["words"]} words '
+                        f'{before*1000:.3f} ms -> {result["seconds"]*1000:.3f} ms ({ratio:.2f}x)'
+                    ))
+            self.stdout.write(f'{cnt_regressions} regressions compared to {options["baseline"]}.')
+
+        self.stdout.write(self.style.SUCCESS(f'Wrote {len(report["results"])} results to {options["output"]}.'))
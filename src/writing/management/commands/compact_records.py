@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from writing.models import WritingRecord
+from writing import record_format
+from writing.record_upload import delete_stale_chunks
+
+
+class Command(BaseCommand):
+    help = 'Convert legacy keystroke records (full article per event) into the compact delta format.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Number of records written back per query.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report the size reduction, do not save anything.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+
+        cnt_converted = cnt_failed = 0
+        size_before = size_after = 0
+
+        # collect the ids first: rows must not be rewritten while SQLite is still reading them
+        record_ids = list(WritingRecord.objects.exclude(record='').order_by('pk').values_list('pk', flat=True))
+        for i in range(0, len(record_ids), batch_size):
+            batch = []
+            records = WritingRecord.objects.filter(pk__in=record_ids[i:i+batch_size]).only('id', 'record')
+            for writing_record in records:
+                try:
+                    record = record_format.loads(writing_record.record)
+                    if record_format.is_compact(record):
+                        continue
+                    compact = record_format.to_compact(record)
+                    # the conversion must be lossless
+                    legacy_events = record['sequences']
+                    if legacy_events and record_format.final_article(compact) != legacy_events[-1]['article']:
+                        raise ValueError('the converted record does not replay to the same article')
+                except Exception as e:
+                    cnt_failed += 1
+                    self.stderr.write(f'Failed to convert record {writing_record.pk}: {e!r}')
+                    continue
+
+                compact_text = record_format.dumps(compact)
+                size_before += len(writing_record.record)
+                size_after += len(compact_text)
+                writing_record.record = compact_text
+                batch.append(writing_record)
+                cnt_converted += 1
+
+            if batch and not dry_run:
+                with transaction.atomic():
+                    WritingRecord.objects.bulk_update(batch, ['record'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Would convert" if dry_run else "Converted"} {cnt_converted} records '
+            f'({size_before} -> {size_after} characters), {cnt_failed} failed.'
+        ))
+        if not dry_run:
+            # the chunks uploaded during the exams which were never submitted
+            self.stdout.write(f'Deleted {delete_stale_chunks()} stale record chunks.')
@@ -0,0 +1,51 @@
+from django.db import transaction
+from django.db.models.functions import Length
+from django.core.management.base import BaseCommand
+
+from writing.fields import compress_text
+from writing.models import WritingRecord
+
+
+class Command(BaseCommand):
+    help = 'Compress the keystroke records which are still stored as plain text.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Number of records written back per query.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report the size reduction, do not save anything.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        compression = WritingRecord._meta.get_field('record').compression
+
+        cnt_compressed = 0
+        size_before = size_after = 0
+
+        # collect the ids first: rows must not be rewritten while SQLite is still reading them
+        record_ids = list(WritingRecord.objects.exclude(record='').order_by('pk').values_list('pk', flat=True))
+        for i in range(0, len(record_ids), batch_size):
+            batch = []
+            # stored_size is the number of bytes of a compressed record, or of characters of a plain one
+            rows = WritingRecord.objects.filter(pk__in=record_ids[i:i+batch_size]).annotate(
+                stored_size=Length('record')
+            ).values_list('pk', 'record', 'stored_size')
+            for pk, record, stored_size in rows:
+                compressed_size = len(compress_text(record, compression))
+                size_before += stored_size
+                size_after += compressed_size
+                if compressed_size == stored_size:
+                    # already compressed the same way
+                    continue
+                batch.append(WritingRecord(pk=pk, record=record))
+                cnt_compressed += 1
+
+            if batch and not dry_run:
+                with transaction.atomic():
+                    WritingRecord.objects.bulk_update(batch, ['record'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Would compress" if dry_run else "Compressed"} {cnt_compressed} records '
+            f'({size_before} -> {size_after} bytes).'
+        ))
@@ -0,0 +1,69 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from writing.feature_batch import default_workers, extract_features_in_batch, records_to_extract
+
+
+def parse_since(value):
+    since = parse_datetime(value)
+    if since is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        since = datetime.datetime.combine(day, datetime.time())
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    return since
+
+
+class Command(BaseCommand):
+    help = 'Extract the features of the writing records (except the test accounts) in parallel.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=default_workers(),
+                            help='Number of worker processes (default: number of CPUs).')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of records read and written back per query.')
+        parser.add_argument('--exam', type=int, action='append', dest='exam_ids',
+                            help='Only extract the records of this exam id (can be repeated).')
+        parser.add_argument('--since',
+                            help='Only extract the records submitted since this date or datetime, e.g. 2022-11-27.')
+        parser.add_argument('--only-missing', action='store_true',
+                            help='Only extract the records without features.')
+        parser.add_argument('--force', action='store_true',
+                            help='Extract the records again even if their features are up to date.')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = parse_since(options['since'])
+            except ValueError:
+                raise CommandError(f'Invalid --since value: {options["since"]}')
+        if options['workers'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--workers and --batch-size must be positive.')
+
+        records = records_to_extract(options['exam_ids'], since, options['only_missing'])
+
+        def on_batch(cnt_extracted, cnt_cached, failures):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'{cnt_extracted} extracted, {cnt_cached} up to date, {len(failures)} failed')
+
+        begin = time.perf_counter()
+        cnt_extracted, cnt_cached, failures = extract_features_in_batch(
+            records,
+            workers=options['workers'],
+            batch_size=options['batch_size'],
+            on_batch=on_batch,
+            use_cache=not options['force'],
+        )
+        for pk, error in failures:
+            self.stderr.write(f'Extraction error for record {pk}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Extracted {cnt_extracted} records in {time.perf_counter() - begin:.1f}s, '
+            f'{cnt_cached} were up to date, {len(failures)} failed.'
+        ))
@@ -0,0 +1,44 @@
+import csv
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from writing.bulk_accounts import create_student_accounts
+
+
+class Command(BaseCommand):
+    help = ('Create student accounts from a CSV file whose rows are "teacher username,student id". '
+            'The students get the same usernames and passwords as when created from the dashboard.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file', help='Path of the CSV file.')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Number of processes hashing the passwords (default: number of CPUs).')
+
+    def handle(self, *args, **options):
+        student_ids = {}
+        with open(options['csv_file'], newline='', encoding='utf-8-sig') as f:
+            for line_no, row in enumerate(csv.reader(f), 1):
+                row = [x.strip() for x in row]
+                if not any(row):
+                    continue
+                if len(row) < 2 or not row[0] or not row[1]:
+                    raise CommandError(f'Line {line_no}: expecting "teacher username,student id"')
+                student_ids.setdefault(row[0], []).append(row[1])
+
+        teachers = User.objects.in_bulk(list(student_ids), field_name='username')
+        unknown = sorted(set(student_ids) - set(teachers))
+        if unknown:
+            raise CommandError(f'Unknown teachers: {", ".join(unknown)}')
+
+        cnt_created = 0
+        skipped = []
+        for username, ids in student_ids.items():
+            cnt_created_for_teacher, skipped_for_teacher = create_student_accounts(
+                teachers[username], ids, workers=options['workers']
+            )
+            cnt_created += cnt_created_for_teacher
+            skipped += skipped_for_teacher
+        if skipped:
+            self.stdout.write(f'Skipped {len(skipped)} existing accounts: {", ".join(skipped)}')
+        self.stdout.write(self.style.SUCCESS(f'Created {cnt_created} student accounts.'))
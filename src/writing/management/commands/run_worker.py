@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from writing.feature_batch import default_workers
+from writing.jobs import run_queued_jobs
+from writing.record_upload import delete_stale_chunks
+
+# seconds between two deletions of the chunks of the abandoned exams
+CHUNK_CLEANUP_INTERVAL = 60 * 60
+
+
+class Command(BaseCommand):
+    help = ('Run the queued feature extraction jobs (use it with WRITING_JOBS_IN_PROCESS = False), '
+            'and delete the uploaded chunks of the abandoned exams.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=default_workers(),
+                            help='Number of worker processes per job (default: number of CPUs).')
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help='Seconds between two checks of the queue.')
+        parser.add_argument('--once', action='store_true',
+                            help='Run the queued jobs and exit.')
+
+    def handle(self, *args, **options):
+        last_cleanup = None
+        while True:
+            if last_cleanup is None or time.monotonic() - last_cleanup > CHUNK_CLEANUP_INTERVAL:
+                cnt_deleted = delete_stale_chunks()
+                if cnt_deleted:
+                    self.stdout.write(f'Deleted {cnt_deleted} stale record chunks.')
+                last_cleanup = time.monotonic()
+            cnt_run = run_queued_jobs(workers=options['workers'])
+            if cnt_run:
+                self.stdout.write(f'Ran {cnt_run} jobs.')
+            if options['once']:
+                return
+            time.sleep(options['interval'])
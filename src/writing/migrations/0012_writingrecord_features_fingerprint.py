@@ -0,0 +1,18 @@
+# Generated by Django 4.0.3 on 2026-10-18 18:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('writing', '0011_writingassignment_access_time'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='writingrecord',
+            name='features_fingerprint',
+            field=models.CharField(blank=True, max_length=80, verbose_name='features fingerprint'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.0.3 on 2026-10-18 18:01
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('writing', '0012_writingrecord_features_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExtractionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'queued'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], default='queued', max_length=16, verbose_name='status')),
+                ('created_time', models.DateTimeField(auto_now_add=True, verbose_name='created time')),
+                ('started_time', models.DateTimeField(blank=True, null=True, verbose_name='started time')),
+                ('finished_time', models.DateTimeField(blank=True, null=True, verbose_name='finished time')),
+                ('total', models.IntegerField(default=0, verbose_name='number of records')),
+                ('processed', models.IntegerField(default=0, verbose_name='number of processed records')),
+                ('failed', models.IntegerField(default=0, verbose_name='number of failed records')),
+                ('failures', models.TextField(blank=True, verbose_name='failures')),
+                ('error', models.TextField(blank=True, verbose_name='error')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='created by')),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.0.3 on 2026-10-18 18:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('writing', '0013_extractionjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReplayIndex',
+            fields=[
+                ('record', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='replay_index', serialize=False, to='writing.writingrecord', verbose_name='record')),
+                ('version', models.IntegerField(verbose_name='version')),
+                ('keyframe_interval', models.IntegerField(verbose_name='keyframe interval')),
+                ('index', models.TextField(verbose_name='index')),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.0.3 on 2026-10-18 18:09
+
+from django.db import migrations
+import writing.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('writing', '0014_replayindex'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='writingrecord',
+            name='record',
+            field=writing.fields.CompressedTextField(verbose_name='record'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.0.3 on 2026-10-18 18:32
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('writing', '0015_compress_writingrecord_record'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecordChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.IntegerField(verbose_name='sequence number')),
+                ('start_time', models.BigIntegerField(verbose_name='start time')),
+                ('events', models.TextField(verbose_name='events')),
+                ('received_time', models.DateTimeField(auto_now_add=True, verbose_name='received time')),
+                ('exam', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='writing.writingexam', verbose_name='exam')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='user')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='recordchunk',
+            constraint=models.UniqueConstraint(fields=('user', 'exam', 'seq'), name='unique_record_chunk'),
+        ),
+    ]
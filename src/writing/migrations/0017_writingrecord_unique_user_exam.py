@@ -0,0 +1,94 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:48
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import writing.fields
+
+
+def archive_duplicate_records(apps, schema_editor):
+    """ Keep the first record of each (user, exam), as the dashboard shows it,
+    and move the others to ArchivedWritingRecord with their user, so that they don't break the constraint.
+    """
+    WritingRecord = apps.get_model('writing', 'WritingRecord')
+    ArchivedWritingRecord = apps.get_model('writing', 'ArchivedWritingRecord')
+    earlier_records = WritingRecord.objects.filter(
+        user__isnull=False,
+        exam=models.OuterRef('exam'),
+        user=models.OuterRef('user'),
+        pk__lt=models.OuterRef('pk'),
+    )
+    duplicate_ids = list(WritingRecord.objects.filter(models.Exists(earlier_records)).values_list('pk', flat=True))
+    # one by one, the records can be several MB
+    for duplicate_id in duplicate_ids:
+        writing_record = WritingRecord.objects.get(pk=duplicate_id)
+        ArchivedWritingRecord.objects.create(
+            original_id=writing_record.pk,
+            user_id=writing_record.user_id,
+            exam_id=writing_record.exam_id,
+            article=writing_record.article,
+            record=writing_record.record,
+            datetime=writing_record.datetime,
+            features=writing_record.features,
+            score=writing_record.score,
+        )
+        writing_record.delete()
+
+
+def restore_archived_records(apps, schema_editor):
+    """ Move the archived records back, the constraint is removed before.
+    """
+    WritingRecord = apps.get_model('writing', 'WritingRecord')
+    ArchivedWritingRecord = apps.get_model('writing', 'ArchivedWritingRecord')
+    for archived_id in list(ArchivedWritingRecord.objects.values_list('pk', flat=True)):
+        archived = ArchivedWritingRecord.objects.get(pk=archived_id)
+        WritingRecord.objects.create(
+            pk=archived.original_id,
+            user_id=archived.user_id,
+            exam_id=archived.exam_id,
+            article=archived.article,
+            record=archived.record,
+            datetime=archived.datetime,
+            features=archived.features,
+            score=archived.score,
+        )
+        archived.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('writing', '0016_recordchunk'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedWritingRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_id', models.IntegerField(verbose_name='original id')),
+                ('article', models.TextField(verbose_name='article')),
+                ('record', writing.fields.CompressedTextField(verbose_name='record')),
+                ('datetime', models.DateTimeField(verbose_name='datetime')),
+                ('features', models.TextField(blank=True, verbose_name='features')),
+                ('score', models.IntegerField(default=-1, verbose_name='score')),
+                ('archived_time', models.DateTimeField(auto_now_add=True, verbose_name='archived time')),
+                ('exam', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='writing.writingexam', verbose_name='exam')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='user')),
+            ],
+        ),
+        migrations.RunPython(archive_duplicate_records, restore_archived_records),
+        migrations.AddIndex(
+            model_name='writingrecord',
+            index=models.Index(fields=['datetime'], name='writing_record_datetime_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='writingrecord',
+            index=models.Index(fields=['score'], name='writing_record_score_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='writingrecord',
+            constraint=models.UniqueConstraint(fields=('user', 'exam'), name='unique_writing_record'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:56
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fail_duplicate_active_jobs(apps, schema_editor):
+    """ Keep the last queued and the last running job, the others have stopped long ago.
+    """
+    ExtractionJob = apps.get_model('writing', 'ExtractionJob')
+    for status in ['queued', 'running']:
+        last_pk = ExtractionJob.objects.filter(status=status).order_by('-pk').values_list('pk', flat=True).first()
+        ExtractionJob.objects.filter(status=status).exclude(pk=last_pk).update(
+            status='failed',
+            finished_time=timezone.now(),
+            error='The job has stopped.',
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('writing', '0017_writingrecord_unique_user_exam'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='extractionjob',
+            name='heartbeat_time',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='heartbeat time'),
+        ),
+        migrations.RunPython(fail_duplicate_active_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='extractionjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['queued', 'running'])), fields=('status',), name='unique_active_extraction_job'),
+        ),
+    ]
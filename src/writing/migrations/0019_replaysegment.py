@@ -0,0 +1,58 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def delete_replay_indexes(apps, schema_editor):
+    """ The indexes are rebuilt on demand, in segments.
+    """
+    apps.get_model('writing', 'ReplayIndex').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('writing', '0018_extractionjob_heartbeat'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_replay_indexes, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='replayindex',
+            name='index',
+        ),
+        migrations.AddField(
+            model_name='replayindex',
+            name='start_time',
+            field=models.BigIntegerField(default=0, verbose_name='start time'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='replayindex',
+            name='duration',
+            field=models.BigIntegerField(default=0, verbose_name='duration'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='replayindex',
+            name='num_of_events',
+            field=models.IntegerField(default=0, verbose_name='number of events'),
+            preserve_default=False,
+        ),
+        migrations.CreateModel(
+            name='ReplaySegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.IntegerField(verbose_name='sequence number')),
+                ('start_time', models.BigIntegerField(verbose_name='start time')),
+                ('keyframe', models.TextField(verbose_name='keyframe')),
+                ('events', models.TextField(verbose_name='events')),
+                ('replay_index', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='segments', to='writing.replayindex', verbose_name='replay index')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='replaysegment',
+            constraint=models.UniqueConstraint(fields=('replay_index', 'seq'), name='unique_replay_segment'),
+        ),
+    ]
@@ -5,6 +5,8 @@ from django.utils.translation import gettext as _
 
 from django.conf import settings
 
+from .fields import CompressedTextField
+
 # Create your models here.
 
 class WritingExam(models.Model):
@@ -66,6 +68,21 @@ class TeacherStudentRelation(models.Model):
         return str(self.teacher) + str(self.student)
        
 
+class WritingRecordQuerySet(models.QuerySet):
+    def with_record(self):
+        """ Also load the record, deferred by default.
+        """
+        return self.defer(None)
+
+
+class WritingRecordManager(models.Manager.from_queryset(WritingRecordQuerySet)):
+    """ The record (the keystroke log, up to several MB) is only needed by the replay and the feature extraction,
+    so it is not loaded unless asked for with .with_record(), .only('record') or .values('record').
+    """
+    def get_queryset(self):
+        return super().get_queryset().defer('record')
+
+
 class WritingRecord(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -82,7 +99,8 @@ class WritingRecord(models.Model):
     article = models.TextField(
         verbose_name=_('article')
     )
-    record = models.TextField(
+    # stored compressed, see fields.py
+    record = CompressedTextField(
         verbose_name=_('record')
     )
     datetime = models.DateTimeField(
@@ -92,10 +110,265 @@ class WritingRecord(models.Model):
         verbose_name=_('features'),
         blank=True
     )
+    # fingerprint of (record, article, extractor version) the features were extracted from
+    features_fingerprint = models.CharField(
+        verbose_name=_('features fingerprint'),
+        max_length=80,
+        blank=True
+    )
     score = models.IntegerField(
         verbose_name=_('score'),
         default=-1
     )
 
+    objects = WritingRecordManager()
+
+    class Meta:
+        # a user submits an exam once, the records of deleted users (user is NULL) are kept.
+        # The unique index also serves the lookups of the record of (user, exam)
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'exam'], name='unique_writing_record'),
+        ]
+        indexes = [
+            models.Index(fields=['datetime'], name='writing_record_datetime_idx'),
+            models.Index(fields=['score'], name='writing_record_score_idx'),
+        ]
+
     def __str__(self) -> str:
         return str(self.exam.title) + str(self.user) + ' ' + str(self.datetime)
+
+
+class ArchivedWritingRecord(models.Model):
+    """ A second record of a (user, exam), submitted before a user could only submit an exam once.
+    The records are moved here by the migration adding the unique constraint of WritingRecord,
+    so they keep their user.
+    """
+    # the pk of the record in WritingRecord
+    original_id = models.IntegerField(
+        verbose_name=_('original id')
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        verbose_name=_('user'),
+        blank=True,
+        null=True,
+        on_delete=models.SET_NULL
+    )
+    exam = models.ForeignKey(
+        WritingExam,
+        verbose_name=_('exam'),
+        on_delete=models.CASCADE
+    )
+    article = models.TextField(
+        verbose_name=_('article')
+    )
+    record = CompressedTextField(
+        verbose_name=_('record')
+    )
+    datetime = models.DateTimeField(
+        verbose_name=_('datetime'),
+    )
+    features = models.TextField(
+        verbose_name=_('features'),
+        blank=True
+    )
+    score = models.IntegerField(
+        verbose_name=_('score'),
+        default=-1
+    )
+    archived_time = models.DateTimeField(
+        verbose_name=_('archived time'),
+        auto_now_add=True
+    )
+
+    def __str__(self) -> str:
+        return f'{self.original_id} {self.user} {self.exam_id} {self.datetime}'
+
+
+class ExtractionJob(models.Model):
+    """ A feature extraction over all the records, run in the background (see jobs.py).
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, _('queued')),
+        (STATUS_RUNNING, _('running')),
+        (STATUS_DONE, _('done')),
+        (STATUS_FAILED, _('failed')),
+    ]
+
+    status = models.CharField(
+        verbose_name=_('status'),
+        max_length=16,
+        choices=STATUS_CHOICES,
+        default=STATUS_QUEUED
+    )
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        verbose_name=_('created by'),
+        blank=True,
+        null=True,
+        on_delete=models.SET_NULL
+    )
+    created_time = models.DateTimeField(
+        verbose_name=_('created time'),
+        auto_now_add=True
+    )
+    started_time = models.DateTimeField(
+        verbose_name=_('started time'),
+        blank=True,
+        null=True
+    )
+    finished_time = models.DateTimeField(
+        verbose_name=_('finished time'),
+        blank=True,
+        null=True
+    )
+    # updated after each batch, a running job without heartbeat for a while has stopped (see jobs.py)
+    heartbeat_time = models.DateTimeField(
+        verbose_name=_('heartbeat time'),
+        blank=True,
+        null=True
+    )
+    total = models.IntegerField(
+        verbose_name=_('number of records'),
+        default=0
+    )
+    processed = models.IntegerField(
+        verbose_name=_('number of processed records'),
+        default=0
+    )
+    failed = models.IntegerField(
+        verbose_name=_('number of failed records'),
+        default=0
+    )
+    # json list of [record id, error message]
+    failures = models.TextField(
+        verbose_name=_('failures'),
+        blank=True
+    )
+    # the traceback if the whole job failed
+    error = models.TextField(
+        verbose_name=_('error'),
+        blank=True
+    )
+
+    class Meta:
+        # at most one queued and one running job, so that two admins can't enqueue a job at the same time
+        constraints = [
+            models.UniqueConstraint(
+                fields=['status'],
+                condition=models.Q(status__in=['queued', 'running']),
+                name='unique_active_extraction_job',
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.pk} {self.status} {self.processed}/{self.total}'
+
+
+class ReplayIndex(models.Model):
+    """ Header of the replay index of a record, whose events are in ReplaySegments (see replay.py).
+    """
+    record = models.OneToOneField(
+        WritingRecord,
+        verbose_name=_('record'),
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='replay_index'
+    )
+    version = models.IntegerField(
+        verbose_name=_('version')
+    )
+    keyframe_interval = models.IntegerField(
+        verbose_name=_('keyframe interval')
+    )
+    # startTime of the record, in ms
+    start_time = models.BigIntegerField(
+        verbose_name=_('start time')
+    )
+    duration = models.BigIntegerField(
+        verbose_name=_('duration')
+    )
+    num_of_events = models.IntegerField(
+        verbose_name=_('number of events')
+    )
+
+    def __str__(self) -> str:
+        return f'{self.record_id} v{self.version}'
+
+
+class ReplaySegment(models.Model):
+    """ keyframe_interval events of a record and the article before them, so that a replay page
+    only reads the segments it covers.
+    """
+    replay_index = models.ForeignKey(
+        ReplayIndex,
+        verbose_name=_('replay index'),
+        on_delete=models.CASCADE,
+        related_name='segments'
+    )
+    # 0, 1, 2... the events seq * keyframe_interval, seq * keyframe_interval + 1...
+    seq = models.IntegerField(
+        verbose_name=_('sequence number')
+    )
+    # ms since the start of the record of the first event
+    start_time = models.BigIntegerField(
+        verbose_name=_('start time')
+    )
+    keyframe = models.TextField(
+        verbose_name=_('keyframe')
+    )
+    # json list of the compact events, see record_format.py
+    events = models.TextField(
+        verbose_name=_('events')
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['replay_index', 'seq'], name='unique_replay_segment'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.replay_index_id} {self.seq}'
+
+
+class RecordChunk(models.Model):
+    """ A batch of the compact events of a record, uploaded during the exam (see record_upload.py).
+    The chunks of a (user, exam) are put together into the WritingRecord when the exam is submitted.
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        verbose_name=_('user'),
+        on_delete=models.CASCADE
+    )
+    exam = models.ForeignKey(
+        WritingExam,
+        verbose_name=_('exam'),
+        on_delete=models.CASCADE
+    )
+    # 0, 1, 2... in the order of the events
+    seq = models.IntegerField(
+        verbose_name=_('sequence number')
+    )
+    start_time = models.BigIntegerField(
+        verbose_name=_('start time')
+    )
+    # json array of compact events
+    events = models.TextField(
+        verbose_name=_('events')
+    )
+    received_time = models.DateTimeField(
+        verbose_name=_('received time'),
+        auto_now_add=True
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'exam', 'seq'], name='unique_record_chunk'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.user} {self.exam_id} #{self.seq}'
@@ -0,0 +1,215 @@
+# coding=utf-8
+""" Helpers for the keystroke records stored in WritingRecord.record.
+
+Two formats are in use:
+
+    version 1 (legacy): every event carries the whole article after the edition
+        {"startTime": ms, "sequences": [{"selectStart": .., "selectEnd": .., "position": ..,
+         "data": .., "inputType": .., "time": ms, "article": ".."}, ...], "submitTime": ms}
+
+    version 2 (compact): every event only carries the edition delta
+        {"version": 2, "startTime": ms, "sequences": [[dt, start, end, text, inputType], ...], "submitTime": ms}
+
+        dt is the time (ms) elapsed since the previous event (since startTime for the first one),
+        and the article after the event is prev_article[:start] + text + prev_article[end:].
+"""
+import json
+import re
+
+RECORD_VERSION = 2
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+def loads(record_text):
+    return json.loads(record_text)
+
+
+def dumps(record):
+    return json.dumps(record, separators=(',', ':'), ensure_ascii=False)
+
+
+def record_version(record):
+    return record.get('version', 1)
+
+
+def is_compact(record):
+    return record_version(record) >= 2
+
+
+def iter_events(record):
+    """ Yield the events of a record (any version) as dicts in the legacy layout.
+
+    Each event has at least 'time', 'inputType', 'data' and 'article' (the whole article after the edition).
+    Events of compact records also have 'edit' == (start, end, text) in the coordinates of the previous article.
+    """
+    if not is_compact(record):
+        yield from record['sequences']
+        return
+    yield from _iter_compact_events(record['sequences'], record['startTime'])
+
+
+def _iter_compact_events(sequences, start_time, articles=True):
+    article = ''
+    timestamp = start_time
+    for dt, start, end, text, input_type in sequences:
+        timestamp += dt
+        event = {
+            'time': timestamp,
+            'inputType': input_type,
+            'data': text or None,
+            'position': start + len(text) - 1,
+            'edit': (start, end, text),
+        }
+        if articles:
+            article = article[:start] + text + article[end:]
+            event['article'] = article
+        yield event
+
+
+class _Tokenizer:
+    """ Read json values one by one from text chunks, keeping only the unread text in memory.
+    """
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = ''
+        self.pos = 0
+
+    def _read(self):
+        """ Append the next chunk to the buffer. Return False at the end of the text.
+        """
+        for chunk in self.chunks:
+            if chunk:
+                self.buffer = self.buffer[self.pos:] + chunk
+                self.pos = 0
+                return True
+        return False
+
+    def peek(self):
+        """ Return the next non-whitespace character ('' at the end of the text), without consuming it.
+        """
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._read():
+                return ''
+
+    def expect(self, chars):
+        """ Consume the next character, which must be in chars. Return it.
+        """
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f'Expecting one of {chars!r} at {self.pos}, got {char!r}')
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._read():
+                    raise
+                continue
+            # a number at the end of the buffer may go on in the next chunk
+            if end < len(self.buffer) or not self._read():
+                self.pos = end
+                return value
+
+    def array(self):
+        """ Yield the values of an array one by one.
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+
+def iter_record_events(chunks, header, articles=True):
+    """ Yield the events of a record (any version) as iter_events() does, but reading the record
+    incrementally from text chunks: only the current event is kept in memory.
+
+    If articles is False, the compact events have no 'article' (building it costs a copy of the article
+    per event), only their 'edit' (see document.Document to apply them).
+
+    The other keys of the record (startTime, submitTime...) are put into header as they are read.
+    startTime comes before the events in the records written by the platform, but submitTime comes after,
+    so header is only complete once all the events have been yielded.
+    """
+    tokens = _Tokenizer(chunks)
+    pending_sequences = None
+    tokens.expect('{')
+    if tokens.peek() == '}':
+        return
+    while True:
+        key = tokens.value()
+        tokens.expect(':')
+        if key != 'sequences':
+            header[key] = tokens.value()
+        elif 'startTime' not in header:
+            # the events of compact records can't be timed before startTime is read
+            pending_sequences = tokens.value()
+        elif tokens.peek() == '[' and is_compact(header):
+            yield from _iter_compact_events(tokens.array(), header['startTime'], articles)
+        else:
+            yield from tokens.array()
+        if tokens.expect(',}') == '}':
+            break
+
+    if pending_sequences is not None:
+        if is_compact(header):
+            yield from _iter_compact_events(pending_sequences, header['startTime'], articles)
+        else:
+            yield from pending_sequences
+
+
+def to_compact(record):
+    """ Convert a legacy record into the compact format. Compact records are returned as they are.
+    """
+    if is_compact(record):
+        return record
+
+    # import here because extract_features depends on this module
+    from .extract_features import decide_edition_hint, decide_edition_range
+
+    sequences = []
+    prev_article = ''
+    prev_timestamp = record['startTime']
+    for event in record['sequences']:
+        cur_article = event['article']
+        hint = decide_edition_hint(event, len(prev_article), len(cur_article))
+        start1, end1, start2, end2 = decide_edition_range(prev_article, cur_article, hint)
+        sequences.append([
+            event['time'] - prev_timestamp,
+            start1,
+            end1,
+            cur_article[start2:end2],
+            event['inputType'],
+        ])
+        prev_article = cur_article
+        prev_timestamp = event['time']
+
+    compact = {
+        'version': RECORD_VERSION,
+        'startTime': record['startTime'],
+        'sequences': sequences,
+    }
+    if 'submitTime' in record:
+        compact['submitTime'] = record['submitTime']
+    return compact
+
+
+def final_article(record):
+    """ Return the article after the last event of a record (any version).
+    """
+    article = ''
+    for event in iter_events(record):
+        article = event['article']
+    return article
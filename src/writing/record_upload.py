@@ -0,0 +1,195 @@
+# coding=utf-8
+""" Incremental upload of the records during the exam.
+
+Every few seconds the exam page posts the new compact events (see record_format.py) as a chunk
+numbered 0, 1, 2... to append_record_chunk. A chunk is only stored once, so the page can post it
+again until it's acknowledged, and it posts the next one after that.
+
+On submit, the page posts the number of acknowledged chunks as 'chunked' and a record with only
+the events after them as 'examRecord', and record_exam puts the record together from the chunks.
+The chunks are then deleted. Pages without 'chunked' post the whole record as before.
+The chunks of the exams which are never submitted are deleted by delete_stale_chunks()
+(run by `manage.py run_worker` and `manage.py compact_records`).
+
+The browsers which have CompressionStream post examRecord gzipped, as the file examRecordGzip,
+which is stored as it is (see fields.stored_compressed()) once read_compressed_record() has checked
+that it decompresses into a valid record of a bounded size. File parts don't count in
+DATA_UPLOAD_MAX_MEMORY_SIZE, and are about 10 times smaller than the json.
+"""
+import json
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .fields import iter_stored_text, stored_compressed
+from .models import RecordChunk, WritingRecord
+from .record_format import RECORD_VERSION, dumps, is_compact, iter_record_events, loads
+
+# a chunk is a few seconds of typing, this is far more than any student can type
+MAX_CHUNK_EVENTS = 5000
+# the default of settings.WRITING_MAX_RECORD_SIZE, in chars
+MAX_RECORD_SIZE = 200 * 1024 * 1024
+# the default of settings.WRITING_CHUNK_MAX_AGE_SECONDS
+CHUNK_MAX_AGE_SECONDS = 2 * 24 * 60 * 60
+
+
+class UploadError(ValueError):
+    pass
+
+
+class ChunkError(UploadError):
+    pass
+
+
+def read_compressed_record(uploaded_file):
+    """ Return the stored value of an uploaded gzip (or zlib) compressed record.
+
+    The record is decompressed and parsed chunk by chunk to check that it is a complete record
+    (see record_format.py) of at most settings.WRITING_MAX_RECORD_SIZE chars, so a small upload
+    can't expand in memory.
+    """
+    max_size = getattr(settings, 'WRITING_MAX_RECORD_SIZE', MAX_RECORD_SIZE)
+    value = stored_compressed(b''.join(uploaded_file.chunks()))
+
+    def iter_text():
+        size = 0
+        for text in iter_stored_text(value):
+            size += len(text)
+            if size > max_size:
+                raise UploadError(f'The record is larger than {max_size} chars')
+            yield text
+
+    header = {}
+    try:
+        for event in iter_record_events(iter_text(), header, articles=False):
+            if not _is_valid_event(event):
+                raise UploadError('Invalid event in the record')
+    except (zlib.error, EOFError, UnicodeDecodeError) as e:
+        raise UploadError(f'Invalid compressed record: {e}')
+    except UploadError:
+        raise
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        raise UploadError(f'Invalid record: {e}')
+    if not isinstance(header.get('startTime'), int):
+        raise UploadError('The record has no startTime')
+    return value
+
+
+def _is_valid_event(event):
+    """ Return True if an event yielded by iter_record_events() has the fields the extraction and the replay read.
+    """
+    if not isinstance(event, dict) or not isinstance(event.get('time'), int):
+        return False
+    if 'edit' in event:
+        start, end, text = event['edit']
+        return isinstance(start, int) and isinstance(end, int) and isinstance(text, str)
+    return isinstance(event.get('article'), str)
+
+
+def parse_chunk_events(events_text):
+    """ Return the compact events of a posted chunk, raising ChunkError if they are invalid.
+    """
+    try:
+        events = json.loads(events_text)
+    except ValueError:
+        raise ChunkError('Invalid json')
+    if not isinstance(events, list) or len(events) > MAX_CHUNK_EVENTS:
+        raise ChunkError('Expecting a list of events')
+    for event in events:
+        if not (isinstance(event, list) and len(event) == 5 and isinstance(event[3], str) and
+                all(isinstance(x, int) for x in event[:3])):
+            raise ChunkError('Expecting events [dt, start, end, text, inputType]')
+    return events
+
+
+def append_chunk(user, exam_id, seq, start_time, events):
+    """ Store a chunk of events. Return False if it was already stored (a retry).
+    """
+    if seq < 0:
+        raise ChunkError('Invalid sequence number')
+    if RecordChunk.objects.filter(user=user, exam_id=exam_id, seq=seq).exists():
+        return False
+    try:
+        with transaction.atomic():
+            RecordChunk.objects.create(user=user, exam_id=exam_id, seq=seq, start_time=start_time, events=dumps(events))
+    except IntegrityError:
+        # the same chunk posted twice at the same time
+        return False
+    return True
+
+
+def record_from_chunks(user, exam, num_of_chunks, tail_record_text):
+    """ Return the text of the record made of the first num_of_chunks chunks of (user, exam)
+    followed by the events of the tail record, which has the startTime and submitTime.
+    """
+    tail_record = loads(tail_record_text)
+    if not is_compact(tail_record):
+        raise ChunkError('Chunks are only uploaded for compact records')
+    chunks = list(
+        RecordChunk.objects.filter(user=user, exam=exam, seq__lt=num_of_chunks)
+        .order_by('seq').values_list('seq', 'start_time', 'events')
+    )
+    if [seq for seq, _, _ in chunks] != list(range(num_of_chunks)):
+        raise ChunkError(f'Missing chunks: {len(chunks)} of {num_of_chunks} received')
+    if any(start_time != tail_record['startTime'] for _, start_time, _ in chunks):
+        raise ChunkError('The chunks are not from the same record')
+
+    # the events are stored as json arrays, join them without parsing them again
+    events = [events_text[1:-1] for _, _, events_text in chunks if events_text != '[]']
+    if tail_record['sequences']:
+        events.append(dumps(tail_record['sequences'])[1:-1])
+    header = dumps({'version': RECORD_VERSION, 'startTime': tail_record['startTime']})
+    footer = dumps({'submitTime': tail_record.get('submitTime')})
+    return header[:-1] + ',"sequences":[' + ','.join(events) + '],' + footer[1:]
+
+
+def delete_chunks(user, exam):
+    RecordChunk.objects.filter(user=user, exam=exam).delete()
+
+
+def delete_stale_chunks():
+    """ Delete the chunks no record will be made of, return their number: the chunks of the submitted exams
+    (left if the submission failed after saving the record), and those of the exams abandoned
+    for settings.WRITING_CHUNK_MAX_AGE_SECONDS, i.e. without any chunk received since then.
+    """
+    max_age = getattr(settings, 'WRITING_CHUNK_MAX_AGE_SECONDS', CHUNK_MAX_AGE_SECONDS)
+    stale_time = timezone.now() - timedelta(seconds=max_age)
+    submitted = WritingRecord.objects.filter(user=OuterRef('user'), exam=OuterRef('exam'))
+    recent_chunks = RecordChunk.objects.filter(user=OuterRef('user'), exam=OuterRef('exam'), received_time__gte=stale_time)
+    cnt_deleted, _ = RecordChunk.objects.filter(
+        Exists(submitted) | (Q(received_time__lt=stale_time) & ~Exists(recent_chunks))
+    ).delete()
+    return cnt_deleted
+
+
+def save_exam_record(user, exam, article, record, num_of_chunks=None):
+    """ Save and return the WritingRecord submitted by a user, or return None if the exam was already submitted.
+
+    record is the text or the stored value (see read_compressed_record()) of the record,
+    which only has the events after the first num_of_chunks chunks if num_of_chunks is not None.
+    It's run by run_serialized() (see write_queue.py). A second submission, even by another process,
+    is refused by the unique constraint of (user, exam), not by checking for the record first.
+    """
+    if num_of_chunks is not None:
+        record_text = record if isinstance(record, str) else ''.join(iter_stored_text(record))
+        try:
+            record = record_from_chunks(user, exam, num_of_chunks, record_text)
+        except ChunkError:
+            # the chunks are deleted once the record is saved
+            if WritingRecord.objects.filter(user=user, exam=exam).exists():
+                return None
+            raise
+    try:
+        with transaction.atomic():
+            writing_record = WritingRecord.objects.create(
+                user=user, exam=exam, article=article, record=record, datetime=timezone.now()
+            )
+    except IntegrityError:
+        return None
+    if num_of_chunks is not None:
+        delete_chunks(user, exam)
+    return writing_record
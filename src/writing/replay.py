@@ -0,0 +1,190 @@
+# coding=utf-8
+""" Replay index of the records, for seeking and paging in the replay.
+
+The index of a record is built once from the record in any format: a ReplayIndex with the start time,
+the duration and the number of events of the record, and a ReplaySegment for each KEYFRAME_INTERVAL
+events, with the compact events (see record_format.py), the ms since the start of the first one,
+and the article before them (the keyframe).
+
+The article at any event is a keyframe plus at most KEYFRAME_INTERVAL - 1 editions, and a replay page
+only reads the few segments it covers, so serving it doesn't depend on the length of the record.
+"""
+import json
+from bisect import bisect_right
+from itertools import accumulate
+
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, transaction
+
+from .document import Document
+from .models import ReplayIndex, ReplaySegment, WritingRecord
+from .record_format import dumps, loads, to_compact
+
+INDEX_VERSION = 2
+# number of events of a segment
+KEYFRAME_INTERVAL = 200
+
+# a replay page covers this many ms of the record, but no more than PAGE_MAX_EVENTS events
+PAGE_WINDOW = 60 * 1000
+PAGE_MAX_EVENTS = 500
+
+
+def build_replay_index(record):
+    """ Return the (unsaved) ReplayIndex of a record and the (seq, start time, keyframe, events) of its segments.
+    """
+    record = to_compact(record)
+    events = record['sequences']
+    segments = []
+    article = Document()
+    elapsed = 0
+    for i, event in enumerate(events):
+        dt, start, end, text, _input_type = event
+        elapsed += dt
+        if i % KEYFRAME_INTERVAL == 0:
+            segments.append((i // KEYFRAME_INTERVAL, elapsed, str(article), []))
+        segments[-1][3].append(event)
+        article.replace(start, end, text)
+    duration = elapsed
+    if 'submitTime' in record:
+        duration = max(duration, record['submitTime'] - record['startTime'])
+    replay_index = ReplayIndex(
+        version=INDEX_VERSION,
+        keyframe_interval=KEYFRAME_INTERVAL,
+        start_time=record['startTime'],
+        duration=duration,
+        num_of_events=len(events),
+    )
+    return replay_index, segments
+
+
+def _build_record_index(record_text):
+    return build_replay_index(loads(record_text))
+
+
+def _save_replay_index(record_id, replay_index, segments):
+    replay_index.record_id = record_id
+    try:
+        with transaction.atomic():
+            ReplayIndex.objects.filter(pk=record_id).delete()
+            replay_index.save(force_insert=True)
+            ReplaySegment.objects.bulk_create([
+                ReplaySegment(replay_index=replay_index, seq=seq, start_time=start_time, keyframe=keyframe, events=dumps(events))
+                for seq, start_time, keyframe, events in segments
+            ], batch_size=100)
+    except IntegrityError:
+        # built by another request at the same time
+        pass
+    return replay_index
+
+
+def get_replay_index(record_id):
+    """ Return the ReplayIndex of a record, building it if needed.
+    """
+    replay_index = ReplayIndex.objects.filter(record_id=record_id, version=INDEX_VERSION).first()
+    if replay_index is None:
+        record_text = WritingRecord.objects.filter(pk=record_id).values_list('record', flat=True).get()
+        replay_index = _save_replay_index(record_id, *_build_record_index(record_text))
+    return replay_index
+
+
+async def aget_replay_index(record_id):
+    """ get_replay_index() with the async ORM. The index of a long record takes a while to build,
+    it's built in a thread so that the other requests go on meanwhile.
+    """
+    replay_index = await ReplayIndex.objects.filter(record_id=record_id, version=INDEX_VERSION).afirst()
+    if replay_index is None:
+        record_text = await WritingRecord.objects.filter(pk=record_id).values_list('record', flat=True).aget()
+        built = await sync_to_async(_build_record_index, thread_sensitive=False)(record_text)
+        # transaction.atomic() is sync only
+        replay_index = await sync_to_async(_save_replay_index)(record_id, *built)
+    return replay_index
+
+
+def _segment_times(start_time, events):
+    """ ms since the start of the record of each event of a segment.
+    """
+    return list(accumulate((dt for dt, *_ in events[1:]), initial=start_time))
+
+
+def _events_until(segment, time):
+    """ Number of events at or before time, given the last segment starting at or before time (None if there is none).
+    """
+    if segment is None:
+        return 0
+    events = json.loads(segment.events)
+    return segment.seq * KEYFRAME_INTERVAL + bisect_right(_segment_times(segment.start_time, events), time)
+
+
+def _time_query(replay_index, time):
+    return replay_index.segments.filter(start_time__lte=time).order_by('-seq').only('seq', 'start_time', 'events')
+
+
+def _page_query(replay_index, event):
+    """ The segments read by the page starting after event: from the one of the previous event
+    (for the time of the page) to the one of its last possible event.
+    """
+    first_seq = (event - 1) // KEYFRAME_INTERVAL if event else 0
+    last_seq = (min(event + PAGE_MAX_EVENTS, replay_index.num_of_events) - 1) // KEYFRAME_INTERVAL
+    return replay_index.segments.filter(seq__gte=first_seq, seq__lte=last_seq).order_by('seq')
+
+
+def replay_page(replay_index, segments, event, window=PAGE_WINDOW):
+    """ Return the article after a number of events and the events of the following window,
+    segments being the ReplaySegments of _page_query().
+    """
+    num_of_events = replay_index.num_of_events
+    base = segments[0].seq * KEYFRAME_INTERVAL if segments else 0
+    events = []
+    times = []
+    for segment in segments:
+        segment_events = json.loads(segment.events)
+        events += segment_events
+        times += _segment_times(segment.start_time, segment_events)
+
+    # positions in the events of the segments
+    position = event - base
+    event_time = times[position - 1] if event else 0
+    end = bisect_right(times, event_time + window, lo=position)
+    end = min(max(end, position + 1), position + PAGE_MAX_EVENTS, len(times))
+
+    article = ''
+    if segments:
+        # the keyframe of the segment of the event, or of the last one after the last event
+        keyframe_seq = min(event // KEYFRAME_INTERVAL, segments[-1].seq)
+        segment = segments[keyframe_seq - segments[0].seq]
+        document = Document(segment.keyframe)
+        for _dt, start, end_, text, _input_type in events[keyframe_seq * KEYFRAME_INTERVAL - base:position]:
+            document.replace(start, end_, text)
+        article = str(document)
+
+    return {
+        'startTime': replay_index.start_time,
+        'duration': replay_index.duration,
+        'event': event,
+        'time': event_time,
+        'article': article,
+        'events': events[position:end],
+        'next_event': base + end if base + end < num_of_events else None,
+    }
+
+
+def get_replay_page(record_id, time=None, event=None):
+    """ Return the replay page of a record at a time (ms since startTime) or after a number of events.
+    """
+    replay_index = get_replay_index(record_id)
+    if event is None:
+        time = time or 0
+        event = _events_until(_time_query(replay_index, time).first(), time)
+    event = max(0, min(event, replay_index.num_of_events))
+    return replay_page(replay_index, list(_page_query(replay_index, event)), event)
+
+
+async def aget_replay_page(record_id, time=None, event=None):
+    """ get_replay_page() with the async ORM.
+    """
+    replay_index = await aget_replay_index(record_id)
+    if event is None:
+        time = time or 0
+        event = _events_until(await _time_query(replay_index, time).afirst(), time)
+    event = max(0, min(event, replay_index.num_of_events))
+    return replay_page(replay_index, [segment async for segment in _page_query(replay_index, event)], event)
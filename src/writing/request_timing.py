@@ -0,0 +1,180 @@
+# coding=utf-8
+""" Timing of the requests: wall time, number of queries and time spent in the database.
+
+RequestTimingMiddleware keeps the timings of the last requests in memory (per process),
+summarized on the request timings page of the dashboard, and logs them to the
+'writing.request_timing' logger if settings.WRITING_REQUEST_TIMING_LOG is True.
+The requests slower than settings.WRITING_SLOW_REQUEST_SECONDS are always logged
+with their slowest queries.
+
+The time of a streaming response only covers the view, not the streaming of the content.
+
+Under ASGI the middleware is async, so that the async views are not run in a thread.
+The queries of an async request are run in its sync thread (see asgiref's sync_to_async()),
+where the query timer is installed.
+"""
+import heapq
+import logging
+import threading
+import time
+from collections import deque
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger('writing.request_timing')
+
+# number of slowest queries logged for a slow request
+NUM_OF_SLOW_QUERIES = 5
+
+_timings = deque(maxlen=getattr(settings, 'WRITING_REQUEST_TIMING_SIZE', 10000))
+_timings_lock = threading.Lock()
+
+
+class QueryTimer:
+    """ Execute wrapper (see connection.execute_wrapper()) counting and timing the queries.
+    """
+    __slots__ = ('count', 'duration', 'slowest')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        # heap of (duration, sql) of the slowest queries
+        self.slowest = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.count += 1
+            self.duration += duration
+            if len(self.slowest) < NUM_OF_SLOW_QUERIES:
+                heapq.heappush(self.slowest, (duration, sql))
+            elif duration > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, (duration, sql))
+
+
+def _add_query_timer(query_timer):
+    connection.execute_wrappers.append(query_timer)
+
+
+def _remove_query_timer(query_timer):
+    connection.execute_wrappers.remove(query_timer)
+
+
+class RequestTimingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.log_all = getattr(settings, 'WRITING_REQUEST_TIMING_LOG', False)
+        self.slow_seconds = getattr(settings, 'WRITING_SLOW_REQUEST_SECONDS', 1.0)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        query_timer = QueryTimer()
+        start = time.perf_counter()
+        with connection.execute_wrapper(query_timer):
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        self.record(request, response, duration, query_timer)
+        if self.must_log(duration):
+            self.log(request, response, duration, query_timer)
+        return response
+
+    async def __acall__(self, request):
+        query_timer = QueryTimer()
+        start = time.perf_counter()
+        await sync_to_async(_add_query_timer)(query_timer)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(_remove_query_timer)(query_timer)
+        duration = time.perf_counter() - start
+
+        self.record(request, response, duration, query_timer)
+        if self.must_log(duration):
+            # request.user may not be loaded yet
+            await sync_to_async(self.log)(request, response, duration, query_timer)
+        return response
+
+    def record(self, request, response, duration, query_timer):
+        with _timings_lock:
+            _timings.append((
+                self.url_name(request), request.method, response.status_code, duration,
+                query_timer.count, query_timer.duration,
+            ))
+
+    def must_log(self, duration):
+        return self.log_all or duration >= self.slow_seconds
+
+    @staticmethod
+    def url_name(request):
+        resolver_match = request.resolver_match
+        return resolver_match.view_name if resolver_match is not None else ''
+
+    def log(self, request, response, duration, query_timer):
+        message = '%s %s %s (%s) %d: %.1f ms, %d queries, %.1f ms in the database'
+        args = (
+            request.method, request.path, self.url_name(request), request.user if hasattr(request, 'user') else '-',
+            response.status_code, duration * 1000, query_timer.count, query_timer.duration * 1000,
+        )
+        if duration >= self.slow_seconds:
+            slowest = sorted(query_timer.slowest, reverse=True)
+            logger.warning(
+                'Slow request ' + message + '\nSlowest queries:\n%s', *args,
+                '\n'.join(f'{query_duration*1000:10.1f} ms  {sql}' for query_duration, sql in slowest),
+            )
+        else:
+            logger.info(message, *args)
+
+
+def percentile(sorted_values, q):
+    """ Nearest-rank percentile q (in [0, 100]) of a sorted list.
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * q // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def timing_summary():
+    """ Return the summary of the recorded requests per url name, the slowest (by p95) first:
+    dicts with url_name, count, p50, p95, p99 and max (ms), mean_queries and db_p95 (ms).
+    """
+    with _timings_lock:
+        timings = list(_timings)
+
+    per_url = {}
+    for url_name, _method, _status, duration, num_of_queries, db_duration in timings:
+        per_url.setdefault(url_name, []).append((duration, num_of_queries, db_duration))
+
+    summary = []
+    for url_name, samples in per_url.items():
+        durations = sorted(duration * 1000 for duration, _, _ in samples)
+        db_durations = sorted(db_duration * 1000 for _, _, db_duration in samples)
+        summary.append({
+            'url_name': url_name or '-',
+            'count': len(samples),
+            'p50': percentile(durations, 50),
+            'p95': percentile(durations, 95),
+            'p99': percentile(durations, 99),
+            'max': durations[-1],
+            'mean_queries': sum(num_of_queries for _, num_of_queries, _ in samples) / len(samples),
+            'db_p95': percentile(db_durations, 95),
+        })
+    summary.sort(key=lambda row: row['p95'], reverse=True)
+    return summary
+
+
+def clear_timings():
+    with _timings_lock:
+        _timings.clear()
@@ -0,0 +1,69 @@
+# coding=utf-8
+""" Roles of the users, i.e. the names of their groups.
+
+The group names of a user are loaded with one query the first time they are needed
+and kept on the user object, which lives as long as the request (request.user in the views
+and user in the templates are the same object).
+"""
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+
+from django.http.response import HttpResponseBadRequest
+
+WRITING_ADMIN = 'Writing Admin'
+TEACHER = 'Teacher'
+
+
+def user_group_names(user):
+    if not user.is_authenticated:
+        return frozenset()
+    group_names = getattr(user, '_writing_group_names', None)
+    if group_names is None:
+        group_names = frozenset(user.groups.values_list('name', flat=True))
+        user._writing_group_names = group_names
+    return group_names
+
+
+async def auser_group_names(user):
+    """ user_group_names() with the async ORM.
+    """
+    if not user.is_authenticated:
+        return frozenset()
+    group_names = getattr(user, '_writing_group_names', None)
+    if group_names is None:
+        group_names = frozenset([name async for name in user.groups.values_list('name', flat=True)])
+        user._writing_group_names = group_names
+    return group_names
+
+
+def has_group(user, *group_names):
+    """ Return True if the user is in at least one of the groups.
+    """
+    return not user_group_names(user).isdisjoint(group_names)
+
+
+async def ahas_group(user, *group_names):
+    return not (await auser_group_names(user)).isdisjoint(group_names)
+
+
+def group_required(*group_names):
+    """ Decorator for the views only allowed to the users in at least one of the groups.
+    The user must be loaded before, see async_views.login_required() for the async views.
+    """
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def _wrapped_async_view(request, *args, **kwargs):
+                if not await ahas_group(request.user, *group_names):
+                    return HttpResponseBadRequest('Permission denied')
+                return await view_func(request, *args, **kwargs)
+            return _wrapped_async_view
+
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            if not has_group(request.user, *group_names):
+                return HttpResponseBadRequest('Permission denied')
+            return view_func(request, *args, **kwargs)
+        return _wrapped_view
+    return decorator
@@ -65,6 +65,8 @@ jQuery(function ($) {
     }
 
     function extract_features_failure(data) {
+        var $indicator = $('#badge-extract-features');
+        $indicator.text(data['errors']['message']);
         // var form = $('#extract-features-form')[0];
 
         // Show mew errors
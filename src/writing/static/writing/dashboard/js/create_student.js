@@ -60,7 +60,11 @@ jQuery(function ($) {
     function extract_features_success($form, data) {
         reset_extract_features_form($form);
         var $indicator = $('#badgeCreateStudent');
-        $indicator.text("成功创建" + data["cnt_created"] + "个学生");
+        var message = "成功创建" + data["cnt_created"] + "个学生";
+        if (data["skipped"] && data["skipped"].length) {
+            message += "，跳过已存在的" + data["skipped"].length + "个账号: " + data["skipped"].join(", ");
+        }
+        $indicator.text(message);
         // $("#btn-extract").addClass("invisible");
         // $("#btn-download").removeClass("invisible");
     }
@@ -59,10 +59,33 @@ jQuery(function ($) {
 
     function extract_features_success($form, data) {
         reset_extract_features_form($form);
-        var $indicator = $('#badge-extract-features');
-        $indicator.text("成功提取"+data['cnt_extracted']+"个特征");
         $("#btn-extract").addClass("invisible");
-        $("#btn-download").removeClass("invisible");
+        poll_extraction_progress(data['progress_url']);
+    }
+
+    function poll_extraction_progress(progress_url) {
+        $.ajax({
+            type: 'GET',
+            url: progress_url,
+            dataType: 'json',
+            success: function(data) {
+                var $indicator = $('#badge-extract-features');
+                if (!data['finished']) {
+                    $indicator.text("提取中... " + data['processed'] + "/" + data['total']);
+                    setTimeout(function() { poll_extraction_progress(progress_url); }, 1000);
+                } else if (data['success']) {
+                    $indicator.text("成功提取" + (data['processed'] - data['failed']) + "个特征，失败" + data['failed'] + "个");
+                    $("#btn-download").removeClass("invisible");
+                } else {
+                    $indicator.text("提取失败");
+                    $("#btn-extract").removeClass("invisible");
+                }
+            },
+            error: function(xhr) {
+                // try again later, the job keeps running on the server
+                setTimeout(function() { poll_extraction_progress(progress_url); }, 5000);
+            }
+        });
     }
 
     function extract_features_failure(data) {
@@ -6,12 +6,8 @@ var inputTextArea = document.getElementById("EnglishWriting");
 
 if (document.getElementById("WritingForm")) {
     document.getElementById("WritingForm").addEventListener('submit', event => {
-        record["submitTime"] = new Date().getTime();
-        json_string = JSON.stringify(record);
-        document.getElementById("examRecord").value = json_string;
-        if (auto_save_json) {
-            saveTemplateAsFile(json_file_name, json_string);
-        }
+        event.preventDefault();
+        submitExam(event.target);
     });
 }
 
@@ -48,7 +44,14 @@ if (document.getElementById("WritingForm")) {
 // });
 
 
-var record = {"startTime": new Date().getTime(), "sequences": []};
+// Compact record format (version 2): each event is [dt, start, end, text, inputType],
+// i.e. the article after the event is prevArticle.slice(0, start) + text + prevArticle.slice(end).
+// dt is the time elapsed since the previous event (since startTime for the first one).
+// Positions are counted in unicode code points to match the server side.
+var RECORD_VERSION = 2;
+var record = {"version": RECORD_VERSION, "startTime": new Date().getTime(), "sequences": []};
+var lastArticle = "";
+var lastEventTime = record["startTime"];
 
 if (localStorage.getItem("second") != null) {
     second = localStorage.getItem("second");
@@ -107,97 +110,210 @@ function getInputSelection(el) {
     };
 }
 
+function hasSurrogates(text) {
+    return /[\uD800-\uDFFF]/.test(text);
+}
+
+function codePointIndex(text, index) {
+    // convert a UTF-16 index into a code point index
+    return Array.from(text.slice(0, index)).length;
+}
+
+function computeDelta(prevArticle, curArticle) {
+    // the edition is continuous, so find the common prefix and the common suffix
+    var start = 0;
+    var minLength = Math.min(prevArticle.length, curArticle.length);
+    while (start < minLength && prevArticle.charCodeAt(start) == curArticle.charCodeAt(start)) {
+        ++start;
+    }
+    var prevEnd = prevArticle.length;
+    var curEnd = curArticle.length;
+    while (prevEnd > start && curEnd > start && prevArticle.charCodeAt(prevEnd-1) == curArticle.charCodeAt(curEnd-1)) {
+        --prevEnd;
+        --curEnd;
+    }
+    var text = curArticle.slice(start, curEnd);
+    if (hasSurrogates(prevArticle) || hasSurrogates(curArticle)) {
+        // never split a surrogate pair
+        if (start > 0 && /[\uDC00-\uDFFF]/.test(curArticle.charAt(start)) && /[\uD800-\uDBFF]/.test(curArticle.charAt(start-1))) {
+            --start;
+        }
+        if (/[\uDC00-\uDFFF]/.test(prevArticle.charAt(prevEnd)) && prevEnd > start) {
+            ++prevEnd;
+            ++curEnd;
+        }
+        text = curArticle.slice(start, curEnd);
+        prevEnd = codePointIndex(prevArticle, prevEnd);
+        start = codePointIndex(prevArticle, start);
+    }
+    return {start: start, end: prevEnd, text: text};
+}
+
+function applyDelta(article, start, end, text) {
+    if (hasSurrogates(article)) {
+        var chars = Array.from(article);
+        return chars.slice(0, start).join("") + text + chars.slice(end).join("");
+    }
+    return article.slice(0, start) + text + article.slice(end);
+}
+
 function keyboardInput(event) {
-    timeNow = new Date();
-    positionInfo = getInputSelection(inputTextArea);
-    // currentText = document.getElementById("examRecord").value;
-    // document.getElementById("examRecord").value = currentText + '|' + positionInfo.start + ',' + event.data + ',' + event.inputType + ',' + timeNow.getTime();
-    // console.log(positionInfo);
-    
-        record["sequences"].push({"selectStart": selectStart,
-                                  "selectEnd": selectEnd,
-                                  "position": positionInfo.start-1,
-                                  "data": event.data,
-                                  "inputType": event.inputType,
-                                  "time": timeNow.getTime(),
-                                  "article": inputTextArea.value,
-                                });
+    timeNow = new Date().getTime();
+    curArticle = inputTextArea.value;
+    delta = computeDelta(lastArticle, curArticle);
+    record["sequences"].push([timeNow - lastEventTime, delta.start, delta.end, delta.text, event.inputType]);
+    lastArticle = curArticle;
+    lastEventTime = timeNow;
     selectStart = -1;
     selectEnd = -1;
-    
-    // document.getElementById("examRecord").value = JSON.stringify(record);
 }
 
-async function replayRecord() {
-    // clearInterval(myInterval);
-    // myInterval = setInterval(timer, 1000);
-    inputTextArea.value = "";
-    sequences = record["sequences"];
-    org_startTime = startTime = record["startTime"];
-    for (i=0; i < sequences.length; ++i) {
-        r = sequences[i];
-        // console.log(r);
-        position = r["position"];
-        data = r["data"];
-        inputType = r["inputType"];
-        t_selectStart = r["selectStart"]
-        t_selectEnd = r["selectEnd"]
-        waitTime = r["time"] - startTime;
-        startTime = r["time"];
-        if (i > 0) {
-            await sleep(waitTime/10);
+// The events are uploaded during the exam (see record_upload.py on the server side):
+// every UPLOAD_INTERVAL ms, the events not uploaded yet are posted as the chunk number uploadedChunks,
+// and posted again until the server acknowledges them. On submit, only the other events are posted.
+var UPLOAD_INTERVAL = 5000;
+var uploadedChunks = 0;
+var uploadedEvents = 0;
+var pendingChunkEnd = -1;  // the events of the chunk being posted end there
+var uploading = false;
+
+async function uploadChunk() {
+    if (uploading) {
+        return;
+    }
+    if (pendingChunkEnd < 0) {
+        if (record["sequences"].length == uploadedEvents) {
+            return;
+        }
+        pendingChunkEnd = record["sequences"].length;
+    }
+    uploading = true;
+    try {
+        const response = await fetch(append_record_url, {
+            method: "POST",
+            headers: {"X-CSRFToken": document.querySelector("[name=csrfmiddlewaretoken]").value},
+            body: new URLSearchParams({
+                seq: uploadedChunks,
+                startTime: record["startTime"],
+                events: JSON.stringify(record["sequences"].slice(uploadedEvents, pendingChunkEnd)),
+            }),
+        });
+        const data = await response.json();
+        if (data["success"]) {
+            uploadedChunks += 1;
+            uploadedEvents = pendingChunkEnd;
+            pendingChunkEnd = -1;
         }
-        second = Math.floor((startTime - org_startTime)/1000/60)
-        document.getElementById("TimeMinute").innerText = second;
-        if (r.hasOwnProperty("article")) {
-            inputTextArea.value = r["article"];
-        } else {
-            switch (inputType) {
-                case "insertText":
-                    currentValue = inputTextArea.value;
-                    if (t_selectStart == t_selectEnd) {
-                        if (data == null) {
-                            data = "\n";
-                        }
-                        inputTextArea.value = currentValue.slice(0, position) + data + currentValue.slice(position, currentValue.length);
-                    } else {
-                        inputTextArea.value = currentValue.slice(0, t_selectStart) + data + currentValue.slice(t_selectEnd, currentValue.length);
-                    }
-                    break;
-                case "deleteContentBackward":
-                case "deleteContentForward":
-                    currentValue = inputTextArea.value;
-                    if (t_selectStart == t_selectEnd) {
-                        inputTextArea.value = currentValue.slice(0, position+1) + currentValue.slice(position+2, currentValue.length);
-                    } else {
-                        inputTextArea.value = currentValue.slice(0, t_selectStart) + currentValue.slice(t_selectEnd, currentValue.length);
-                    }
-                    break;
-                case "insertLineBreak":
-                    currentValue = inputTextArea.value;
-                    data = "\n";
-                    if (t_selectStart == t_selectEnd) {
-                        inputTextArea.value = currentValue.slice(0, position) + data + currentValue.slice(position, currentValue.length);
-                    } else {
-                        inputTextArea.value = currentValue.slice(0, t_selectStart) + data + currentValue.slice(t_selectEnd, currentValue.length);
-                    }
-                    break;
-                case "insertReplacementText":
-                    console.warn("It uses insertReplacementText probably by grammarly or system auto correction!")
-                    // currentValue = inputTextArea.value;
-                    // if (t_selectStart == t_selectEnd) {
-                    //     inputTextArea.value = currentValue.slice(0, position) + data + currentValue.slice(position, currentValue.length);
-                    // } else {
-                    //     inputTextArea.value = currentValue.slice(0, t_selectStart) + data + currentValue.slice(t_selectEnd, currentValue.length);
-                    // }
-                    break;
-                default:
-                    console.warn("Unhandled events")
-                    console.warn(r);
+    } catch (error) {
+        // posted again at the next interval
+    } finally {
+        uploading = false;
+    }
+}
+
+function submittedRecord() {
+    // the record to post as examRecord: the events which were not uploaded
+    if (uploadedChunks == 0) {
+        return JSON.stringify(record);
+    }
+    var chunked = document.getElementById("examChunked");
+    chunked.value = uploadedChunks;
+    chunked.disabled = false;
+    return JSON.stringify({
+        "version": record["version"],
+        "startTime": record["startTime"],
+        "sequences": record["sequences"].slice(uploadedEvents),
+        "submitTime": record["submitTime"],
+    });
+}
+
+// The record is posted gzipped as the file examRecordGzip when the browser has CompressionStream,
+// else (or if that fails) as the examRecord field of the form.
+var submitting = false;
+
+async function submitExam(form) {
+    if (submitting) {
+        return;
+    }
+    submitting = true;
+    record["submitTime"] = new Date().getTime();
+    json_string = JSON.stringify(record);
+    if (auto_save_json) {
+        saveTemplateAsFile(json_file_name, json_string);
+    }
+    var submitted = submittedRecord();
+    if (typeof CompressionStream !== "undefined") {
+        try {
+            var stream = new Blob([submitted]).stream().pipeThrough(new CompressionStream("gzip"));
+            var formData = new FormData(form);
+            formData.delete("examRecord");
+            formData.set("examRecordGzip", await new Response(stream).blob(), "record.json.gz");
+            const response = await fetch(form.action, {method: "POST", body: formData});
+            if (response.redirected) {
+                window.location = response.url;
+                return;
+            }
+            if (response.ok) {
+                // an error message page
+                document.open();
+                document.write(await response.text());
+                document.close();
+                return;
+            }
+        } catch (error) {
+            // posted as a form field below
+        }
+    }
+    document.getElementById("examRecord").value = submitted;
+    form.submit();
+}
+
+// The replay fetches the record page by page from replay_data_url (see replay.py on the server side).
+// Each page has the article at its start and the compact events following it.
+var replayToken = 0;
+
+async function fetchReplayPage(params) {
+    const response = await fetch(replay_data_url + "?" + new URLSearchParams(params));
+    return response.json();
+}
+
+async function replayRecord(time) {
+    // starting a new replay (e.g. by seeking) stops the current one
+    var token = ++replayToken;
+    var seek = document.getElementById("ReplaySeek");
+    var page = await fetchReplayPage({t: time});
+    if (token != replayToken) {
+        return;
+    }
+    seek.max = page["duration"];
+    var article = page["article"];
+    var eventTime = page["time"];
+    inputTextArea.value = article;
+    while (true) {
+        // fetch the next page while this one is played
+        var nextPage = page["next_event"] === null ? null : fetchReplayPage({event: page["next_event"]});
+        var events = page["events"];
+        for (var i=0; i < events.length; ++i) {
+            var [dt, start, end, text, inputType] = events[i];
+            eventTime += dt;
+            await sleep(dt/10);
+            if (token != replayToken) {
+                return;
             }
+            second = Math.floor(eventTime/1000/60)
+            document.getElementById("TimeMinute").innerText = second;
+            seek.value = eventTime;
+            article = applyDelta(article, start, end, text);
+            inputTextArea.value = article;
+        }
+        if (nextPage === null) {
+            return;
+        }
+        page = await nextPage;
+        if (token != replayToken) {
+            return;
         }
     }
-    // clearInterval(myInterval);
 }
 
 function sleep(ms) {
@@ -0,0 +1,121 @@
+# coding=utf-8
+""" Random keystroke records, to benchmark the feature extraction without real data.
+
+The generated records are valid records of either format (see record_format.py):
+a student types words at a given speed, with pauses, backspaces, forward deletions,
+jumps to another position and replacements of a selection.
+"""
+import random
+
+from .record_format import RECORD_VERSION
+
+WORDS = (
+    'the a of students writing is was to and in that it for on with as be by this are from at or an '
+    'which we can more have not will their they one all has been would there think because people school '
+    'important example however believe learning teacher different problem should could time many'
+).split()
+PUNCTUATIONS = ',.?!;:'
+
+
+def generate_record(num_of_words=300, chars_per_minute=200, deletion_rate=0.08, jump_rate=0.02,
+                    selection_rate=0.01, pause_rate=0.05, legacy=False, seed=0, start_time=1600000000000):
+    """ Return (record, article) where record is a random record of num_of_words words
+    in the compact format (the legacy one if legacy), and article is the final article.
+
+    chars_per_minute is the mean typing speed, and the rates are the probabilities, before each word,
+    of deleting some chars, jumping to another position, replacing a selection and pausing
+    for a long time (more than 2s).
+    """
+    rnd = random.Random(seed)
+    key_interval = 60000 / chars_per_minute
+    timestamp = start_time + rnd.randint(1000, 60000)
+    last_event_time = start_time
+    article = ''
+    caret = 0
+    sequences = []
+
+    def edit(start, end, text, input_type, interval):
+        nonlocal timestamp, last_event_time, article, caret
+        timestamp += max(1, int(interval))
+        sequences.append([timestamp - last_event_time, start, end, text, input_type])
+        last_event_time = timestamp
+        article = article[:start] + text + article[end:]
+        caret = start + len(text)
+
+    def type_text(text, first_interval):
+        for i, char in enumerate(text):
+            interval = first_interval if i == 0 else key_interval * rnd.uniform(0.3, 1.7)
+            edit(caret, caret, char, 'insertLineBreak' if char == '\n' else 'insertText', interval)
+
+    num_of_typed_words = 0
+    while num_of_typed_words < num_of_words:
+        r = rnd.random()
+        if r < jump_rate and article:
+            # move the caret, the next edition is a jump
+            caret = rnd.randint(0, len(article))
+            timestamp += rnd.randint(300, 5000)
+        elif r < jump_rate + selection_rate and len(article) > 3:
+            start = rnd.randint(0, len(article) - 2)
+            end = rnd.randint(start + 1, min(len(article), start + 30))
+            # the selection is deleted or replaced by a typed char
+            char = rnd.choice('abcdefghijklmnopqrstuvwxyz') if rnd.random() < 0.5 else ''
+            if article[start:end] != char:
+                edit(start, end, char, 'insertText' if char else 'deleteContentBackward', rnd.randint(200, 4000))
+        elif r < jump_rate + selection_rate + deletion_rate and caret > 0:
+            for _ in range(1 if caret < 2 or rnd.random() < 0.8 else rnd.randint(2, min(caret, 10))):
+                if caret == 0:
+                    break
+                edit(caret - 1, caret, '', 'deleteContentBackward', key_interval * rnd.uniform(0.5, 2))
+            if caret < len(article) and rnd.random() < 0.1:
+                edit(caret, caret + 1, '', 'deleteContentForward', key_interval * rnd.uniform(0.5, 2))
+        else:
+            if rnd.random() < pause_rate:
+                first_interval = rnd.randint(2000, 30000)
+            else:
+                first_interval = key_interval * rnd.uniform(1, 6)
+            word = rnd.choice(WORDS)
+            r = rnd.random()
+            if r < 0.08:
+                word += rnd.choice(PUNCTUATIONS) + ' '
+            elif r < 0.1:
+                word += '\n'
+            else:
+                word += ' '
+            type_text(word, first_interval)
+            num_of_typed_words += 1
+
+    record = {
+        'version': RECORD_VERSION,
+        'startTime': start_time,
+        'sequences': sequences,
+        'submitTime': timestamp + rnd.randint(1000, 20000),
+    }
+    if legacy:
+        record = to_legacy(record)
+    return record, article
+
+
+def to_legacy(record):
+    """ Convert a compact record into the legacy format, as the browsers used to write it.
+    """
+    sequences = []
+    article = ''
+    timestamp = record['startTime']
+    for dt, start, end, text, input_type in record['sequences']:
+        timestamp += dt
+        is_selection = end - start > (0 if text else 1)
+        article = article[:start] + text + article[end:]
+        sequences.append({
+            'selectStart': start if is_selection else -1,
+            'selectEnd': end if is_selection else -1,
+            'position': start + len(text) - 1,
+            'data': None if input_type == 'insertLineBreak' else (text or None),
+            'inputType': input_type,
+            'time': timestamp,
+            'article': article,
+        })
+    return {
+        'startTime': record['startTime'],
+        'sequences': sequences,
+        'submitTime': record['submitTime'],
+    }
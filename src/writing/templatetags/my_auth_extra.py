@@ -1,7 +1,9 @@
 from django import template
 
+from writing.roles import has_group as user_has_group
+
 register = template.Library() 
 
 @register.filter(name='has_group') 
 def has_group(user, group_name):
-    return user.groups.filter(name=group_name).exists() 
\ No newline at end of file
+    return user_has_group(user, group_name)
@@ -1,3 +1,975 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import multiprocessing
+import random
+import re
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.hashers import check_password
+from django.contrib.auth.models import Group, User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import Client, LiveServerTestCase, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import bulk_accounts
+from .exports import features_rows, iter_features_json, record_features_rows
+from .extract_features import (
+    count_num_of_deleted_words,
+    count_num_of_inserted_words,
+    count_num_of_jump_words,
+    count_num_of_words,
+    decide_edition_range,
+    decide_operation_type,
+)
+from .feature_engine import extract_features_from_chunks
+from .fields import compress_text, iter_stored_text, stored_compressed, stored_value
+from .jobs import enqueue_extraction_job, run_queued_jobs
+from .models import ExtractionJob, RecordChunk, TeacherStudentRelation, WritingAssignment, WritingExam, WritingRecord
+from .record_format import dumps, final_article, is_compact, iter_record_events, loads, to_compact
+from .record_upload import delete_stale_chunks, save_exam_record
+from .replay import KEYFRAME_INTERVAL, get_replay_page
+from .roles import TEACHER
+from .synthetic import generate_record, to_legacy
+from .write_queue import close_write_connections, immediate_atomic
+
+
+def decide_edition_range_by_scanning(prev_article, cur_article):
+    """ The original char-by-char implementation of decide_edition_range(), kept as its reference.
+    """
+    s1 = s2 = e1 = e2 = -1
+
+    if prev_article is None or len(prev_article) == 0:
+        # start from the scratch
+        s1 = e1 = s2 = 0
+        e2 = len(cur_article)
+        return s1, e1, s2, e2
+    else:
+        # because the edition is continuous, so we only need to find the first and second different positions.
+        prev_i = cur_i = 0
+        while prev_i < len(prev_article) and cur_i < len(cur_article):
+            prev_char = prev_article[prev_i]
+            cur_char = cur_article[cur_i]
+
+            if prev_char != cur_char:
+                if s1 == -1:
+                    s1 = prev_i
+                    s2 = cur_i
+                    break
+            prev_i += 1
+            cur_i += 1
+
+        if s1 == -1:
+            s1 = s2 = prev_i  # prev_i == cur_i == min(len(prev_article), len(cur_article))
+        
+        if s1 == len(prev_article) or s2 == len(cur_article):
+            e1 = len(prev_article)
+            e2 = len(cur_article)
+
+            assert prev_article[0:s1] == cur_article[0:s2] and prev_article[e1:] == cur_article[e2:]
+            assert s1 == s2 and len(prev_article)-e1 == len(cur_article)-e2
+            return s1, e1, s2, e2
+
+        # now we know prev_article[0:s1] == cur_article[0:s2]
+        # so we need to find e1 and e2 st prev_article[e1:] == cur_article[e2:]
+        # Note that cur_articel can be considered as 
+        #   1) deleting a substring (empty or the whole string) from prev_article
+        #   2) (optional) add ONE char at s2
+        # So we can try to find the common suffix e1 and e2 in prev_article[s1:] and cur_article[s2:] (for delete) or cur_article[s2+1:] (for insertion)
+        prev_i = len(prev_article) - 1
+        cur_i = len(cur_article) - 1
+        while prev_i >= s1 and cur_i >= s2:
+            prev_char = prev_article[prev_i]
+            cur_char = cur_article[cur_i]
+
+            if prev_char != cur_char:
+                if e1 == -1:
+                    e1 = prev_i + 1
+                    e2 = cur_i + 1
+                    break
+            prev_i -= 1
+            cur_i -= 1
+
+        if e1 == -1:
+            e1 = prev_i + 1
+            e2 = cur_i + 1
+        
+        assert prev_article[0:s1] == cur_article[0:s2] and prev_article[e1:] == cur_article[e2:]
+        assert s1 == s2 and len(prev_article)-e1 == len(cur_article)-e2
+        return s1, e1, s2, e2
+
+
+def extract_features_by_articles(record, article, score):
+    """ The original implementation of extract_features(), which compares the whole articles of
+    the events of a legacy record (see record_format.py), kept as the reference of the feature engine.
+    """
+    start_time = record['startTime']
+    event_sequence = record['sequences']
+    submit_time = record['submitTime']
+    # num_of_words = len(article.split())
+    num_of_words = count_num_of_words(article)
+
+    if len(event_sequence) > 0:
+        planning_time = event_sequence[0]['time'] - start_time
+    
+    writing_time = submit_time - event_sequence[0]['time']
+
+    within_a_word_pause_list = []
+    between_words_pause_list =[]
+    between_paragraphs_pause_list = []
+    between_sentences_pause_list = []
+
+    last_in_word_timestamp = None
+    last_between_word_timestamp = None
+    last_paragraph_timestamp = None
+    last_sentence_timestamp = None
+
+    sequential_deleted_content = ''
+    sequential_deletion_length_list = []
+    preceding_deletion_content = ''
+    subsequent_deletion_content = ''
+    sequential_deletion_time = None
+    sequential_deletion_time_list = []
+
+    # sequential insertion means typing without pausing more than 2s (2000ms)
+    sequential_inserted_content = ''
+    sequential_insertion_length_list = []
+    preceding_insertion_content = ''
+    subsequent_insertion_content = ''
+    sequential_insertion_time = None
+    sequential_insertion_time_list = []
+
+    jump_length_list = []
+    jump_time_list = []
+
+    last_position = -1  # if last edition includes selection, it points to the end of the selection.
+    prev_article = ''
+    pre_sequential_char_insertion_timestamp = None
+
+    def handle_insertion():
+        nonlocal sequential_deleted_content
+        nonlocal sequential_deletion_time
+        nonlocal last_in_word_timestamp
+        nonlocal last_between_word_timestamp
+        nonlocal last_paragraph_timestamp
+        nonlocal last_sentence_timestamp
+        nonlocal pre_sequential_char_insertion_timestamp
+        nonlocal sequential_inserted_content
+        nonlocal sequential_insertion_time
+        nonlocal preceding_insertion_content
+        nonlocal subsequent_insertion_content
+
+        if sequential_deleted_content:
+            sequential_deletion_length_list.append(count_num_of_deleted_words(sequential_deleted_content, preceding_deletion_content, subsequent_deletion_content))
+            sequential_deletion_time_list.append(timestamp-sequential_deletion_time)
+        sequential_deleted_content = ''  # reset the deletion
+        sequential_deletion_time = None
+
+        if current_position != last_position+1:
+            # The editing position is not continuous
+            last_in_word_timestamp = None
+            last_between_word_timestamp = None
+            last_paragraph_timestamp = None
+            last_sentence_timestamp = None
+            pre_sequential_char_insertion_timestamp = None
+
+            sequential_inserted_content = ''
+            sequential_insertion_time = None
+
+            # handle jump edition
+            if current_position < last_position:
+                jump_length_list.append(count_num_of_jump_words(
+                    prev_article[end1:last_position+1],
+                    prev_article[:end1],
+                    prev_article[last_position+1:]
+                ))
+                jump_time_list.append(timestamp-prev_timestamp)
+            
+        else:
+            # only record sequential insertion when it's a continuous insertion and a long pause
+            if is_long_pause:
+                # end of a typing chunk so record it
+                if sequential_inserted_content:
+                    subsequent_insertion_content = prev_article[end1:]  # only the latest subsequent content matters.
+                    sequential_insertion_length_list.append(count_num_of_inserted_words(sequential_inserted_content, preceding_insertion_content, subsequent_insertion_content))
+                    sequential_insertion_time_list.append(timestamp-sequential_insertion_time)
+                # start a new typing chunk
+                sequential_inserted_content = cur_content
+                sequential_insertion_time = timestamp
+                preceding_insertion_content = prev_article[:start1]
+                
+            else:
+                if sequential_inserted_content:
+                    # within a typing chunk, so append the inserted content
+                    sequential_inserted_content = sequential_inserted_content + cur_content            
+
+        if cur_content == ' ':
+            # begin a new word (usually for between in word pause)
+            last_in_word_timestamp = None
+        elif cur_content in ',.?!;:':
+            # separated by punctuation
+            last_in_word_timestamp = None
+            last_between_word_timestamp = None
+            last_paragraph_timestamp = None
+            if last_sentence_timestamp is None and pre_sequential_char_insertion_timestamp is not None:
+                # assert pre_sequential_char_insertion_timestamp is not None
+                last_sentence_timestamp = pre_sequential_char_insertion_timestamp
+        elif cur_content == '\n':
+            # begin a new paragraph
+            last_in_word_timestamp = None
+            last_between_word_timestamp = None
+            last_sentence_timestamp = None
+            # find the most recent non-enter input
+            if last_paragraph_timestamp is None and pre_sequential_char_insertion_timestamp is not None:
+                # assert pre_sequential_char_insertion_timestamp is not None
+                last_paragraph_timestamp = pre_sequential_char_insertion_timestamp or timestamp                      
+        else:
+            # within a word
+            if last_in_word_timestamp is not None:
+                # within a word
+                within_a_word_pause_list.append(timestamp-last_in_word_timestamp)
+                last_sentence_timestamp = None
+                last_paragraph_timestamp = None
+            else:
+                # start a new word, compute the between in word pause for continouse edition
+                if last_between_word_timestamp is not None:
+                    assert last_sentence_timestamp is None
+                    assert last_paragraph_timestamp is None
+                    between_words_pause_list.append(timestamp-last_between_word_timestamp)
+
+                if last_sentence_timestamp is not None:
+                    assert last_between_word_timestamp is None
+                    between_sentences_pause_list.append(timestamp-last_sentence_timestamp)
+                    last_sentence_timestamp = None
+
+                if last_paragraph_timestamp is not None:
+                    assert last_between_word_timestamp is None
+                    between_paragraphs_pause_list.append(timestamp-last_paragraph_timestamp)
+                    last_paragraph_timestamp = None
+
+            last_in_word_timestamp = timestamp
+            last_between_word_timestamp = timestamp
+            pre_sequential_char_insertion_timestamp = timestamp
+
+    def handle_deletion():
+        nonlocal sequential_deleted_content
+        nonlocal preceding_deletion_content
+        nonlocal subsequent_deletion_content
+        nonlocal sequential_deletion_time
+        nonlocal sequential_inserted_content
+        nonlocal sequential_insertion_time
+
+        # reset them because this is not a sequential insertion
+        sequential_inserted_content = ''
+        sequential_insertion_time = None
+
+        # handle jump edition
+        if current_position < last_position:
+            jump_length_list.append(count_num_of_jump_words(
+                prev_article[end1:last_position+1],
+                prev_article[:end1],
+                prev_article[last_position+1:]
+            ))
+            jump_time_list.append(timestamp-prev_timestamp)
+
+        if sequential_deleted_content == '':
+            # this is a new deletion
+            preceding_deletion_content = prev_article[:start1]
+            subsequent_deletion_content = prev_article[end1:]
+            sequential_deletion_time = timestamp
+
+        if start1 == last_position+1:
+            # delete the subsequent selection
+            sequential_deleted_content = sequential_deleted_content + prev_content
+        elif end1 == last_position+1:
+            # delete the preceding selection
+            sequential_deleted_content = prev_content + sequential_deleted_content
+        else:
+            # delete another selection
+            if sequential_deleted_content:
+                sequential_deletion_length_list.append(count_num_of_deleted_words(sequential_deleted_content, preceding_deletion_content, subsequent_deletion_content))
+                sequential_deletion_time_list.append(timestamp-sequential_deletion_time)
+            sequential_deleted_content = prev_content
+            sequential_deletion_time = timestamp
+
+    for event_i, event in enumerate(event_sequence):
+        # current_position = event['position']  # this is not accurate, use end2-1.
+        input_type = event['inputType']
+        data = event['data']
+        timestamp = event['time']
+        cur_article = event['article']
+
+        start1, end1, start2, end2 = decide_edition_range(prev_article, cur_article)
+        current_position = end2-1  # this is the last char index if it's positive, this can be -1 if deleting the prefix
+
+
+        op_type, is_selection = decide_operation_type(start1, end1, start2, end2)
+        prev_content = prev_article[start1:end1]
+        cur_content = cur_article[start2:end2]
+
+        if event_i > 0:
+            prev_timestamp = event_sequence[event_i-1]['time']
+        else:
+            prev_timestamp = timestamp
+
+        is_long_pause = (timestamp-prev_timestamp) >= 2000
+
+        # everything with selection are not within a word
+        if is_selection:
+            # The editing with selection is not continuous
+            last_in_word_timestamp = None
+            last_between_word_timestamp = None
+            last_paragraph_timestamp = None
+            last_sentence_timestamp = None
+            pre_sequential_char_insertion_timestamp = None
+            sequential_inserted_content = ''
+            sequential_insertion_time = None
+
+            if op_type == 'insert':
+                handle_insertion()
+            elif op_type == 'delete':
+                handle_deletion()
+            else:
+                raise NotImplementedError(f'This [{op_type}] has not been supported yet')
+        else:
+            if op_type == 'insert':
+                handle_insertion()
+            elif op_type == 'delete':
+                # It's not insertion operation
+                last_in_word_timestamp = None
+                last_between_word_timestamp = None
+                last_paragraph_timestamp = None
+                last_sentence_timestamp = None
+                pre_sequential_char_insertion_timestamp = None
+
+                handle_deletion()
+            else:
+                raise NotImplementedError(f'This [{op_type}] has not been supported yet')
+
+
+        prev_article = cur_article
+        last_position = current_position
+
+    # only keep the results whose deletion length > 0.
+    sequential_deletion_time_list = [t for t, l in zip(sequential_deletion_time_list, sequential_deletion_length_list) if l > 0]
+    sequential_deletion_length_list = [x for x in sequential_deletion_length_list if x > 0]
+    sequential_insertion_time_list = [t for t, l in zip(sequential_insertion_time_list, sequential_insertion_length_list) if l > 0]
+    sequential_insertion_length_list = [x for x in sequential_insertion_length_list if x > 0]
+    jump_time_list = [t for t, l in zip(jump_time_list, jump_length_list) if l > 0]
+    jump_length_list = [x for x in jump_length_list if x > 0]
+
+    features_dict = {
+        'score':    score,
+        'tottime':  writing_time,
+        'platime':  planning_time,
+        'numword':  num_of_words,
+        'witpau':   within_a_word_pause_list,
+        'bewpau':   between_words_pause_list,
+        'parpau':   between_paragraphs_pause_list,
+        'senpau':   between_sentences_pause_list,
+        'dellen':   sequential_deletion_length_list,
+        'deltime':  sequential_deletion_time_list,
+        'numchun':  len(sequential_insertion_length_list),
+        'chuword':  sequential_insertion_length_list,
+        'chutime':  sequential_insertion_time_list,
+        'numjump':  len(jump_time_list),
+        'jumptime': jump_time_list,
+        'jumpword': jump_length_list,
+    }
+    return features_dict
+
+
+class RecordFormatTest(SimpleTestCase):
+    # the positions are in code points, the browser converts its UTF-16 positions (see Exercise.js)
+    record = {
+        'version': 2,
+        'startTime': 1000,
+        'sequences': [
+            [500, 0, 0, 'a', 'insertText'],
+            [100, 1, 1, '\U0001F600', 'insertText'],
+            [100, 2, 2, '中', 'insertText'],
+            [100, 3, 3, '\n', 'insertLineBreak'],
+            [100, 4, 4, '\U0001D11E', 'insertText'],
+            [100, 1, 2, '', 'deleteContentBackward'],
+            [2500, 0, 2, 'b', 'insertText'],
+        ],
+        'submitTime': 5000,
+    }
+    articles = ['a', 'a\U0001F600', 'a\U0001F600中', 'a\U0001F600中\n', 'a\U0001F600中\n\U0001D11E',
+                'a中\n\U0001D11E', 'b\n\U0001D11E']
+
+    def test_round_trip(self):
+        legacy_record = to_legacy(self.record)
+        self.assertEqual([event['article'] for event in legacy_record['sequences']], self.articles)
+        self.assertEqual(to_compact(legacy_record), self.record)
+        self.assertIs(to_compact(self.record), self.record)
+        for record in [self.record, legacy_record]:
+            self.assertEqual(final_article(record), self.articles[-1])
+            self.assertEqual(loads(dumps(record)), record)
+        # the surrogate pairs are written as they are
+        self.assertIn('\U0001F600', dumps(self.record))
+
+    def test_iter_record_events(self):
+        for record in [self.record, to_legacy(self.record)]:
+            text = dumps(record)
+            for chunk_size in [1, 3, len(text)]:
+                with self.subTest(compact=is_compact(record), chunk_size=chunk_size):
+                    header = {}
+                    events = iter_record_events([text[i:i + chunk_size] for i in range(0, len(text), chunk_size)], header)
+                    self.assertEqual([event['article'] for event in events], self.articles)
+                    self.assertEqual((header['startTime'], header['submitTime']), (1000, 5000))
+
+
+class CompressedRecordTest(TestCase):
+    text = dumps(generate_record(num_of_words=50, seed=1)[0])
+
+    def setUp(self):
+        self.exam = WritingExam.objects.create(title='Compressed', description='Write.')
+
+    def create_record(self, record):
+        student = User.objects.create_user(f'student{User.objects.count()}')
+        return WritingRecord.objects.create(user=student, exam=self.exam, article='', record=record, datetime=timezone.now()).pk
+
+    def stored(self, record_id):
+        return WritingRecord.objects.filter(pk=record_id).values_list(stored_value('record'), flat=True).get()
+
+    def test_round_trip(self):
+        for compression, marker in [('zlib', b'Z'), ('lzma', b'X'), ('gzip', b'G')]:
+            with self.subTest(compression=compression):
+                record_id = self.create_record(compress_text(self.text, compression))
+                stored = bytes(self.stored(record_id))
+                self.assertEqual(stored[:1], marker)
+                self.assertEqual(WritingRecord.objects.with_record().get(pk=record_id).record, self.text)
+                self.assertEqual(''.join(iter_stored_text(stored, chunk_size=100)), self.text)
+        # as compressed by a browser
+        record_id = self.create_record(stored_compressed(gzip.compress(self.text.encode('utf-8'))))
+        self.assertEqual(WritingRecord.objects.with_record().get(pk=record_id).record, self.text)
+        # a str is compressed with the compression of the field, except the empty string
+        record_id = self.create_record(self.text)
+        self.assertEqual(bytes(self.stored(record_id))[:1], b'Z')
+        self.assertEqual(self.stored(self.create_record('')), '')
+
+    def test_record_deferred(self):
+        self.create_record(self.text)
+        with CaptureQueriesContext(connection) as queries:
+            records = list(WritingRecord.objects.all())
+        self.assertNotIn('"record"', queries[0]['sql'])
+        self.assertIn('record', records[0].get_deferred_fields())
+
+        with CaptureQueriesContext(connection) as queries:
+            records = list(WritingRecord.objects.with_record())
+        self.assertIn('"writing_writingrecord"."record"', queries[0]['sql'])
+        self.assertEqual(records[0].record, self.text)
+
+    def test_compress_records(self):
+        plain_id = self.create_record('')
+        with connection.cursor() as cursor:
+            # written before the field was compressed
+            cursor.execute('UPDATE writing_writingrecord SET record = %s WHERE id = %s', [self.text, plain_id])
+        zlib_id = self.create_record(self.text)
+        lzma_id = self.create_record(compress_text(self.text, 'lzma'))
+        zlib_stored = bytes(self.stored(zlib_id))
+
+        out = io.StringIO()
+        call_command('compress_records', stdout=out)
+        # the records already compressed with zlib are skipped, the others are compressed with zlib
+        self.assertIn('Compressed 2 records', out.getvalue())
+        self.assertEqual(bytes(self.stored(zlib_id)), zlib_stored)
+        for record_id in [plain_id, lzma_id]:
+            self.assertEqual(bytes(self.stored(record_id))[:1], b'Z')
+        self.assertEqual(set(WritingRecord.objects.with_record().values_list('record', flat=True)), {self.text})
+
+
+class ExamRushTest(LiveServerTestCase):
+    """ Many students opening the exam and submitting it at the same time, through a real server.
+    """
+    num_of_students = 100
+    num_of_threads = 40
+
+    def setUp(self):
+        self.exam = WritingExam.objects.create(title='Exam rush', description='Write.', time=60)
+        self.session_ids = []
+        for i in range(self.num_of_students):
+            student = User.objects.create_user(f'student{i}')
+            WritingAssignment.objects.create(student=student, exam=self.exam)
+            client = Client()
+            client.force_login(student)
+            self.session_ids.append(client.cookies[settings.SESSION_COOKIE_NAME].value)
+
+    def tearDown(self):
+        # the connection of the write thread would keep the test database open
+        close_write_connections()
+
+    def open_exam(self, session_id):
+        """ Open the exam as the student of the session, return the cookies and the csrf token to submit it.
+        """
+        cookie = f'{settings.SESSION_COOKIE_NAME}={session_id}'
+        with urlopen(Request(self.live_server_url + '/writing/exam/', headers={'Cookie': cookie})) as response:
+            page = response.read().decode('utf-8')
+            csrf_cookie = re.search(settings.CSRF_COOKIE_NAME + r'=([^;]+)', response.headers['Set-Cookie']).group(1)
+        csrf_token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', page).group(1)
+        return f'{cookie}; {settings.CSRF_COOKIE_NAME}={csrf_cookie}', csrf_token
+
+    def submit_exam(self, cookies, csrf_token):
+        """ Submit the exam, return the status and the url of the response.
+        """
+        record = {'version': 2, 'startTime': 0, 'sequences': [[10, 0, 0, 'a', 'insertText']], 'submitTime': 20}
+        data = urlencode({
+            'csrfmiddlewaretoken': csrf_token,
+            'EnglishWriting': 'a',
+            'examRecord': json.dumps(record),
+        }).encode('utf-8')
+        request = Request(self.live_server_url + f'/writing/record/{self.exam.pk}/', data=data, headers={'Cookie': cookies})
+        with urlopen(request) as response:
+            return response.status, response.url
+
+    def take_exam(self, session_id):
+        """ Open the exam and submit it as the student of the session, return the status and the url of the response.
+        """
+        return self.submit_exam(*self.open_exam(session_id))
+
+    def test_wal_mode(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0].lower(), 'wal')
+
+    def test_concurrent_submissions(self):
+        with ThreadPoolExecutor(self.num_of_threads) as executor:
+            results = list(executor.map(self.take_exam, self.session_ids))
+
+        for status, url in results:
+            self.assertEqual(status, 200)
+            self.assertTrue(url.endswith('/writing/thank-you/'), url)
+        self.assertEqual(WritingRecord.objects.filter(exam=self.exam).count(), self.num_of_students)
+        self.assertFalse(WritingAssignment.objects.filter(exam=self.exam, access_time__isnull=True).exists())
+
+    def test_double_submissions(self):
+        cookies, csrf_token = self.open_exam(self.session_ids[0])
+        with ThreadPoolExecutor(self.num_of_threads) as executor:
+            results = list(executor.map(lambda _: self.submit_exam(cookies, csrf_token), range(self.num_of_threads)))
+
+        # the first submission is saved, the others are refused by the unique constraint of (user, exam)
+        self.assertEqual(sum(url.endswith('/writing/thank-you/') for _, url in results), 1)
+        self.assertEqual(WritingRecord.objects.filter(exam=self.exam).count(), 1)
+
+
+class ImmediateTransactionTest(TransactionTestCase):
+    def begin_statements(self, atomic):
+        with CaptureQueriesContext(connection) as queries:
+            with atomic():
+                WritingExam.objects.count()
+        return [query['sql'] for query in queries if query['sql'].startswith('BEGIN')]
+
+    def test_only_write_paths_take_the_lock(self):
+        self.assertEqual(self.begin_statements(transaction.atomic), ['BEGIN'])
+        self.assertEqual(self.begin_statements(immediate_atomic), ['BEGIN IMMEDIATE'])
+        self.assertEqual(self.begin_statements(transaction.atomic), ['BEGIN'])
+
+
+class DecideEditionRangeTest(SimpleTestCase):
+    def test_editions(self):
+        # (prev_article, cur_article, (s1, e1, s2, e2)), see decide_edition_range()
+        cases = [
+            ('abcd', 'abcde', (4, 4, 4, 5)),
+            ('abcd', 'abc', (3, 4, 3, 3)),
+            ('abcd', 'eabcd', (0, 0, 0, 1)),
+            ('abcd', 'bcd', (0, 1, 0, 0)),
+            ('abcd', 'abced', (3, 3, 3, 4)),
+            ('abcd', 'abd', (2, 3, 2, 2)),
+            ('abcd', 'abe', (2, 4, 2, 3)),
+            ('abcd', 'ab', (2, 4, 2, 2)),
+            ('abcd', 'aed', (1, 3, 1, 2)),
+            ('abcd', 'ad', (1, 3, 1, 1)),
+            ('abcd', 'ecd', (0, 2, 0, 1)),
+            ('abcd', 'cd', (0, 2, 0, 0)),
+            ('acd', 'acd', (3, 3, 3, 3)),
+        ]
+        for prev_article, cur_article, expected in cases:
+            with self.subTest(prev_article=prev_article, cur_article=cur_article):
+                self.assertEqual(decide_edition_range(prev_article, cur_article), expected)
+
+    def test_hints(self):
+        # the hints only speed up the search, the results must not change
+        self.assertEqual(decide_edition_range('aaa', 'aaaa', hint=(1, 1, 1)), (3, 3, 3, 4))
+        # a wrong hint
+        self.assertEqual(decide_edition_range('abcd', 'abd', hint=(0, 1, 0)), (2, 3, 2, 2))
+
+    def test_random_editions(self):
+        rnd = random.Random(0)
+        for _ in range(2000):
+            prev_article = ''.join(rnd.choice('ab ') for _ in range(rnd.randint(0, 30)))
+            start = rnd.randint(0, len(prev_article))
+            end = rnd.randint(start, len(prev_article))
+            text = ''.join(rnd.choice('ab ') for _ in range(rnd.randint(0, 2)))
+            cur_article = prev_article[:start] + text + prev_article[end:]
+            hint = (start, end, len(text))
+            expected = decide_edition_range_by_scanning(prev_article, cur_article)
+            self.assertEqual(decide_edition_range(prev_article, cur_article), expected)
+            self.assertEqual(decide_edition_range(prev_article, cur_article, hint=hint), expected)
+            self.assertEqual(decide_edition_range(prev_article, cur_article, hint=hint, verify_hint=False), expected)
+
+
+class FeatureEngineTest(SimpleTestCase):
+    def test_same_features_as_by_articles(self):
+        """ The engine extracts the features of the original implementation, from both formats.
+        """
+        rates = [
+            {},
+            {'deletion_rate': 0.3, 'jump_rate': 0.1, 'selection_rate': 0.1},
+            {'deletion_rate': 0, 'jump_rate': 0, 'selection_rate': 0, 'pause_rate': 0.3},
+            {'chars_per_minute': 40, 'jump_rate': 0.2},
+        ]
+        for seed in range(40):
+            with self.subTest(seed=seed):
+                record, article = generate_record(num_of_words=100, seed=seed, **rates[seed % len(rates)])
+                legacy_record = to_legacy(record)
+                expected = json.dumps(extract_features_by_articles(legacy_record, article, seed))
+                for r in [record, legacy_record]:
+                    features = extract_features_from_chunks([dumps(r)], article, seed)
+                    self.assertEqual(json.dumps(features), expected)
+
+
+class SyntheticRecordTest(SimpleTestCase):
+    def test_seeds(self):
+        for seed in range(300):
+            with self.subTest(seed=seed):
+                record, article = generate_record(num_of_words=30, deletion_rate=0.3, seed=seed)
+                self.assertEqual(final_article(record), article)
+                self.assertEqual(final_article(to_legacy(record)), article)
+
+
+@override_settings(WRITING_JOBS_IN_PROCESS=False, WRITING_JOB_STALE_SECONDS=60)
+class ExtractionJobTest(TestCase):
+    def test_enqueue_once(self):
+        job = enqueue_extraction_job()
+        self.assertEqual(enqueue_extraction_job().pk, job.pk)
+        self.assertEqual(ExtractionJob.objects.count(), 1)
+
+    def test_stale_running_job(self):
+        job = enqueue_extraction_job()
+        # the process running the job stopped 2 minutes ago
+        ExtractionJob.objects.filter(pk=job.pk).update(
+            status=ExtractionJob.STATUS_RUNNING, heartbeat_time=timezone.now() - timedelta(minutes=2),
+        )
+        new_job = enqueue_extraction_job()
+        self.assertNotEqual(new_job.pk, job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExtractionJob.STATUS_FAILED)
+
+        self.assertEqual(run_queued_jobs(), 1)
+        new_job.refresh_from_db()
+        self.assertEqual(new_job.status, ExtractionJob.STATUS_DONE)
+
+
+class ExamRecordListTest(TestCase):
+    def setUp(self):
+        self.exams = [WritingExam.objects.create(title=f'Exam {i}', description='Write.') for i in range(2)]
+        self.teacher = User.objects.create_user('teacher')
+        self.teacher.groups.add(Group.objects.create(name=TEACHER))
+
+    def add_student(self, exam=None):
+        student = User.objects.create_user(f'{self.teacher.username}_{User.objects.count():03}')
+        TeacherStudentRelation.objects.create(teacher=self.teacher, student=student)
+        if exam is not None:
+            WritingAssignment.objects.create(student=student, exam=exam)
+        return student
+
+    def add_students(self, num_of_students):
+        """ Add students assigned to the exams in turn, the even ones having submitted the exam
+        (and an exam they are not assigned to anymore), and one student without exam.
+        Return the expected rows of the students.
+        """
+        expected = []
+        for i in range(num_of_students):
+            exam = self.exams[i % 2]
+            student = self.add_student(exam)
+            record_id = score = None
+            if i % 2 == 0:
+                score = i
+                record_id = WritingRecord.objects.create(
+                    user=student, exam=exam, article='a', record='{}', datetime=timezone.now(), score=score,
+                ).pk
+                WritingRecord.objects.create(
+                    user=student, exam=self.exams[1], article='b', record='{}', datetime=timezone.now(), score=-2,
+                )
+            expected.append((student.username, exam.pk, record_id, score))
+        expected.append((self.add_student().username, None, None, None))
+        return expected
+
+    def get_rows(self):
+        response = self.client.get('/writing/dashboard/exam-record-list/')
+        self.assertEqual(response.status_code, 200)
+        return [
+            (student.username, exam.pk if exam else None, record_id, score)
+            for _teacher, student, exam, record_id, score, _datetime in response.context['exam_records']
+        ]
+
+    def test_single_query(self):
+        self.client.force_login(self.teacher)
+        expected = self.add_students(2)
+        # the session, the user, their groups and the list
+        with self.assertNumQueries(4):
+            self.assertEqual(self.get_rows(), expected)
+        expected += self.add_students(20)
+        with self.assertNumQueries(4):
+            self.assertEqual(self.get_rows(), expected)
+
+
+class FeaturesExportTest(TestCase):
+    def create_records(self):
+        self.exams = [WritingExam.objects.create(title=f'Exam {i}', description='Write.') for i in range(2)]
+        alice = User.objects.create_user('alice')
+        bob = User.objects.create_user('bob')
+        for user, exam, features in [(alice, self.exams[0], '{"numword": 1}'), (bob, self.exams[0], '{"numword": 2}'),
+                                     (alice, self.exams[1], '{"numword": 3}'), (bob, self.exams[1], '')]:
+            WritingRecord.objects.create(
+                user=user, exam=exam, article='a', record='', datetime=timezone.now(), features=features,
+            )
+
+    def test_one_key_per_user(self):
+        self.create_records()
+        # as the json.dumps() of {username: features} filled in the order of the records
+        self.assertEqual(''.join(iter_features_json(features_rows())), '{"alice": {"numword": 3}, "bob": {"numword": 2}}')
+
+    def test_one_row_per_record(self):
+        self.create_records()
+        rows = [(exam_id, username, features) for _, exam_id, username, features in record_features_rows()]
+        self.assertEqual(rows, [
+            (self.exams[0].pk, 'alice', '{"numword": 1}'),
+            (self.exams[0].pk, 'bob', '{"numword": 2}'),
+            (self.exams[1].pk, 'alice', '{"numword": 3}'),
+        ])
+
+
+class BulkAccountsTest(TestCase):
+    def setUp(self):
+        self.teacher = User.objects.create_user('teacher')
+
+    def test_skip_existing(self):
+        User.objects.create_user('teacher_2')
+        cnt_created, skipped = bulk_accounts.create_student_accounts(self.teacher, ['1', '2', '3', '1'], workers=1)
+        self.assertEqual((cnt_created, skipped), (2, ['teacher_2']))
+        self.assertTrue(User.objects.get(username='teacher_3').check_password('3'))
+        self.assertEqual(TeacherStudentRelation.objects.filter(teacher=self.teacher).count(), 2)
+
+    def test_normalized_usernames(self):
+        User.objects.create_user('teacher_2')
+        # the full width digits are normalized (NFKC) as create_user() does
+        cnt_created, skipped = bulk_accounts.create_student_accounts(self.teacher, ['\uff12', '\uff13'], workers=1)
+        self.assertEqual((cnt_created, skipped), (1, ['teacher_2']))
+        self.assertTrue(User.objects.filter(username='teacher_3').exists())
+
+    def test_password_pool(self):
+        passwords = [str(i) for i in range(bulk_accounts.MIN_PASSWORDS_FOR_POOL)]
+        hashes = bulk_accounts.hash_passwords(passwords, workers=2)
+        self.assertEqual(len(hashes), len(passwords))
+        self.assertTrue(check_password(passwords[0], hashes[0]))
+        self.assertTrue(check_password(passwords[-1], hashes[-1]))
+        # the processes of the pool are stopped
+        self.assertEqual(multiprocessing.active_children(), [])
+
+    def test_created_meanwhile(self):
+        existing_usernames = bulk_accounts._existing_usernames
+        calls = []
+
+        def created_after_the_check(usernames):
+            # the first check happens before another import creates teacher_2
+            calls.append(usernames)
+            if len(calls) == 1:
+                User.objects.create_user('teacher_2')
+                return set()
+            return existing_usernames(usernames)
+
+        with mock.patch.object(bulk_accounts, '_existing_usernames', created_after_the_check):
+            cnt_created, skipped = bulk_accounts.create_student_accounts(self.teacher, ['1', '2', '3'], workers=1)
+        self.assertEqual((cnt_created, skipped), (2, ['teacher_2']))
+        self.assertEqual(TeacherStudentRelation.objects.filter(teacher=self.teacher).count(), 2)
+
+
+@override_settings(WRITING_SERIALIZED_WRITES=False)
+class RecordUploadTest(TestCase):
+    def setUp(self):
+        self.exam = WritingExam.objects.create(title='Upload', description='Write.')
+        self.student = User.objects.create_user('student')
+        WritingAssignment.objects.create(student=self.student, exam=self.exam)
+        self.events = [[5, 0, 0, 'a', 'insertText'], [3, 1, 1, 'b', 'insertText'], [4, 2, 2, 'c', 'insertText']]
+
+    def record(self, events):
+        return dumps({'version': 2, 'startTime': 100, 'sequences': events, 'submitTime': 200})
+
+    def submit(self, **data):
+        # the error pages log the student out
+        self.client.force_login(self.student)
+        return self.client.post(f'/writing/record/{self.exam.pk}/', dict({'EnglishWriting': 'abc'}, **data))
+
+    def submit_gzip(self, data, **extra):
+        return self.submit(examRecordGzip=SimpleUploadedFile('record.json.gz', data), **extra)
+
+    def assertSubmitted(self, response, events):
+        self.assertRedirects(response, '/writing/thank-you/', fetch_redirect_response=False)
+        record = WritingRecord.objects.with_record().get(user=self.student, exam=self.exam)
+        self.assertEqual(loads(record.record)['sequences'], events)
+
+    def test_gzip_record(self):
+        self.assertSubmitted(self.submit_gzip(gzip.compress(self.record(self.events).encode('utf-8'))), self.events)
+
+    def test_submitted_twice(self):
+        self.assertIsNotNone(save_exam_record(self.student, self.exam, 'abc', self.record(self.events)))
+        # refused by the unique constraint of (user, exam)
+        self.assertIsNone(save_exam_record(self.student, self.exam, 'abd', self.record(self.events)))
+        self.assertEqual(list(WritingRecord.objects.filter(user=self.student).values_list('article', flat=True)), ['abc'])
+
+    def append_chunk(self, seq, events):
+        response = self.client.post(f'/writing/record/{self.exam.pk}/append/', {
+            'seq': seq, 'startTime': 100, 'events': json.dumps(events),
+        })
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_chunks(self):
+        self.client.force_login(self.student)
+        # out of order, and repeated with other events
+        self.assertEqual(self.append_chunk(1, self.events[1:2])['stored'], True)
+        self.assertEqual(self.append_chunk(0, self.events[:1])['stored'], True)
+        self.assertEqual(self.append_chunk(0, self.events[2:])['stored'], False)
+        self.assertEqual(RecordChunk.objects.filter(user=self.student).count(), 2)
+
+        self.assertSubmitted(self.submit(chunked=2, examRecord=self.record(self.events[2:])), self.events)
+        self.assertFalse(RecordChunk.objects.filter(user=self.student).exists())
+        self.client.force_login(self.student)
+        self.assertEqual(self.append_chunk(2, self.events[:1])['success'], False)
+
+    def test_missing_chunk(self):
+        self.client.force_login(self.student)
+        self.append_chunk(1, self.events[1:2])
+        self.assertContains(self.submit(chunked=2, examRecord=self.record(self.events[2:])), '提交失败')
+        self.assertFalse(WritingRecord.objects.filter(user=self.student).exists())
+        self.assertEqual(RecordChunk.objects.filter(user=self.student).count(), 1)
+
+    @override_settings(WRITING_CHUNK_MAX_AGE_SECONDS=60)
+    def test_delete_stale_chunks(self):
+        other_exam = WritingExam.objects.create(title='Other', description='Write.')
+        old_time = timezone.now() - timedelta(seconds=120)
+        for exam, seq, received_time in [(self.exam, 0, old_time), (self.exam, 1, timezone.now()),
+                                         (other_exam, 0, old_time), (other_exam, 1, old_time)]:
+            chunk = RecordChunk.objects.create(user=self.student, exam=exam, seq=seq, start_time=100, events='[]')
+            RecordChunk.objects.filter(pk=chunk.pk).update(received_time=received_time)
+
+        # the exam still being written is kept, the abandoned one is deleted
+        self.assertEqual(delete_stale_chunks(), 2)
+        self.assertEqual(list(RecordChunk.objects.values_list('exam', 'seq').order_by('seq')), [(self.exam.pk, 0), (self.exam.pk, 1)])
+
+        # the chunks left by a submitted exam
+        WritingRecord.objects.create(user=self.student, exam=self.exam, article='', record='', datetime=timezone.now())
+        self.assertEqual(delete_stale_chunks(), 2)
+
+    def test_invalid_gzip_record(self):
+        record = gzip.compress(self.record(self.events).encode('utf-8'))
+        for name, data in [
+            ('not json', gzip.compress(b'not a record')),
+            ('truncated', record[:len(record) // 2]),
+            ('truncated json', gzip.compress(self.record(self.events)[:-10].encode('utf-8'))),
+            ('invalid event', gzip.compress(self.record([[5, 0, 0, 1, 'insertText']]).encode('utf-8'))),
+            ('no startTime', gzip.compress(b'{"version": 2, "sequences": []}')),
+        ]:
+            with self.subTest(name):
+                response = self.submit_gzip(data)
+                self.assertContains(response, '提交失败')
+                self.assertFalse(WritingRecord.objects.filter(user=self.student).exists())
+
+
+class ArchiveDuplicateRecordsTest(TransactionTestCase):
+    """ The migration adding the unique constraint of (user, exam) moves the duplicate records to ArchivedWritingRecord.
+    """
+    before = [('writing', '0016_recordchunk')]
+    after = [('writing', '0017_writingrecord_unique_user_exam')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_archive_and_restore(self):
+        apps = self.migrate(self.before)
+        user = apps.get_model('auth', 'User').objects.create(username='student')
+        exam = apps.get_model('writing', 'WritingExam').objects.create(title='Exam', description='Write.')
+        records = apps.get_model('writing', 'WritingRecord').objects
+        record_ids = [
+            records.create(user=user, exam=exam, article=article, record='{}', datetime=timezone.now()).pk
+            for article in ['first', 'second']
+        ]
+
+        apps = self.migrate(self.after)
+        self.assertEqual(list(apps.get_model('writing', 'WritingRecord').objects.values_list('pk', 'article')),
+                         [(record_ids[0], 'first')])
+        archived = apps.get_model('writing', 'ArchivedWritingRecord').objects.get()
+        self.assertEqual((archived.original_id, archived.user_id, archived.article, archived.record),
+                         (record_ids[1], user.pk, 'second', '{}'))
+
+        apps = self.migrate(self.before)
+        self.assertEqual(list(apps.get_model('writing', 'WritingRecord').objects.order_by('pk').values_list('pk', 'user', 'article')),
+                         [(record_ids[0], user.pk, 'first'), (record_ids[1], user.pk, 'second')])
+
+
+class ReplayPageTest(TestCase):
+    def setUp(self):
+        self.exam = WritingExam.objects.create(title='Replay', description='Write.')
+
+    def create_record(self, record, article):
+        return WritingRecord.objects.create(
+            exam=self.exam, article=article, record=dumps(record), datetime=timezone.now(),
+        ).pk
+
+    def test_pages(self):
+        record, article = generate_record(num_of_words=400, seed=0)
+        events = record['sequences']
+        self.assertGreater(len(events), 3 * KEYFRAME_INTERVAL)
+        record_id = self.create_record(record, article)
+
+        articles = ['']
+        times = []
+        elapsed = 0
+        for dt, start, end, text, _input_type in events:
+            articles.append(articles[-1][:start] + text + articles[-1][end:])
+            elapsed += dt
+            times.append(elapsed)
+        self.assertEqual(articles[-1], article)
+
+        for event in [0, 1, KEYFRAME_INTERVAL - 1, KEYFRAME_INTERVAL, KEYFRAME_INTERVAL + 1, len(events) - 1, len(events)]:
+            page = get_replay_page(record_id, event=event)
+            self.assertEqual(page['article'], articles[event])
+            self.assertEqual(page['time'], times[event - 1] if event else 0)
+            self.assertEqual(page['events'], events[event:event + len(page['events'])])
+        for time in [0, times[KEYFRAME_INTERVAL], times[-1] // 2, times[-1] + 1]:
+            page = get_replay_page(record_id, time=time)
+            self.assertEqual(page['event'], bisect_right(times, time))
+            self.assertEqual(page['article'], articles[page['event']])
+
+        # the pages cover all the events
+        replayed = []
+        event = 0
+        while event is not None:
+            page = get_replay_page(record_id, event=event)
+            replayed += page['events']
+            event = page['next_event']
+        self.assertEqual(replayed, events)
+
+    def test_empty_record(self):
+        record_id = self.create_record({'version': 2, 'startTime': 0, 'sequences': [], 'submitTime': 10}, '')
+        page = get_replay_page(record_id, time=5)
+        self.assertEqual((page['event'], page['article'], page['events'], page['next_event']), (0, '', [], None))
+        self.assertEqual(page['duration'], 10)
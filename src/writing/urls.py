@@ -11,8 +11,10 @@ urlpatterns = [
     path('exam/', views.exam, name='exam'),
     path('thank-you/', views.thank_you, name='thank_you'),
     path('record/<int:exam_id>/', views.record_exam, name='record_exam'),
+    path('record/<int:exam_id>/append/', views.append_record_chunk, name='append_record_chunk'),
     path('replay/<int:exam_id>/', views.replay_exam, name='replay_exam'),
     path('replay/<int:user_id>/<int:exam_id>/', views.replay_user_exam, name='replay_user_exam'),
+    path('replay/record/<int:record_id>/data/', views.replay_data, name='replay_data'),
 
     path('dashboard/', views.dashboard, name='dashboard'),
     path('dashboard/download-features/', views.download_features, name='download_features'),
@@ -25,8 +27,10 @@ urlpatterns = [
     path('dashboard/grade-exam-record/<int:record_id>/', views.grade_exam_record, name='grade_exam_record'),
     path('dashboard/extract-features/', views.extract_features_view, name='extract_features_view'),
     path('dashboard/assign-exam/', views.assign_exam, name='assign_exam'),
+    path('dashboard/request-timings/', views.request_timings, name='request_timings'),
     
     path('dashboard/ajax/extract-features/', views.extract_features_ajax, name='extract_features_ajax'),
+    path('dashboard/ajax/extract-features/<int:job_id>/', views.extraction_job_progress, name='extraction_job_progress'),
     path('dashboard/ajax/create-student/', views.create_student_ajax, name='create_student_ajax'),
     path('dashboard/ajax/create-teacher/', views.create_teacher_ajax, name='create_teacher_ajax'),
     path('dashboard/ajax/create-exam/', views.create_exam_ajax, name='create_exam_ajax'),
@@ -1,20 +1,34 @@
-from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render
 from django.template import RequestContext
 from django.utils import timezone
 from django.urls import reverse
-from django.contrib.auth.decorators import login_required
-from django.views.decorators.http import require_POST
+from django.core.handlers.asgi import ASGIRequest
 from django.http.response import HttpResponseNotFound, HttpResponseBadRequest
-from django.contrib.auth.models import User, Group
+from django.contrib.auth.models import User
+from django.db.models import Count, F, FilteredRelation, Q
 from django.contrib import auth
 from django.utils.translation import gettext as _
+from asgiref.sync import sync_to_async
 
-import json
+import heapq
 import random
 
-from .models import WritingExam, WritingRecord, WritingAssignment, TeacherStudentRelation
-from .extract_features import extract_features
+from .models import WritingExam, WritingRecord, WritingAssignment, TeacherStudentRelation, ExtractionJob
+from .async_views import aget_object_or_404, login_required, require_POST
+from .bulk_accounts import create_student_accounts, create_teacher_accounts
+from .exports import (
+    afeatures_rows, aiter_features_json, aiter_gzip, features_rows, iter_features_json, iter_gzip, record_features_rows,
+)
+from .feature_summary import summarize_features, summary_csv, summary_npz
+from .jobs import enqueue_extraction_job, expire_stale_jobs, job_progress
+from .record_upload import (
+    ChunkError, UploadError, append_chunk, parse_chunk_events, read_compressed_record, save_exam_record,
+)
+from .replay import aget_replay_page
+from .request_timing import clear_timings, timing_summary
+from .roles import TEACHER, WRITING_ADMIN, ahas_group, group_required, has_group
+from .write_queue import arun_serialized, run_serialized
 
 
 @login_required
@@ -29,6 +43,12 @@ def error_message_view(request, message):
     }
     return render(request, 'writing/error_message.html', context)
 
+
+async def aerror_message_view(request, message):
+    """ error_message_view() for the async views, the logout is sync.
+    """
+    return await sync_to_async(error_message_view)(request, message)
+
 @login_required
 def exam(request):
     assignment = WritingAssignment.objects.filter(student=request.user).first()
@@ -39,12 +59,16 @@ def exam(request):
         return error_message_view(request, _("请勿重复进入考试!"))
 
     exam = assignment.exam
-    writing_record = WritingRecord.objects.filter(user=request.user, exam=exam)
-    if writing_record:
+    if WritingRecord.objects.filter(user=request.user, exam=exam).exists():
         return error_message_view(request, _("您已参加过考试，请勿重复参加！"))
 
-    assignment.access_time = timezone.now()
-    assignment.save()
+    # the first access wins if the page is opened twice at the same time
+    accessed = run_serialized(
+        WritingAssignment.objects.filter(pk=assignment.pk, access_time__isnull=True).update,
+        access_time=timezone.now(),
+    )
+    if not accessed:
+        return error_message_view(request, _("请勿重复进入考试!"))
     context = {
         'record': True,
         'exam': exam,
@@ -57,25 +81,79 @@ def thank_you(request):
 
 @login_required
 @require_POST
-def record_exam(request, exam_id):
-    exam = get_object_or_404(WritingExam, pk=exam_id)
-    writing_record = WritingRecord.objects.filter(user=request.user, exam=exam).first()
-    if writing_record:
-        return error_message_view(request, _("您已参加过考试，请勿重复参加！"))
-    record = request.POST['examRecord']
+async def record_exam(request, exam_id):
+    """ Save the record submitted at the end of the exam.
+    Under ASGI, the slow uploads and the queued writes of the submissions don't hold a thread each.
+    """
+    exam = await aget_object_or_404(WritingExam, pk=exam_id)
     article = request.POST['EnglishWriting']
-    writing_record = WritingRecord(user=request.user, exam=exam, article=article, record=record, datetime=timezone.now())
-    writing_record.save()
+    if 'examRecordGzip' in request.FILES:
+        # stored as it is, see record_upload.py
+        try:
+            # decompressing the record to check it takes a while, it's done in a thread
+            record = await sync_to_async(read_compressed_record, thread_sensitive=False)(request.FILES['examRecordGzip'])
+        except UploadError:
+            return await aerror_message_view(request, _("提交失败，请联系老师！"))
+    else:
+        record = request.POST['examRecord']
+    try:
+        # the first events may have been uploaded during the exam, see record_upload.py
+        num_of_chunks = int(request.POST['chunked']) if 'chunked' in request.POST else None
+        # the submissions are written one by one, see write_queue.py
+        writing_record = await arun_serialized(save_exam_record, request.user, exam, article, record, num_of_chunks)
+    except (ChunkError, ValueError, KeyError):
+        return await aerror_message_view(request, _("提交失败，请联系老师！"))
+    if writing_record is None:
+        return await aerror_message_view(request, _("您已参加过考试，请勿重复参加！"))
     return HttpResponseRedirect(reverse('writing:thank_you'))
 
 
 @login_required
-def replay_exam(request, exam_id):
+@require_POST
+def append_record_chunk(request, exam_id):
+    """ Store a chunk of the events of the exam being written, see record_upload.py.
+    Posting the same chunk again is harmless.
+    """
+    if not WritingAssignment.objects.filter(student=request.user, exam_id=exam_id).exists():
+        return HttpResponseBadRequest('Permission denied')
+
+    success = True
+    json_errors = {}
+    stored = False
+    try:
+        seq = int(request.POST['seq'])
+        start_time = int(request.POST['startTime'])
+        events = parse_chunk_events(request.POST['events'])
+    except (KeyError, ValueError) as e:
+        success = False
+        json_errors['message'] = str(e) if isinstance(e, ChunkError) else 'seq, startTime and events are expected'
+    if success:
+        if WritingRecord.objects.filter(user=request.user, exam_id=exam_id).exists():
+            success = False
+            json_errors['message'] = 'The exam is already submitted'
+        else:
+            try:
+                stored = append_chunk(request.user, exam_id, seq, start_time, events)
+            except ChunkError as e:
+                success = False
+                json_errors['message'] = str(e)
+
+    json_return = {
+        'success': success,
+        'errors': json_errors,
+        'stored': stored,
+    }
+    return JsonResponse(json_return)
+
+
+@login_required
+async def replay_exam(request, exam_id):
     # NOTE: we only show one record
-    exam = get_object_or_404(WritingExam, pk=exam_id)
-    writing_record = WritingRecord.objects.filter(user=request.user, exam=exam).first()
+    exam = await aget_object_or_404(WritingExam, pk=exam_id)
+    # the record is fetched page by page by replay_data
+    writing_record = await WritingRecord.objects.filter(user=request.user, exam=exam).only('pk').afirst()
     if not writing_record:
-        return error_message_view(request, _("您还未参加过本考试"))
+        return await aerror_message_view(request, _("您还未参加过本考试"))
     context = {
         'record': False,
         'exam': exam,
@@ -86,11 +164,11 @@ def replay_exam(request, exam_id):
 
 
 @login_required
-def replay_user_exam(request, user_id, exam_id):
+async def replay_user_exam(request, user_id, exam_id):
     # NOTE: we only show one record
-    exam = get_object_or_404(WritingExam, pk=exam_id)
-    user = get_object_or_404(User, pk=user_id)
-    writing_record = WritingRecord.objects.filter(user=user, exam=exam).first()
+    exam = await aget_object_or_404(WritingExam, pk=exam_id)
+    user = await aget_object_or_404(User, pk=user_id)
+    writing_record = await WritingRecord.objects.filter(user=user, exam=exam).only('pk').afirst()
     if not writing_record:
         return HttpResponse(_("该用户还未参加过考试！"))
     context = {
@@ -102,13 +180,42 @@ def replay_user_exam(request, user_id, exam_id):
     return render(request, 'writing/exam.html', context)
 
 
+async def acan_replay(user, student_id):
+    """ Return True if the user may see the records of the student.
+    """
+    return (
+        user.pk == student_id or
+        await ahas_group(user, WRITING_ADMIN) or
+        await TeacherStudentRelation.objects.filter(teacher=user, student_id=student_id).aexists()
+    )
+
+
+@login_required
+async def replay_data(request, record_id):
+    """ Return the article at ?t=<ms since the start> (or after ?event=<number of events>)
+    and the events of the following page, see replay.py.
+    """
+    student_id = await aget_object_or_404(WritingRecord.objects.values_list('user_id', flat=True), pk=record_id)
+    if not await acan_replay(request.user, student_id):
+        return HttpResponseBadRequest('Permission denied')
+    try:
+        time = int(request.GET['t']) if 't' in request.GET else None
+        event = int(request.GET['event']) if 'event' in request.GET else None
+    except ValueError:
+        return HttpResponseBadRequest('Invalid t or event')
+
+    page = await aget_replay_page(record_id, time=time, event=event)
+    page['success'] = True
+    return JsonResponse(page)
+
+
 @login_required
 def dashboard(request):
-    if request.user.groups.filter(name='Writing Admin').exists():
-        teachers = User.objects.filter(groups__name='Teacher').order_by('username')
+    if has_group(request.user, WRITING_ADMIN):
+        teachers = User.objects.filter(groups__name=TEACHER).order_by('username')
     else:
         teachers = []
-    if request.user.groups.filter(name='Teacher').exists():
+    if has_group(request.user, TEACHER):
         students = request.user.my_students.all()
     else:
         students = []
@@ -120,10 +227,8 @@ def dashboard(request):
 
 
 @login_required
+@group_required(WRITING_ADMIN)
 def extract_features_view(request):
-    if not request.user.groups.filter(name='Writing Admin').exists():
-        return HttpResponseBadRequest(_('Permission denied'))
-
     context = {}
     return render(request, 'writing/dashboard/download_data.html', context)
 
@@ -134,61 +239,79 @@ def is_ajax(request):
 
 @login_required
 @require_POST
+@group_required(WRITING_ADMIN)
 def extract_features_ajax(request):
     if not is_ajax(request):
         return HttpResponseBadRequest('Expecting Ajax call')
 
-    if not request.user.groups.filter(name='Writing Admin').exists():
-        return HttpResponseBadRequest('Permission denied')
-
-    cnt_extracted = 0
-    for i, writing_record in enumerate(WritingRecord.objects.all()):
-        if writing_record.user.username.startswith('litest'):
-            continue
-        try:
-            features = extract_features(writing_record)
-        except:
-            print('Extraction error', i, writing_record)
-        else:
-            writing_record.features = json.dumps(features)
-            writing_record.save()
-            cnt_extracted += 1
+    job = enqueue_extraction_job(request.user)
 
     success = True
     json_errors = {}
     json_return = {
         'success': success,
         'errors': json_errors,
-        'cnt_extracted': cnt_extracted,
+        'job_id': job.pk,
+        'progress_url': reverse('writing:extraction_job_progress', args=[job.pk]),
     }
     return JsonResponse(json_return)
 
 
 @login_required
-def download_features(request):
-    if not request.user.groups.filter(name='Writing Admin').exists():
-        return HttpResponseBadRequest('Permission denied')
+@group_required(WRITING_ADMIN)
+def extraction_job_progress(request, job_id):
+    job = get_object_or_404(ExtractionJob, pk=job_id)
+    # so that the page stops polling a job whose process has stopped
+    if job.status in (ExtractionJob.STATUS_QUEUED, ExtractionJob.STATUS_RUNNING) and expire_stale_jobs():
+        job.refresh_from_db()
+    json_return = job_progress(job)
+    json_return['success'] = job.status != ExtractionJob.STATUS_FAILED
+    return JsonResponse(json_return)
 
-    json_res = {}
-    for writing_record in WritingRecord.objects.all():
-        if writing_record.features:
-            json_res[writing_record.user.username] = json.loads(writing_record.features)
 
-    json_res = json.dumps(json_res)
-    resp = HttpResponse(json_res, content_type='application/text;charset=UTF-8')
-    resp['Content-Disposition'] = 'attachment; filename=extracted_features.txt'
+def features_summary_response(export_format):
+    try:
+        records, table = summarize_features(record_features_rows())
+    except ImportError:
+        return HttpResponseBadRequest('NumPy is required for the summary table')
+    if export_format == 'csv':
+        resp = HttpResponse(summary_csv(records, table), content_type='text/csv;charset=UTF-8')
+    else:
+        resp = HttpResponse(summary_npz(records, table), content_type='application/octet-stream')
+    resp['Content-Disposition'] = f'attachment; filename=feature_summary.{export_format}'
+    return resp
+
+
+@login_required
+@group_required(WRITING_ADMIN)
+async def download_features(request):
+    export_format = request.GET.get('format', 'json')
+    if export_format in ('csv', 'npz'):
+        # the summary reads all the features at once
+        return await sync_to_async(features_summary_response)(export_format)
+
+    # under WSGI, an async iterator would be read whole before the response is sent
+    if isinstance(request, ASGIRequest):
+        chunks = aiter_features_json(afeatures_rows())
+        compressed = aiter_gzip
+    else:
+        chunks = iter_features_json(features_rows())
+        compressed = iter_gzip
+    if request.GET.get('gzip'):
+        resp = StreamingHttpResponse(compressed(chunks), content_type='application/gzip')
+        resp['Content-Disposition'] = 'attachment; filename=extracted_features.txt.gz'
+    else:
+        resp = StreamingHttpResponse(chunks, content_type='application/text;charset=UTF-8')
+        resp['Content-Disposition'] = 'attachment; filename=extracted_features.txt'
 
     return resp
 
 
 @login_required
+@group_required(WRITING_ADMIN, TEACHER)
 def create_student(request):
-    if not (request.user.groups.filter(name='Writing Admin').exists() or 
-        request.user.groups.filter(name='Teacher').exists()):
-        return HttpResponseBadRequest('Permission denied')
-
-    if request.user.groups.filter(name='Writing Admin').exists():
-        teachers = User.objects.filter(groups__name='Teacher').order_by('username')
+    if has_group(request.user, WRITING_ADMIN):
+        teachers = User.objects.filter(groups__name=TEACHER).order_by('username')
     else:
         teachers = []
     context = {
@@ -208,7 +331,7 @@ def create_student_ajax(request):
     teacher = None
     has_permission = False
 
-    if not request.user.groups.filter(name='Writing Admin').exists():
+    if not has_group(request.user, WRITING_ADMIN):
         return HttpResponseBadRequest('Permission denied')
     else:
         has_permission = True
@@ -220,7 +343,7 @@ def create_student_ajax(request):
         else:
             teacher = User.objects.get(pk=teacher_id)
     
-    if not (has_permission or request.user.groups.filter(name='Teacher').exists()):
+    if not (has_permission or has_group(request.user, TEACHER)):
         return HttpResponseBadRequest('Permission denied')
     else:
         if not has_permission:
@@ -230,94 +353,67 @@ def create_student_ajax(request):
                 json_errors['message'] = ''
 
     cnt_created = 0
+    skipped = []
     if teacher is not None:
         # print('got teacher', teacher)
         student_ids = request.POST.get('TextareaStudentIDs', '')
         student_ids = student_ids.split()
-        for sid in student_ids:
-            sid = sid.strip()
-            if sid:
-                sname = f'{teacher.username}_{sid}'
-                student = User.objects.filter(username=sname).first()
-                if not student:
-                    student = User.objects.create_user(sname, password=str(sid), first_name=str(sid))
-                    cnt_created += 1
-                    try:
-                        student.teacherstudentrelation
-                    except User.teacherstudentrelation.RelatedObjectDoesNotExist:
-                        teacher.my_students.create(student=student)
+        cnt_created, skipped = create_student_accounts(teacher, [sid.strip() for sid in student_ids if sid.strip()])
 
     json_return = {
         'success': success,
         'errors': json_errors,
         'cnt_created': cnt_created,
+        'skipped': skipped,
     }
     return JsonResponse(json_return)
 
 
 @login_required
+@group_required(WRITING_ADMIN)
 def create_teacher(request):
-    if not request.user.groups.filter(name='Writing Admin').exists():
-        return HttpResponseBadRequest('Permission denied')
     context = {}
     return render(request, 'writing/dashboard/create_teacher.html', context)
 
 
 @login_required
 @require_POST
+@group_required(WRITING_ADMIN)
 def create_teacher_ajax(request):
     if not is_ajax(request):
         return HttpResponseBadRequest('Expecting Ajax call')
 
-    if not request.user.groups.filter(name='Writing Admin').exists():
-        return HttpResponseBadRequest('Permission denied')
-
     success = True
     json_errors = {}
 
-    cnt_created = 0
     # print('got teacher', teacher)
     student_ids = request.POST.get('TextareaStudentIDs', '')
     student_ids = student_ids.split()
-    teacher_group = Group.objects.get(name='Teacher')
-    for sid in student_ids:
-        sid = sid.strip()
-        if sid:
-            sname = sid
-            student = User.objects.filter(username=sname).first()
-            if not student:
-                student = User.objects.create_user(sname, password=str(sid))
-                student.groups.add(teacher_group)
-                student.save()
-                cnt_created += 1
+    cnt_created, skipped = create_teacher_accounts([sid.strip() for sid in student_ids if sid.strip()])
 
     json_return = {
         'success': success,
         'errors': json_errors,
         'cnt_created': cnt_created,
+        'skipped': skipped,
     }
     return JsonResponse(json_return)
 
 
 @login_required
+@group_required(WRITING_ADMIN, TEACHER)
 def create_exam(request):
-    if not (request.user.groups.filter(name='Writing Admin').exists() or 
-        request.user.groups.filter(name='Teacher').exists()):
-        return HttpResponseBadRequest('Permission denied')
-
     context = {}
     return render(request, 'writing/dashboard/create_exam.html', context)
 
 
 @login_required
 @require_POST
+@group_required(WRITING_ADMIN)
 def create_exam_ajax(request):
     if not is_ajax(request):
         return HttpResponseBadRequest('Expecting Ajax call')
 
-    if not request.user.groups.filter(name='Writing Admin').exists():
-        return HttpResponseBadRequest('Permission denied')
-
     success = True
     json_errors = {}
 
@@ -351,11 +447,8 @@ def create_exam_ajax(request):
 
 
 @login_required
+@group_required(WRITING_ADMIN, TEACHER)
 def edit_exam(request, exam_id):
-    if not (request.user.groups.filter(name='Writing Admin').exists() or 
-        request.user.groups.filter(name='Teacher').exists()):
-        return HttpResponseBadRequest('Permission denied')
-
     exam = get_object_or_404(WritingExam, pk=exam_id)
     context = {
         'exam': exam,
@@ -365,13 +458,11 @@ def edit_exam(request, exam_id):
 
 @login_required
 @require_POST
+@group_required(WRITING_ADMIN)
 def edit_exam_ajax(request, exam_id):
     if not is_ajax(request):
         return HttpResponseBadRequest('Expecting Ajax call')
 
-    if not request.user.groups.filter(name='Writing Admin').exists():
-        return HttpResponseBadRequest('Permission denied')
-
     success = True
     json_errors = {}
 
@@ -414,11 +505,8 @@ def edit_exam_ajax(request, exam_id):
 
 
 @login_required
+@group_required(WRITING_ADMIN, TEACHER)
 def exam_list(request):
-    if not (request.user.groups.filter(name='Writing Admin').exists() or 
-        request.user.groups.filter(name='Teacher').exists()):
-        return HttpResponseBadRequest('Permission denied')
-    
     exams = WritingExam.objects.all()
     context = {
         'exams': exams,
@@ -427,53 +515,57 @@ def exam_list(request):
 
 
 @login_required
+@group_required(WRITING_ADMIN, TEACHER)
 def exam_record_list(request):
-    if not (request.user.groups.filter(name='Writing Admin').exists() or 
-        request.user.groups.filter(name='Teacher').exists()):
-        return HttpResponseBadRequest('Permission denied')
-
-    if request.user.groups.filter(name='Writing Admin').exists():
-        teachers = User.objects.filter(groups__name='Teacher').order_by('username')
-        students = []
-        for teacher in teachers:
-            students.extend(sorted([x.student for x in teacher.my_students.all()], key=lambda x: x.username))
+    is_admin = has_group(request.user, WRITING_ADMIN)
+    relations = TeacherStudentRelation.objects.select_related('teacher', 'student', 'student__writingassignment__exam')
+    if is_admin:
+        relations = relations.filter(teacher__groups__name=TEACHER).order_by('teacher__username', 'student__username')
     else:
-        if request.user.groups.filter(name='Teacher').exists():
-            teacher = request.user
-            students = [x.student for x in teacher.my_students.all()]
-            students.sort(key=lambda x: x.username)
+        if has_group(request.user, TEACHER):
+            relations = relations.filter(teacher=request.user).order_by('student__username')
         else:
             return HttpResponseBadRequest('Permission denied')
 
-    # NOTE: this one should be careful, because there might be multiple 
-    # records for one student on one exam,
-    # although we try to prevent this in the view.py
+    # one left join on the record of the assigned exam: a student has at most one record for an exam
+    # (see the constraint of WritingRecord). Only the columns we show are read (never the record or the article).
+    relations = relations.annotate(
+        assigned_record=FilteredRelation(
+            'student__writingassignment__exam__writingrecord',
+            condition=Q(student__writingassignment__exam__writingrecord__user=F('student')),
+        ),
+    ).annotate(
+        record_id=F('assigned_record__pk'),
+        record_score=F('assigned_record__score'),
+        record_datetime=F('assigned_record__datetime'),
+    )
+
     exam_records = []
-    exams = []
-    for student in students:
+    for relation in relations:
         try:
-            exam = student.writingassignment.exam
+            exam = relation.student.writingassignment.exam
         except User.writingassignment.RelatedObjectDoesNotExist:
             exam = None
-        exams.append(exam)
-        if exam is not None:
-            exam_records.append(WritingRecord.objects.filter(user=student, exam=exam).first())
-        else:
-            exam_records.append(None)
+        exam_records.append((
+            relation.teacher,
+            relation.student,
+            exam,
+            relation.record_id,
+            relation.record_score,
+            relation.record_datetime,
+        ))
 
     context = {
-        'exam_records': zip(students, exams, exam_records),
+        'is_admin': is_admin,
+        'exam_records': exam_records,
     }
     return render(request, 'writing/dashboard/exam_record_list.html', context)
 
 
 @login_required
+@group_required(WRITING_ADMIN, TEACHER)
 def grade_exam_record(request, record_id):
-    if not (request.user.groups.filter(name='Writing Admin').exists() or 
-        request.user.groups.filter(name='Teacher').exists()):
-        return HttpResponseBadRequest('Permission denied')
-    
-    record = get_object_or_404(WritingRecord, pk=record_id)
+    record = get_object_or_404(WritingRecord.objects.select_related('user', 'exam'), pk=record_id)
     context = {
         'record': record,
     }
@@ -482,14 +574,11 @@ def grade_exam_record(request, record_id):
 
 @login_required
 @require_POST
+@group_required(WRITING_ADMIN, TEACHER)
 def grade_exam_record_ajax(request, record_id):
     if not is_ajax(request):
         return HttpResponseBadRequest('Expecting Ajax call')
 
-    if not (request.user.groups.filter(name='Writing Admin').exists() or 
-        request.user.groups.filter(name='Teacher').exists()):
-        return HttpResponseBadRequest('Permission denied')
-
     success = True
     json_errors = {}
     
@@ -501,9 +590,9 @@ def grade_exam_record_ajax(request, record_id):
         exam_score = int(exam_score)
     
     if success:
-        record = get_object_or_404(WritingRecord, pk=record_id)
+        record = get_object_or_404(WritingRecord.objects.only('pk'), pk=record_id)
         record.score = exam_score
-        record.save()
+        record.save(update_fields=['score'])
 
     json_return = {
         'success': success,
@@ -512,44 +601,82 @@ def grade_exam_record_ajax(request, record_id):
     return JsonResponse(json_return)
 
 
+def choose_balanced_exams(exam_ids, num_of_students):
+    """ Return the exams of num_of_students new assignments (in random order), such that
+    the numbers of students of the exams, including the current assignments, are as even as possible.
+    """
+    counts = dict.fromkeys(exam_ids, 0)
+    for exam_id, count in WritingAssignment.objects.filter(exam_id__in=exam_ids).values_list('exam').annotate(
+        count=Count('pk')
+    ):
+        counts[exam_id] = count
+
+    # ties are broken randomly
+    heap = [(count, random.random(), exam_id) for exam_id, count in counts.items()]
+    heapq.heapify(heap)
+    chosen = []
+    for _ in range(num_of_students):
+        count, _tie, exam_id = heapq.heappop(heap)
+        chosen.append(exam_id)
+        heapq.heappush(heap, (count + 1, random.random(), exam_id))
+    random.shuffle(chosen)
+    return chosen
+
+
 @login_required
+@group_required(WRITING_ADMIN)
 def assign_exam(request):
-    if not request.user.groups.filter(name='Writing Admin').exists():
-        return HttpResponseBadRequest('Permission denied')
-
     context = {}
     return render(request, 'writing/dashboard/assign_exam.html', context)
 
 
 @login_required
 @require_POST
+@group_required(WRITING_ADMIN)
 def assign_exam_ajax(request):
     if not is_ajax(request):
         return HttpResponseBadRequest('Expecting Ajax call')
 
-    if not request.user.groups.filter(name='Writing Admin').exists():
-        return HttpResponseBadRequest('Permission denied')
-
-    teachers = User.objects.filter(groups__name='Teacher').order_by('username')
-    students = []
-    for teacher in teachers:
-        students.extend(sorted([x.student for x in teacher.my_students.all()], key=lambda x: x.username))
-    cnt_newly_assigned = 0
-    all_exams = list(WritingExam.objects.all())
-    for student in students:
-        try:
-            exam_assignment = student.writingassignment
-        except User.writingassignment.RelatedObjectDoesNotExist:
-            cnt_newly_assigned += 1
-            exam = random.choice(all_exams)
-            WritingAssignment.objects.create(student=student, exam=exam)
+    relations = TeacherStudentRelation.objects.filter(teacher__groups__name=TEACHER)
+    cnt_assigned = relations.count()
+    unassigned_student_ids = list(relations.filter(student__writingassignment__isnull=True).order_by(
+        'teacher__username', 'student__username'
+    ).values_list('student_id', flat=True))
+    all_exams = list(WritingExam.objects.values_list('pk', flat=True))
 
     success = True
     json_errors = {}
+    cnt_newly_assigned = 0
+    if unassigned_student_ids and not all_exams:
+        success = False
+        json_errors['message'] = 'There is no exam to assign!'
+    elif unassigned_student_ids:
+        if request.POST.get('balanced'):
+            exam_ids = choose_balanced_exams(all_exams, len(unassigned_student_ids))
+        else:
+            exam_ids = [random.choice(all_exams) for _ in unassigned_student_ids]
+        WritingAssignment.objects.bulk_create([
+            WritingAssignment(student_id=student_id, exam_id=exam_id)
+            for student_id, exam_id in zip(unassigned_student_ids, exam_ids)
+        ])
+        cnt_newly_assigned = len(unassigned_student_ids)
+
     json_return = {
         'success': success,
         'errors': json_errors,
         'cnt_newly_assigned': cnt_newly_assigned,
-        'cnt_assigned': len(students),
+        'cnt_assigned': cnt_assigned,
+    }
+    return JsonResponse(json_return)
+
+
+@login_required
+@group_required(WRITING_ADMIN)
+def request_timings(request):
+    if request.method == 'POST':
+        clear_timings()
+        return HttpResponseRedirect(reverse('writing:request_timings'))
+    context = {
+        'timings': timing_summary(),
     }
-    return JsonResponse(json_return)
\ No newline at end of file
+    return render(request, 'writing/dashboard/request_timings.html', context)
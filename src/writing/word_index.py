@@ -0,0 +1,91 @@
+# coding=utf-8
+""" Word counts over ranges of a text which is edited, without copying or splitting the text again.
+
+The words are counted as count_num_of_words() counts them: the maximal runs of chars which are
+neither whitespace nor one of ',.?!;:'. For two strings x and y,
+
+    words(x + y) = words(x) + words(y) - (1 if x ends and y starts with a word char)
+
+so a Fenwick tree over the blocks of the Document (see document.py) gives the number of words
+before any block in O(log(number of blocks)), and is updated with the blocks.
+"""
+import re
+
+from .document import Document, FenwickTree
+
+_WORD = re.compile(r'[^,.?!;:\s]+')
+
+
+def is_word_char(char):
+    return not (char in ',.?!;:' or char.isspace())
+
+
+def count_words(text):
+    """ Same as count_num_of_words(text).
+    """
+    return len(_WORD.findall(text))
+
+
+def _joined_chars(last_char, first_char):
+    return int(bool(last_char) and bool(first_char) and is_word_char(last_char) and is_word_char(first_char))
+
+
+class WordBoundaryIndex(Document):
+    """ A Document which also counts the words of any range.
+    """
+    __slots__ = ('block_words', 'words')
+
+    def _joined(self, j):
+        """ Return 1 if a word goes on from the block j-1 to the block j.
+        """
+        return int(j > 0 and is_word_char(self.blocks[j-1][-1]) and is_word_char(self.blocks[j][0]))
+
+    def _build(self, blocks):
+        super()._build(blocks)
+        self.block_words = [count_words(block) for block in blocks]
+        # the words of block j not already counted in block j-1
+        self.words = FenwickTree(self.block_words[j] - self._joined(j) for j in range(len(blocks)))
+
+    def _replace_in_block(self, j, start, end, text):
+        # with block == before + deleted + after, only count the words of the edited chars
+        block = self.blocks[j]
+        before_char = block[start-1] if start else ''
+        after_char = block[end] if end < len(block) else ''
+
+        def edited_words(content):
+            """ words(before + content + after) - words(before) - words(after)
+            """
+            if not content:
+                return -_joined_chars(before_char, after_char)
+            return count_words(content) - _joined_chars(before_char, content[0]) - _joined_chars(content[-1], after_char)
+
+        # the joins with the previous and the next blocks may change too
+        updated = range(j, min(j+2, len(self.blocks)))
+        old_contributions = [self.block_words[i] - self._joined(i) for i in updated]
+        self.block_words[j] += edited_words(text) - edited_words(block[start:end])
+        super()._replace_in_block(j, start, end, text)
+        for i, old_contribution in zip(updated, old_contributions):
+            self.words.add(i, self.block_words[i] - self._joined(i) - old_contribution)
+
+    def count_prefix_words(self, position):
+        """ Number of words of text[:position].
+        """
+        if position <= 0 or not self.blocks:
+            return 0
+        j, offset = self._locate(position)
+        prefix = self.blocks[j][:offset]
+        count = self.words.prefix_sum(j) + count_words(prefix)
+        if prefix and j > 0 and is_word_char(self.blocks[j-1][-1]) and is_word_char(prefix[0]):
+            count -= 1
+        return count
+
+    def count_words(self, start, end):
+        """ Number of words of text[start:end], i.e. count_num_of_words(text[start:end]).
+        """
+        if start >= end:
+            return 0
+        count = self.count_prefix_words(end) - self.count_prefix_words(start)
+        # a word cut at start is counted in both prefixes
+        if start > 0 and is_word_char(self[start-1]) and is_word_char(self[start]):
+            count += 1
+        return count
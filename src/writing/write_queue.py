@@ -0,0 +1,77 @@
+# coding=utf-8
+""" Serialized writes of the exam views.
+
+SQLite has one writer at a time: when many requests write at once, e.g. when every student
+submits in the last minute of an exam, they wait for the lock, and fail with "database is locked"
+after the timeout of the database. run_serialized() runs the writes one after the other in a single
+thread of the process instead, each one in a transaction, so they never wait for each other.
+The writes of other processes (e.g. `manage.py run_worker`) are still covered by the timeout.
+
+When settings.WRITING_SERIALIZED_WRITES is False, the writes are run in the request thread.
+The async views await arun_serialized() instead, which doesn't hold a thread while the write waits.
+
+The transactions of the writes are started by immediate_atomic(), which takes the write lock at once
+with the SQLite backend of the app (see backends/sqlite3/base.py).
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='serialized-write')
+_in_write_thread = threading.local()
+
+
+def run_serialized(func, *args, **kwargs):
+    """ Return func(*args, **kwargs), run in a transaction by the write thread, after the writes queued before.
+    The exceptions of func are raised here.
+    """
+    if not getattr(settings, 'WRITING_SERIALIZED_WRITES', True) or getattr(_in_write_thread, 'value', False):
+        return _run_atomic(func, args, kwargs)
+    return _executor.submit(_run_in_thread, func, args, kwargs).result()
+
+
+async def arun_serialized(func, *args, **kwargs):
+    """ run_serialized() for the async views.
+    """
+    if not getattr(settings, 'WRITING_SERIALIZED_WRITES', True):
+        return await sync_to_async(_run_atomic)(func, args, kwargs)
+    return await asyncio.wrap_future(_executor.submit(_run_in_thread, func, args, kwargs))
+
+
+@contextmanager
+def immediate_atomic():
+    """ transaction.atomic() for a transaction which reads and then writes. With the SQLite backend of the app,
+    the transaction takes the write lock when it starts, so that it waits for the other writers instead of
+    failing when it writes. Other backends ignore it.
+    """
+    connection = transaction.get_connection()
+    previous = getattr(connection, 'immediate_transactions', False)
+    connection.immediate_transactions = True
+    try:
+        with transaction.atomic():
+            yield
+    finally:
+        connection.immediate_transactions = previous
+
+
+def _run_atomic(func, args, kwargs):
+    with immediate_atomic():
+        return func(*args, **kwargs)
+
+
+def _run_in_thread(func, args, kwargs):
+    _in_write_thread.value = True
+    # as at the start of a request, the connection of the thread may have expired (CONN_MAX_AGE)
+    close_old_connections()
+    return _run_atomic(func, args, kwargs)
+
+
+def close_write_connections():
+    """ Close the connections of the write thread, e.g. before deleting the database.
+    """
+    _executor.submit(connections.close_all).result()